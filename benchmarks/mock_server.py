@@ -0,0 +1,284 @@
+import json
+import re
+import threading
+import time
+
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .synthetic import bot_username, format_time
+
+
+# Optional pull request fields and the text that shows they were requested
+optional_fields = {
+    'mergeable': 'mergeable',
+    'commits': 'commits(',
+    'reviews': 'reviews(',
+    'reviewRequests': 'reviewRequests(',
+    'comments': 'comments(',
+}
+
+# Connections of which only the last few items are returned with a pull request
+windowed_connections = ('reviews', 'reviewRequests', 'comments')
+
+
+class MockGitHub(object):
+    """
+    Minimal stand-in for the GitHub GraphQL API, serving a fixed set of pull
+    requests.
+
+    Queries are not parsed, instead the operation is recognised from the query
+    text. Supported are the queries and mutations sent by GitHubClient: the
+    viewer login, cursor paginated pull requests (optionally of several aliased
+    repositories), searches for pull requests by creation time, pull requests
+    by number or ID, earlier items of reviews, review requests and comments
+    (aliased by pull request), issues by number (any issue exists) and
+    (aliased) addComment mutations.
+    """
+
+    def __init__(self, pull_requests, latency=0.0, owner='mantidproject', name='mantid'):
+        """
+        @param pull_requests List of pull requests to serve
+        @param latency Seconds added to the handling of every request
+        @param owner Owner of the served repository
+        @param name Name of the served repository
+        """
+        self.pull_requests = pull_requests
+        self.latency = latency
+        self.repository = (owner, name)
+        self.by_id = {pr['id']: pr for pr in pull_requests}
+        self.by_number = {pr['number']: pr for pr in pull_requests}
+
+        # Creation times are not part of the served pull requests, unless
+        # given they are spread evenly in order of number up to now
+        now = datetime.utcnow().replace(microsecond=0)
+        newest = max(self.by_number.keys()) if pull_requests else 0
+        self.created = {pr['number']: pr.get('createdAt', None) or format_time(
+            now - timedelta(hours=6 * (newest - pr['number'] + 1))) for pr in pull_requests}
+
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.bytes_sent = 0
+        self.comments = []
+        self.remaining = {}
+        self.requests_by_token = Counter()
+        self.comments_by_token = Counter()
+
+    def project(self, pr, query):
+        """
+        Removes the fields of a pull request that were not requested.
+        """
+        projected = {}
+        for k, v in pr.items():
+            if k in optional_fields and optional_fields[k] not in query:
+                continue
+            if k in windowed_connections:
+                v = self.window(v['nodes'], len(v['nodes']), 10)
+            projected[k] = v
+        return projected
+
+    def window(self, nodes, end, size):
+        """
+        Gets the items of a connection before a cursor (the index of an item).
+        """
+        start = max(0, end - size)
+        return {
+            'totalCount': len(nodes),
+            'pageInfo': {'hasPreviousPage': start > 0, 'startCursor': str(start)},
+            'nodes': nodes[start:end],
+        }
+
+    def page(self, query, variables, owner, name, cursor=None):
+        if (owner, name) != self.repository:
+            return None
+
+        prs = self.pull_requests
+        if variables.get('states', None):
+            prs = [pr for pr in prs if pr['state'] in variables['states']]
+        if (variables.get('order_by', None) or {}).get('field', None) == 'UPDATED_AT':
+            prs = sorted(prs, key=lambda pr: pr['updatedAt'],
+                         reverse=variables['order_by']['direction'] == 'DESC')
+
+        start = int(cursor) if cursor else 0
+        end = start + variables['page_size']
+        return {'pullRequests': {
+            'pageInfo': {'hasNextPage': end < len(prs), 'endCursor': str(end)},
+            'nodes': [self.project(pr, query) for pr in prs[start:end]],
+        }}
+
+    def span(self, owner, name):
+        if (owner, name) != self.repository:
+            return None
+
+        created = [self.created[pr['number']] for pr in self.pull_requests
+                   if pr['state'] == 'OPEN']
+        return {'pullRequests': {
+            'totalCount': len(created),
+            'nodes': [{'createdAt': min(created)}] if created else [],
+        }}
+
+    def search(self, query, variables):
+        terms = dict(t.split(':', 1) for t in variables['search'].split() if ':' in t)
+        first, last = terms['created'].split('..')
+
+        prs = []
+        if tuple(terms['repo'].split('/')) == self.repository:
+            prs = [pr for pr in self.pull_requests if pr['state'] == 'OPEN' and
+                   (first == '*' or self.created[pr['number']] >= first) and
+                   (last == '*' or self.created[pr['number']] <= last)]
+
+        # As GitHub, only the first 1000 results can be paged through
+        reachable = prs[:1000]
+        cursor = variables.get('cursor', None)
+        start = int(cursor) if cursor else 0
+        end = start + variables['page_size']
+        return {
+            'issueCount': len(prs),
+            'pageInfo': {'hasNextPage': end < len(reachable), 'endCursor': str(end)},
+            'nodes': [self.project(pr, query) for pr in reachable[start:end]],
+        }
+
+    def add_comment(self, pr_id, message):
+        """
+        Adds a comment by the bot to a pull request.
+        """
+        self.comments.append((pr_id, message))
+        pr = self.by_id.get(pr_id, None)
+        if pr is not None and 'comments' in pr:
+            pr['comments']['nodes'].append({
+                'author': {'login': bot_username},
+                'body': message,
+                'createdAt': format_time(datetime.utcnow()),
+            })
+
+    def execute(self, query, variables, token=None):
+        """
+        Executes a query.
+
+        @param query GraphQL query string
+        @param variables GraphQL variables
+        @param token Access token the query was sent with (each has its own
+                     rate limit budget)
+        @return Response data
+        """
+        data = {}
+
+        with self.lock:
+            self.requests_by_token[token] += 1
+
+        if 'addComment' in query:
+            with self.lock:
+                self.comments_by_token[token] += 1
+                if 'pr_id' in variables:
+                    self.add_comment(variables['pr_id'], variables['message'])
+                    data['addComment'] = {'subject': {'id': variables['pr_id']}}
+                i = 0
+                while 'pr_id{}'.format(i) in variables:
+                    pr_id = variables['pr_id{}'.format(i)]
+                    self.add_comment(pr_id, variables['message{}'.format(i)])
+                    data['c{}'.format(i)] = {'subject': {'id': pr_id}}
+                    i += 1
+            return data
+
+        if re.search(r'\bviewer\s*\{', query):
+            data['viewer'] = {'login': bot_username}
+        elif 'node(id:' in query:
+            for i, name, size in re.findall(
+                    r'p(\d+): node\(id: \$id\d+\) \{\s*\.\.\. on PullRequest \{\s*'
+                    r'(\w+)\(last: (\d+), before', query):
+                pr = self.by_id.get(variables['id{}'.format(i)], None)
+                data['p{}'.format(i)] = {name: self.window(
+                    pr[name]['nodes'], int(variables['cursor{}'.format(i)]), int(size))
+                } if pr else None
+        elif 'nodes(ids:' in query:
+            data['nodes'] = [self.project(self.by_id[i], query) if i in self.by_id else None
+                             for i in variables['ids']]
+        elif 'issue(number:' in query:
+            data['repository'] = {'issue': {
+                'id': 'I_{}'.format(variables['number']),
+                'number': variables['number'],
+                'url': 'https://github.com/{}/{}/issues/{}'.format(
+                    self.repository[0], self.repository[1], variables['number']),
+            }} if (variables['repo_owner'], variables['repo_name']) == self.repository else None
+        elif 'pullRequest(number:' in query:
+            pr = self.by_number.get(variables['number'], None)
+            data['repository'] = {'pullRequest': self.project(pr, query) if pr else None}
+        elif 'owner0' in variables:
+            i = 0
+            while 'owner{}'.format(i) in variables:
+                data['r{}'.format(i)] = self.page(
+                    query, variables, variables['owner{}'.format(i)],
+                    variables['name{}'.format(i)])
+                i += 1
+        elif 'search(' in query:
+            data['search'] = self.search(query, variables)
+        elif 'CREATED_AT' in query:
+            data['repository'] = self.span(variables['repo_owner'], variables['repo_name'])
+        elif 'pullRequests(' in query:
+            data['repository'] = self.page(query, variables, variables['repo_owner'],
+                                           variables['repo_name'], variables.get('cursor'))
+
+        if 'rateLimit' in query:
+            with self.lock:
+                self.remaining[token] = self.remaining.get(token, 5000) - 1
+                data['rateLimit'] = {'cost': 1, 'remaining': self.remaining[token],
+                                     'resetAt': '2100-01-01T00:00:00Z'}
+
+        return data
+
+
+class MockGitHubServer(object):
+    """
+    Local HTTP server exposing a MockGitHub as a GraphQL endpoint.
+    """
+
+    def __init__(self, mock, host='127.0.0.1', port=0):
+        self.mock = mock
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                request = json.loads(body.decode('utf-8'))
+
+                if mock.latency:
+                    time.sleep(mock.latency)
+
+                authorization = self.headers.get('Authorization', '')
+                token = authorization[len('Bearer '):] if authorization.startswith('Bearer ') \
+                    else None
+                result = {'data': mock.execute(request['query'], request['variables'] or {},
+                                               token)}
+                response = json.dumps(result).encode('utf-8')
+
+                with mock.lock:
+                    mock.request_count += 1
+                    mock.bytes_sent += len(response)
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def endpoint(self):
+        return 'http://{}:{}/graphql'.format(*self.server.server_address)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
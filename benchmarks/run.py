@@ -0,0 +1,107 @@
+import json
+import time
+
+from collections import OrderedDict
+
+import click
+
+from mantid_pr_bot import columnar
+from mantid_pr_bot.github import GitHubClient
+from mantid_pr_bot.ratelimit import RateLimiter
+from mantid_pr_bot.resolutions import generate_resolution_comments
+from mantid_pr_bot.workflow import filter_prs
+
+from .mock_server import MockGitHub, MockGitHubServer
+from .synthetic import generate_pull_requests
+
+
+def timed(results, phase, func, *args, **kwargs):
+    start = time.perf_counter()
+    value = func(*args, **kwargs)
+    results[phase] = time.perf_counter() - start
+    return value
+
+
+def run_benchmark(count, latency, stale_days, seed, post_workers, post_batch_size):
+    """
+    Times each phase of a run against a mock GitHub serving synthetic pull
+    requests.
+
+    @return Ordered dictionary of measurement name to value
+    """
+    results = OrderedDict()
+    results['pull_requests'] = count
+
+    mock = MockGitHub(generate_pull_requests(count, seed), latency=latency)
+    with MockGitHubServer(mock) as server:
+        client = GitHubClient('benchmark', 'mantidproject', 'mantid', endpoint=server.endpoint)
+
+        prs = timed(results, 'fetch', client.fetch_pull_requests)
+        results['fetch_requests'] = mock.request_count
+        results['fetch_bytes'] = mock.bytes_sent
+
+        filtered_prs = timed(results, 'filter_prs', filter_prs, prs, stale_days)
+
+        # Not part of the total, the columnar path is only used for analytics
+        if columnar.np is not None:
+            table = timed(results, 'columnar_table', columnar.FeatureTable, prs)
+            timed(results, 'columnar_filter', columnar.filter_table, table, stale_days)
+            if columnar.check_equivalence(prs, stale_days):
+                raise RuntimeError('Columnar classification differs from filter_prs')
+        comments = timed(results, 'generate_comments', generate_resolution_comments,
+                         filtered_prs)
+        results['comments'] = len(comments)
+
+        request_count = mock.request_count
+        timed(results, 'post', client.post_comments_on_pull_requests, comments,
+              workers=post_workers, rate_limiter=RateLimiter(0, None, None),
+              batch_size=post_batch_size)
+        results['post_requests'] = mock.request_count - request_count
+
+        client.transport.close()
+
+    results['total'] = sum(results[p] for p in
+                           ('fetch', 'filter_prs', 'generate_comments', 'post'))
+    return results
+
+
+@click.command()
+@click.option('--counts', type=str, default='100,1000,10000',
+              help='Comma separated numbers of pull requests to benchmark with.')
+@click.option('--latency', type=float, default=0.0,
+              help='Seconds of latency added to every mock API request.')
+@click.option('--stale-days', type=int, default=14,
+              help='Number of days of inactivity after which a pull request is stale.')
+@click.option('--seed', type=int, default=0,
+              help='Seed used to generate pull requests.')
+@click.option('--post-workers', type=int, default=4,
+              help='Number of comment requests to send concurrently.')
+@click.option('--post-batch-size', type=int, default=10,
+              help='Number of comments posted in a single request.')
+@click.option('--output', type=click.File('w'),
+              help='File to write results to as JSON.')
+def main(counts, latency, stale_days, seed, post_workers, post_batch_size, output):
+    """
+    Benchmarks fetching, classifying, comment generation and posting against a
+    local mock of the GitHub GraphQL API.
+    """
+    all_results = []
+    for count in [int(c) for c in counts.split(',')]:
+        results = run_benchmark(count, latency, stale_days, seed, post_workers,
+                                post_batch_size)
+        all_results.append(results)
+
+        click.echo('{} pull requests:'.format(count))
+        for name, value in results.items():
+            if isinstance(value, float):
+                click.echo('  {:<20} {:10.4f} s'.format(name, value))
+            else:
+                click.echo('  {:<20} {:10}'.format(name, value))
+        click.echo()
+
+    if output:
+        json.dump(all_results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
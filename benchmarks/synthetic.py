@@ -0,0 +1,97 @@
+import json
+import random
+
+from datetime import datetime, timedelta
+
+
+developers = ['dev{}'.format(i) for i in range(60)]
+reviewers = ['reviewer{}'.format(i) for i in range(20)]
+bot_username = 'mantid-bot'
+
+review_states = ['APPROVED', 'COMMENTED', 'PENDING', 'CHANGES_REQUESTED', 'DISMISSED']
+review_state_weights = [30, 40, 10, 15, 5]
+
+
+def format_time(t):
+    return t.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def generate_pull_request(number, now, rng):
+    """
+    Generates a single synthetic pull request in the same shape as those
+    returned by GitHubClient.fetch_pull_requests (with every review and
+    comment, i.e. as after GitHubClient.complete_pull_requests).
+
+    @param number Pull request number
+    @param now Time the pull requests are generated relative to
+    @param rng random.Random instance
+    @return Pull request
+    """
+    updated = now - timedelta(seconds=int(rng.expovariate(1.0 / (20 * 86400))))
+
+    author = rng.choice(developers)
+    committer = author if rng.random() < 0.9 else rng.choice(developers)
+    author_user = {'login': author} if rng.random() < 0.97 else None
+
+    reviews = []
+    for _ in range(min(25, int(rng.expovariate(0.5)))):
+        reviews.append({
+            'state': rng.choices(review_states, review_state_weights)[0],
+            'author': {'login': rng.choice(reviewers)},
+        })
+
+    review_requests = [{'requestedReviewer': {'login': r}}
+                       for r in rng.sample(reviewers, rng.choice([0, 0, 0, 1, 1, 2]))]
+
+    comments = []
+    comment_time = updated - timedelta(days=rng.randint(0, 30))
+    for _ in range(min(25, int(rng.expovariate(0.3)))):
+        comment_time += timedelta(hours=rng.randint(1, 48))
+        if rng.random() < 0.1:
+            login = bot_username
+            body = '@{} can you take a look at this?\n<!-- {} -->'.format(
+                author, json.dumps({'problem_type': rng.choice(['failing', 'conflicting'])}))
+        else:
+            login = rng.choice(developers + reviewers)
+            body = ' '.join(rng.choice(['looks', 'good', 'needs', 'a', 'test', 'None', 'fix'])
+                            for _ in range(rng.randint(5, 200)))
+        comments.append({
+            'author': {'login': login},
+            'body': body,
+            'createdAt': format_time(comment_time),
+        })
+
+    return {
+        'id': 'MDExOlB1bGxSZXF1ZXN0{}'.format(number),
+        'number': number,
+        'state': 'OPEN',
+        'updatedAt': format_time(updated),
+        'url': 'https://github.com/mantidproject/mantid/pull/{}'.format(number),
+        'mergeable': rng.choices(['MERGEABLE', 'CONFLICTING', 'UNKNOWN'], [75, 20, 5])[0],
+        'commits': {'nodes': [{'commit': {
+            'oid': '{:040x}'.format(rng.getrandbits(160)),
+            'author': {'user': author_user},
+            'committer': {'user': {'login': committer}},
+            'status': {'state': rng.choices(['SUCCESS', 'FAILURE', 'PENDING'],
+                                            [65, 25, 10])[0]},
+        }}]},
+        'reviews': {'nodes': reviews},
+        'reviewRequests': {'nodes': review_requests},
+        'comments': {'nodes': comments},
+    }
+
+
+def generate_pull_requests(count, seed=0, now=None):
+    """
+    Generates a set of synthetic open pull requests.
+
+    @param count Number of pull requests (e.g. 100 to 100000)
+    @param seed Random seed, the same seed always gives the same pull requests
+    @param now Time the pull requests are generated relative to (defaults to now)
+    @return List of pull requests ordered by number
+    """
+    rng = random.Random(seed)
+    if now is None:
+        now = datetime.utcnow().replace(microsecond=0)
+
+    return [generate_pull_request(number, now, rng) for number in range(1, count + 1)]
@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+
+from . import jsoncodec
+
+
+class PullRequestCache(object):
+    """
+    On-disk JSON store of open pull requests, keyed by pull request ID.
+
+    The watermark is the most recent updatedAt timestamp seen, any pull request
+    updated on or after it must be fetched again on the next run.
+
+    Note that some changes (such as a new CI status) do not change the
+    updatedAt time of a pull request, these will only be picked up once the
+    pull request is otherwise updated or the cache is cleared.
+    """
+
+    format_version = 1
+
+    def __init__(self, filename, repository, fields=None):
+        """
+        @param filename Path to the cache file
+        @param repository Repository the cache belongs to ("owner/name")
+        @param fields Pull request fields that are fetched (see github.PULL_REQUEST_FIELDS)
+        """
+        self.filename = filename
+        self.repository = repository
+        self.fields = sorted(fields) if fields is not None else None
+        self.watermark = None
+        self._prs = {}
+
+    @classmethod
+    def load(cls, filename, repository, fields=None):
+        """
+        Loads a cache from disk.
+
+        A missing file, or one created for a different repository, set of
+        fields or by an incompatible version, results in an empty cache.
+
+        @param filename Path to the cache file
+        @param repository Repository the cache belongs to ("owner/name")
+        @param fields Pull request fields that are fetched (see github.PULL_REQUEST_FIELDS)
+        @return PullRequestCache
+        """
+        cache = cls(filename, repository, fields)
+
+        try:
+            with open(filename, 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return cache
+
+        if data.get('version') == cls.format_version and \
+                data.get('repository') == repository and \
+                data.get('fields') == cache.fields:
+            cache.watermark = data['watermark']
+            cache._prs = data['pull_requests']
+
+        return cache
+
+    def save(self):
+        """
+        Writes the cache to disk, replacing the file atomically.
+        """
+        data = {
+            'version': self.format_version,
+            'repository': self.repository,
+            'fields': self.fields,
+            'watermark': self.watermark,
+            'pull_requests': self._prs,
+        }
+
+        tmp_filename = '{}.tmp'.format(self.filename)
+        with open(tmp_filename, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_filename, self.filename)
+
+    def clear(self):
+        """
+        Removes all pull requests, forcing a full fetch on the next run.
+        """
+        self.watermark = None
+        self._prs = {}
+
+    def replace(self, pull_requests):
+        """
+        Replaces the contents of the cache with a complete set of open pull
+        requests.
+
+        @param pull_requests List of all open pull requests
+        """
+        self.clear()
+        self.update(pull_requests)
+
+    def update(self, pull_requests):
+        """
+        Merges changed pull requests into the cache.
+
+        Open pull requests are added or replaced, any that are no longer open
+        are removed.
+
+        @param pull_requests List of pull requests updated since the watermark
+        """
+        for pr in pull_requests:
+            if pr.get('state', 'OPEN') == 'OPEN':
+                self._prs[pr['id']] = pr
+            else:
+                self._prs.pop(pr['id'], None)
+
+            if self.watermark is None or pr['updatedAt'] > self.watermark:
+                self.watermark = pr['updatedAt']
+
+    def pull_requests(self):
+        """
+        Gets all cached open pull requests.
+
+        @return List of pull requests ordered by number
+        """
+        return sorted(self._prs.values(), key=lambda pr: pr['number'])
+
+    def __len__(self):
+        return len(self._prs)
+
+
+def make_response_key(endpoint, query, variables, identity=None):
+    """
+    Gets the key a reply is cached under.
+
+    Queries are normalised by collapsing whitespace, so differently indented
+    but otherwise identical queries share replies.
+
+    @param endpoint GraphQL API endpoint
+    @param query GraphQL query string
+    @param variables GraphQL variables
+    @param identity Access token, for queries whose reply depends on who sends
+                    them (None if it does not)
+    @return Key string
+    """
+    key = json.dumps([endpoint, ' '.join(query.split()), variables, identity],
+                     sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(object):
+    """
+    In memory cache of replies to read only queries (see
+    GitHubClient.send_query).
+
+    Replies expire a fixed time after they were received and the least
+    recently used are evicted once the cache is full. Replies are stored
+    serialised, so callers are free to modify the replies they are given.
+    """
+
+    def __init__(self, ttl=600.0, max_entries=1000):
+        """
+        @param ttl Seconds a reply can be served from the cache for
+        @param max_entries Maximum number of replies held
+        """
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        @param key Key of the reply (see make_response_key)
+        @return Reply, None if it is not cached or has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and entry[0] <= time.time():
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return jsoncodec.loads(entry[1])
+
+    def set(self, key, reply):
+        """
+        @param key Key of the reply (see make_response_key)
+        @param reply Reply to cache
+        """
+        data = jsoncodec.dumps(reply)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DiskResponseCache(ResponseCache):
+    """
+    ResponseCache kept in an SQLite database, so replies are reused between
+    runs.
+    """
+
+    def __init__(self, filename, ttl=600.0, max_entries=10000):
+        """
+        @param filename Path to the SQLite database
+        @param ttl Seconds a reply can be served from the cache for
+        @param max_entries Maximum number of replies held
+        """
+        super(DiskResponseCache, self).__init__(ttl, max_entries)
+        self._db = sqlite3.connect(filename, timeout=30.0, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, '
+                'reply BLOB NOT NULL, '
+                'expires REAL NOT NULL, '
+                'last_used REAL NOT NULL)')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+
+    def close(self):
+        self._db.close()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute('SELECT reply FROM responses WHERE key = ? AND expires > ?',
+                                   (key, now)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._db.execute('UPDATE responses SET last_used = ? WHERE key = ?', (now, key))
+            self.hits += 1
+        return jsoncodec.loads(zlib.decompress(row[0]))
+
+    def set(self, key, reply):
+        data = zlib.compress(jsoncodec.dumps(reply))
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, reply, expires, last_used) '
+                'VALUES (?, ?, ?, ?)', (key, data, now + self.ttl, now))
+
+            # Drop expired replies, then the least recently used beyond the limit
+            self._db.execute('DELETE FROM responses WHERE expires <= ?', (now,))
+            self._db.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM responses '
+                'ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM responses')
@@ -0,0 +1,183 @@
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+
+from .filtering import has_pr_not_been_updated_since
+from .records import PullRequestRecord, ReviewState
+
+
+PullRequestFeatures = namedtuple('PullRequestFeatures', [
+    'elapsed_days',
+    'no_developer',
+    'conflicting',
+    'ci_state',
+    'review_count',
+    'review_request_count',
+    'has_pending_review',
+    'has_changes_requested',
+    'all_reviews_approved',
+])
+
+
+Classification = namedtuple('Classification', ['categories', 'matches'])
+
+
+def extract_features(pr, now=None):
+    """
+    Extracts everything the problem category predicates need from a pull
+    request, walking the nested response data only once (or reading it
+    directly from a PullRequestRecord).
+
+    Features are what the predicates in filtering.py are evaluated against,
+    fields that were not fetched (see workflow.category_fields) are treated as
+    being empty:
+        - elapsed_days: whole days since the PR was last updated
+        - no_developer: author of the last commit is not a GitHub user
+        - conflicting: PR cannot be merged due to conflicts
+        - ci_state: CI status of the last commit ('' if there is none)
+        - review_count: number of reviews that are not just comments
+        - review_request_count: number of outstanding review requests
+        - has_pending_review: at least one review is pending
+        - has_changes_requested: at least one review requested changes
+        - all_reviews_approved: all reviews are approvals or comments
+
+    @param pr Pull request or PullRequestRecord
+    @param now Time to measure staleness from (defaults to now)
+    @return PullRequestFeatures
+    """
+    return extract_features_with_age(pr, elapsed_days_since_update(pr, now))
+
+
+def elapsed_days_since_update(pr, now=None):
+    """
+    Gets the number of whole days since a pull request was last updated.
+
+    GitHub timestamps are in UTC, so now is a naive UTC datetime.
+
+    @param pr Pull request or PullRequestRecord
+    @param now UTC time to measure from (defaults to now)
+    @return Number of days
+    """
+    if now is None:
+        now = datetime.utcnow()
+
+    if isinstance(pr, PullRequestRecord):
+        return pr.elapsed_days(now)
+
+    ref_time = datetime.strptime(pr['updatedAt'], "%Y-%m-%dT%H:%M:%SZ")
+    return (now - ref_time).days
+
+
+def _nodes(pr, field):
+    # Fields that were not fetched are treated as empty
+    connection = pr.get(field, None)
+    return connection['nodes'] if connection else []
+
+
+def extract_features_with_age(pr, elapsed_days):
+    """
+    Extracts the features of a pull request (see extract_features) whose age
+    is already known, e.g. from having checked whether it is stale.
+
+    @param pr Pull request or PullRequestRecord
+    @param elapsed_days Whole days since the PR was last updated (see
+                        elapsed_days_since_update)
+    @return PullRequestFeatures
+    """
+    if isinstance(pr, PullRequestRecord):
+        return _extract_record_features(pr, elapsed_days)
+
+    try:
+        last_commit = pr['commits']['nodes'][0]['commit']
+    except (KeyError, IndexError, TypeError):
+        last_commit = None
+
+    try:
+        no_developer = len(last_commit['author']['user']['login']) == 0
+    except TypeError:
+        no_developer = True
+
+    try:
+        ci_state = last_commit['status']['state']
+    except (KeyError, TypeError):
+        ci_state = ''
+
+    review_count = 0
+    has_pending_review = False
+    has_changes_requested = False
+    all_reviews_approved = True
+    for r in _nodes(pr, 'reviews'):
+        state = r['state']
+        if state != 'COMMENTED':
+            review_count += 1
+        if state == 'PENDING':
+            has_pending_review = True
+        elif state == 'CHANGES_REQUESTED':
+            has_changes_requested = True
+        if state != 'APPROVED' and state != 'COMMENTED':
+            all_reviews_approved = False
+
+    return PullRequestFeatures(
+        elapsed_days=elapsed_days,
+        no_developer=no_developer,
+        conflicting=pr.get('mergeable', None) == 'CONFLICTING',
+        ci_state=ci_state,
+        review_count=review_count,
+        review_request_count=len(_nodes(pr, 'reviewRequests')),
+        has_pending_review=has_pending_review,
+        has_changes_requested=has_changes_requested,
+        all_reviews_approved=all_reviews_approved)
+
+
+def _extract_record_features(record, elapsed_days):
+    states = record.review_states
+    return PullRequestFeatures(
+        elapsed_days=elapsed_days,
+        no_developer=not record.author,
+        conflicting=record.mergeable == 'CONFLICTING',
+        ci_state=record.ci_state,
+        review_count=len(states) - states.count(ReviewState.COMMENTED),
+        review_request_count=len(record.requested_reviewers),
+        has_pending_review=ReviewState.PENDING in states,
+        has_changes_requested=ReviewState.CHANGES_REQUESTED in states,
+        all_reviews_approved=all(
+            s == ReviewState.APPROVED or s == ReviewState.COMMENTED for s in states))
+
+
+def classify_prs(all_prs, categories, stale_days_threshold, now=None):
+    """
+    Sorts pull requests into problem categories in a single pass.
+
+    Features of each pull request are extracted once and every category
+    predicate is evaluated against them. Pull requests that are not stale are
+    discarded before any other features are extracted.
+
+    @param all_prs Iterable of pull requests (or PullRequestRecords)
+    @param categories List of (category name, predicate over PullRequestFeatures)
+    @param stale_days_threshold Number of days of inactivity after which a PR is "stale"
+    @param now UTC time to measure staleness from (defaults to now)
+    @return Classification of category name to list of pull requests and PR
+            number to tuple of matched category names
+    """
+    if now is None:
+        now = datetime.utcnow()
+
+    sorted_prs = OrderedDict((name, []) for name, _ in categories)
+    matches = {}
+
+    for pr in all_prs:
+        elapsed_days = elapsed_days_since_update(pr, now)
+        if not has_pr_not_been_updated_since(stale_days_threshold, elapsed_days):
+            matches[pr['number']] = ()
+            continue
+
+        features = extract_features_with_age(pr, elapsed_days)
+
+        matched = []
+        for name, predicate in categories:
+            if predicate(features):
+                sorted_prs[name].append(pr)
+                matched.append(name)
+
+        matches[pr['number']] = tuple(matched)
+
+    return Classification(sorted_prs, matches)
@@ -0,0 +1,255 @@
+"""
+Columnar, NumPy backed representation of a set of pull requests, for
+classifying large numbers of pull requests (e.g. historical snapshots) by
+evaluating the problem category predicates over whole columns at once.
+
+NumPy is optional, FeatureTable raises an ImportError if it is not installed.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .classify import PullRequestFeatures, classify_prs
+from .filtering import has_pr_not_been_updated_since
+from .records import EPOCH, PullRequestRecord, ReviewState
+from . import workflow
+
+
+class FeatureTable(object):
+    """
+    Features of a set of pull requests (see classify.PullRequestFeatures),
+    held as one array per feature.
+
+    Columns:
+        - updated_at: time last updated, in seconds since the epoch
+        - mergeable: codes into the mergeable_labels list
+        - ci_state: codes into the ci_state_labels list
+        - no_developer: author of the last commit is not a GitHub user
+        - review_states: number of reviews in each ReviewState (one column per state)
+        - review_request_count: number of outstanding review requests
+    """
+
+    def __init__(self, pull_requests):
+        """
+        @param pull_requests Iterable of pull requests (or PullRequestRecords)
+        """
+        if np is None:
+            raise ImportError('NumPy is required for columnar classification')
+
+        self.pull_requests = list(pull_requests)
+
+        updated_at = []
+        timestamps = []
+        mergeable = []
+        ci_state = []
+        no_developer = []
+        review_states = []
+        review_request_count = []
+
+        for pr in self.pull_requests:
+            if isinstance(pr, PullRequestRecord):
+                updated_at.append(pr.updated_at)
+                mergeable.append(pr.mergeable)
+                ci_state.append(pr.ci_state)
+                no_developer.append(not pr.author)
+                review_states.append(pr.review_states)
+                review_request_count.append(len(pr.requested_reviewers))
+                continue
+
+            # Timestamps are parsed all at once below (without the trailing
+            # "Z", which NumPy does not accept)
+            timestamps.append((len(updated_at), pr['updatedAt'][:-1]))
+            updated_at.append(0)
+            mergeable.append(pr.get('mergeable', None))
+
+            try:
+                commit = pr['commits']['nodes'][0]['commit']
+            except (KeyError, IndexError, TypeError):
+                commit = {}
+            ci_state.append((commit.get('status', None) or {}).get('state', ''))
+            user = (commit.get('author', None) or {}).get('user', None)
+            no_developer.append(not (user and user['login']))
+
+            reviews = (pr.get('reviews', None) or {}).get('nodes', [])
+            review_states.append([ReviewState.__members__.get(r['state'], ReviewState.OTHER)
+                                  for r in reviews])
+            review_request_count.append(
+                len((pr.get('reviewRequests', None) or {}).get('nodes', [])))
+
+        count = len(self.pull_requests)
+
+        self.updated_at = np.array(updated_at, dtype=np.int64)
+        if timestamps:
+            indices, text = zip(*timestamps)
+            self.updated_at[list(indices)] = \
+                np.array(text, dtype='datetime64[s]').astype(np.int64)
+
+        self.mergeable, self.mergeable_labels = _categorical(mergeable)
+        self.ci_state, self.ci_state_labels = _categorical(ci_state)
+        self.no_developer = np.array(no_developer, dtype=bool)
+        self.review_request_count = np.array(review_request_count, dtype=np.int32)
+
+        self.review_states = np.zeros((count, len(ReviewState)), dtype=np.int32)
+        for i, states in enumerate(review_states):
+            for s in states:
+                self.review_states[i, s] += 1
+
+    def __len__(self):
+        return len(self.pull_requests)
+
+    def mergeable_is(self, value):
+        """
+        @return Boolean array, true where the mergeable state is value
+        """
+        return _equals(self.mergeable, self.mergeable_labels, value)
+
+    def ci_state_is(self, value):
+        """
+        @return Boolean array, true where the CI state is value
+        """
+        return _equals(self.ci_state, self.ci_state_labels, value)
+
+    def review_count(self, state=None):
+        """
+        @param state ReviewState to count (None for all reviews)
+        @return Array of the number of reviews of each pull request
+        """
+        if state is None:
+            return self.review_states.sum(axis=1)
+        return self.review_states[:, state]
+
+    def elapsed_days(self, now=None):
+        """
+        Gets the number of whole days since each pull request was last updated,
+        as classify.elapsed_days_since_update.
+
+        @param now Naive UTC datetime to measure from (defaults to now)
+        @return Array of number of days
+        """
+        if now is None:
+            now = datetime.utcnow()
+
+        # Whole microseconds keep the result exact, as timedelta.days
+        now_us = (now - EPOCH) // timedelta(microseconds=1)
+        return (now_us - self.updated_at * 1000000) // (86400 * 1000000)
+
+    def features(self, now=None):
+        """
+        Gets the features of all pull requests, as classify.extract_features
+        but with an array (or, for ci_state, a column comparing equal
+        elementwise) in place of each value, which the predicates in
+        filtering.py evaluate to a boolean array.
+
+        @param now Naive UTC datetime to measure staleness from (defaults to now)
+        @return PullRequestFeatures
+        """
+        review_count = self.review_count() - self.review_count(ReviewState.COMMENTED)
+        return PullRequestFeatures(
+            elapsed_days=self.elapsed_days(now),
+            no_developer=self.no_developer,
+            conflicting=self.mergeable_is('CONFLICTING'),
+            ci_state=_CategoricalColumn(self.ci_state, self.ci_state_labels),
+            review_count=review_count,
+            review_request_count=self.review_request_count,
+            has_pending_review=self.review_count(ReviewState.PENDING) > 0,
+            has_changes_requested=self.review_count(ReviewState.CHANGES_REQUESTED) > 0,
+            all_reviews_approved=(review_count == self.review_count(ReviewState.APPROVED)))
+
+
+class _CategoricalColumn(object):
+
+    def __init__(self, codes, labels):
+        self.codes = codes
+        self.labels = labels
+
+    def __eq__(self, value):
+        return _equals(self.codes, self.labels, value)
+
+    def __ne__(self, value):
+        return ~_equals(self.codes, self.labels, value)
+
+    __hash__ = None
+
+
+def _categorical(values):
+    labels = []
+    codes = {}
+    column = []
+    for v in values:
+        if v not in codes:
+            codes[v] = len(labels)
+            labels.append(v)
+        column.append(codes[v])
+    return np.array(column, dtype=np.int16), labels
+
+
+def _equals(column, labels, value):
+    if value not in labels:
+        return np.zeros(len(column), dtype=bool)
+    return column == labels.index(value)
+
+
+def filter_table(table, stale_days_threshold, enabled_categories=None, now=None):
+    """
+    Sorts the pull requests of a FeatureTable into problem categories, as
+    workflow.filter_prs, evaluating each of workflow.categories once over the
+    whole table.
+
+    @param table FeatureTable
+    @param stale_days_threshold Number of days of inactivity after which a PR is "stale"
+    @param enabled_categories Names of the categories to evaluate (defaults to all)
+    @param now Time to measure staleness from (defaults to now)
+    @return Dictionary of problem type to list of affected pull requests
+    """
+    features = table.features(now)
+    stale = has_pr_not_been_updated_since(stale_days_threshold, features.elapsed_days)
+
+    sorted_prs = OrderedDict()
+    for name, predicate in workflow.categories:
+        if enabled_categories is not None and name not in enabled_categories:
+            continue
+        sorted_prs[name] = [table.pull_requests[i]
+                            for i in np.flatnonzero(stale & predicate(features))]
+
+    return sorted_prs
+
+
+def check_equivalence(all_prs, stale_days_threshold, enabled_categories=None, now=None):
+    """
+    Compares the columnar classification of pull requests with their
+    classification one at a time (classify.classify_prs), both evaluating
+    workflow.categories.
+
+    @param all_prs List of pull requests (or PullRequestRecords)
+    @param stale_days_threshold Number of days of inactivity after which a PR is "stale"
+    @param enabled_categories Names of the categories to evaluate (defaults to all)
+    @param now Time to measure staleness from (defaults to now)
+    @return List of (category name, PR numbers only found one at a time, PR
+            numbers only found by the columnar classification), empty if both
+            agree
+    """
+    if now is None:
+        now = datetime.utcnow()
+
+    active = workflow.categories
+    if enabled_categories is not None:
+        active = [c for c in active if c[0] in enabled_categories]
+
+    scalar = classify_prs(all_prs, active, stale_days_threshold, now).categories
+    vectorised = filter_table(FeatureTable(all_prs), stale_days_threshold,
+                              enabled_categories, now)
+
+    differences = []
+    for name in scalar:
+        expected = [pr['number'] for pr in scalar[name]]
+        actual = [pr['number'] for pr in vectorised.get(name, [])]
+        if expected != actual:
+            differences.append((name, sorted(set(expected) - set(actual)),
+                                sorted(set(actual) - set(expected))))
+
+    return differences
@@ -0,0 +1,417 @@
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from queue import Queue, Empty
+from socketserver import ThreadingMixIn
+
+import click
+
+from . import resolutions, workflow
+from .github import GitHubClient
+from .ratelimit import RateLimiter
+from .records import parse_pull_request
+from .resolutions import generate_resolution_comments
+from .workflow import classify_stale_prs, filter_prs
+
+
+# Webhook events that can change the category of a pull request
+handled_events = ('pull_request', 'pull_request_review', 'status', 'issue_comment')
+
+
+class PullRequestIndex(object):
+    """
+    In-memory index of open pull requests (as PullRequestRecords), keyed by
+    pull request number.
+    """
+
+    def __init__(self):
+        self._prs = {}
+
+    def replace(self, pull_requests):
+        """
+        Replaces the contents of the index.
+
+        @param pull_requests Iterable of open PullRequestRecords
+        """
+        self._prs = {pr['number']: pr for pr in pull_requests}
+
+    def update(self, pr):
+        """
+        Adds or replaces a pull request.
+        """
+        self._prs[pr['number']] = pr
+
+    def remove(self, number):
+        """
+        Removes a pull request (if it is in the index).
+        """
+        self._prs.pop(number, None)
+
+    def get(self, number):
+        return self._prs.get(number, None)
+
+    def numbers_with_head(self, sha):
+        """
+        Gets the numbers of the pull requests whose last commit has a given SHA.
+
+        @param sha Commit SHA
+        @return List of pull request numbers
+        """
+        return [number for number, pr in self._prs.items() if pr.commit_oid == sha]
+
+    def values(self):
+        return list(self._prs.values())
+
+    def __len__(self):
+        return len(self._prs)
+
+
+def get_affected_pull_requests(event, payload, index):
+    """
+    Works out which pull requests are affected by a webhook event.
+
+    @param event Event type (value of the X-GitHub-Event header)
+    @param payload Decoded event payload
+    @param index PullRequestIndex (used to map commit statuses to pull requests)
+    @return Tuple of (numbers of pull requests to refresh, numbers of pull
+            requests to remove)
+    """
+    if event == 'pull_request':
+        if payload.get('action', None) == 'closed':
+            return [], [payload['number']]
+        return [payload['number']], []
+
+    if event == 'pull_request_review':
+        return [payload['pull_request']['number']], []
+
+    if event == 'issue_comment':
+        # Comments on issues are also delivered, only those on PRs matter
+        if 'pull_request' in payload['issue']:
+            return [payload['issue']['number']], []
+        return [], []
+
+    if event == 'status':
+        return index.numbers_with_head(payload['sha']), []
+
+    return [], []
+
+
+def verify_signature(secret, body, signature):
+    """
+    Checks the X-Hub-Signature-256 header of a webhook delivery.
+
+    @param secret Webhook secret
+    @param body Raw request body
+    @param signature Value of the signature header
+    @return True if the signature is valid
+    """
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest('sha256={}'.format(digest), signature or '')
+
+
+def log(message):
+    click.echo('[{}] {}'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), message))
+
+
+class Daemon(object):
+    """
+    Keeps an index of open pull requests up to date from webhook events and
+    periodically checks them for staleness.
+
+    Only the pull requests touched by an event are fetched again, the periodic
+    check works entirely from the index. Pull requests are held as compact
+    PullRequestRecords to keep the memory used by the index low.
+    """
+
+    def __init__(self, client, stale_days, check_interval, enabled_categories=None,
+                 do_commenting=False, post_interval=1.0, post_batch_size=10, record_dir=None):
+        """
+        @param client GitHubClient for the repository being watched
+        @param stale_days Number of days of inactivity after which a PR is "stale"
+        @param check_interval Number of seconds between staleness checks
+        @param enabled_categories Names of the categories to evaluate (defaults to all)
+        @param do_commenting If comments should be posted on stale pull requests
+        @param post_interval Minimum number of seconds between comments
+        @param post_batch_size Number of comments posted in a single request
+        @param record_dir Directory in which to record received events (optional)
+        """
+        self.client = client
+        self.stale_days = stale_days
+        self.check_interval = check_interval
+        self.enabled_categories = enabled_categories
+        self.do_commenting = do_commenting
+        self.rate_limiter = RateLimiter(post_interval)
+        self.post_batch_size = post_batch_size
+        self.record_dir = record_dir
+
+        self.repository = '{repo_owner}/{repo_name}'.format(**client.variables)
+        self.index = PullRequestIndex()
+        self.events = Queue()
+        # Webhook requests are handled on their own threads, events are
+        # numbered and queued under this lock so that records replay in order
+        self._record_lock = threading.Lock()
+        self._record_count = 0
+
+        # Pull request ID to the updatedAt time at which it was last commented
+        # on, so the same update is never nagged about twice
+        self.notified = {}
+
+    def load(self):
+        """
+        Populates the index with all open pull requests.
+        """
+        self.index.replace(parse_pull_request(pr) for pr in self.client.iter_pull_requests())
+        log('Indexed {} open pull requests'.format(len(self.index)))
+
+    def enqueue(self, event, payload):
+        """
+        Queues a webhook event for processing.
+        """
+        with self._record_lock:
+            if self.record_dir:
+                self._record_count += 1
+                filename = os.path.join(
+                    self.record_dir, '{:06d}-{}.json'.format(self._record_count, event))
+                with open(filename, 'w') as f:
+                    json.dump({'event': event, 'payload': payload}, f)
+
+            self.events.put((event, payload))
+
+    def handle_event(self, event, payload):
+        """
+        Updates the index for a webhook event.
+
+        @param event Event type
+        @param payload Decoded event payload
+        """
+        repository = payload.get('repository', {}).get('full_name', None)
+        if repository is not None and repository.lower() != self.repository.lower():
+            return
+
+        refresh, remove = get_affected_pull_requests(event, payload, self.index)
+
+        for number in remove:
+            self.index.remove(number)
+            log('#{} closed, removed from index'.format(number))
+
+        for number in refresh:
+            self.refresh(number)
+
+    def refresh(self, number):
+        """
+        Fetches a pull request again and re-classifies it.
+
+        @param number Pull request number
+        """
+        pr = self.client.fetch_pull_request(number)
+        if pr is None or pr['state'] != 'OPEN':
+            self.index.remove(number)
+            log('#{} no longer open, removed from index'.format(number))
+            return
+
+        pr = parse_pull_request(pr)
+        self.index.update(pr)
+
+        matches = classify_stale_prs(
+                [pr], self.stale_days, self.enabled_categories).matches[number]
+        log('#{} refreshed ({})'.format(number, ', '.join(matches) or 'not stale'))
+
+    def check(self):
+        """
+        Classifies all indexed pull requests, commenting on newly stale ones if
+        commenting is enabled.
+
+        @return List of (pull request, comment text) tuples for pull requests
+                not yet commented on since their last update
+        """
+        filtered_prs = filter_prs(self.index.values(), self.stale_days, self.enabled_categories)
+        log('Staleness check: {}'.format(', '.join(
+            ['{} {}'.format(name, len(prs)) for name, prs in filtered_prs.items()])))
+
+        comments = [c for c in generate_resolution_comments(filtered_prs)
+                    if self.notified.get(c[0]['id'], None) != c[0]['updatedAt']]
+
+        if self.do_commenting and comments:
+            results = self.client.post_comments_on_pull_requests(
+                    comments, rate_limiter=self.rate_limiter, batch_size=self.post_batch_size)
+            for pr, success, error in results:
+                if success:
+                    self.notified[pr['id']] = pr['updatedAt']
+                else:
+                    log('#{} comment failed: {}'.format(pr['number'], error))
+            log('Posted {} comments'.format(len([r for r in results if r[1]])))
+
+        return comments
+
+    def process_events(self, stop_event):
+        """
+        Processes queued events until stopped, running staleness checks at the
+        configured interval.
+
+        @param stop_event threading.Event used to stop processing
+        """
+        # Webhooks keep being accepted for as long as the server runs, so no
+        # error may end processing: it fails the one event or check instead
+        next_check = time.monotonic()
+        while not stop_event.is_set():
+            if time.monotonic() >= next_check:
+                try:
+                    self.check()
+                except Exception as e:
+                    log('Staleness check failed: {}: {}'.format(type(e).__name__, e))
+                next_check = time.monotonic() + self.check_interval
+
+            try:
+                event, payload = self.events.get(timeout=min(
+                    1.0, max(0.0, next_check - time.monotonic())))
+            except Empty:
+                continue
+
+            try:
+                self.handle_event(event, payload)
+            except Exception as e:
+                log('Failed to handle {} event: {}: {}'.format(event, type(e).__name__, e))
+
+    def replay(self, directory):
+        """
+        Processes events previously recorded with record_dir, in order.
+
+        @param directory Directory of recorded events
+        @return Number of events replayed
+        """
+        filenames = sorted(f for f in os.listdir(directory) if f.endswith('.json'))
+        for filename in filenames:
+            with open(os.path.join(directory, filename), 'r') as f:
+                recorded = json.load(f)
+            self.handle_event(recorded['event'], recorded['payload'])
+        return len(filenames)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_webhook_handler(daemon, secret=None):
+    """
+    Creates a request handler class that queues webhook deliveries on a
+    daemon.
+
+    @param daemon Daemon to queue events on
+    @param secret Webhook secret used to verify deliveries (optional)
+    @return BaseHTTPRequestHandler subclass
+    """
+    class WebhookHandler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+
+            if secret and not verify_signature(
+                    secret, body, self.headers.get('X-Hub-Signature-256', None)):
+                self.send_response(401)
+                self.end_headers()
+                return
+
+            event = self.headers.get('X-GitHub-Event', None)
+            if event in handled_events:
+                try:
+                    payload = json.loads(body.decode('utf-8'))
+                except ValueError:
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+                daemon.enqueue(event, payload)
+
+            # Respond straight away, events are processed in the background
+            self.send_response(202)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return WebhookHandler
+
+
+@click.command()
+@click.option('--token', type=str, required=True,
+              help='GitHub Personal Access token.')
+@click.option('--stale-days', type=int, default=14,
+              help='Number of days of inactivity after which a pull request is stale.')
+@click.option('--org', type=str, default='mantidproject',
+              help='User/Organisation that owns the repository.')
+@click.option('--repo', type=str, default='mantid',
+              help='Repository to operate on.')
+@click.option('--endpoint', type=str, default='https://api.github.com/graphql',
+              help='GitHub GraphQL API endpoint.')
+@click.option('--category', 'categories', multiple=True,
+              type=click.Choice([c[0] for c in workflow.categories]),
+              help='Problem category to check (may be repeated, defaults to all).')
+@click.option('--host', type=str, default='127.0.0.1',
+              help='Address to listen for webhook deliveries on.')
+@click.option('--port', type=int, default=8080,
+              help='Port to listen for webhook deliveries on.')
+@click.option('--secret', type=str, envvar='WEBHOOK_SECRET',
+              help='Webhook secret used to verify deliveries.')
+@click.option('--check-interval', type=int, default=3600,
+              help='Seconds between staleness checks.')
+@click.option('--do-commenting', is_flag=True,
+              help='Comment on pull requests found by staleness checks.')
+@click.option('--post-interval', type=float, default=1.0,
+              help='Minimum number of seconds between two comments.')
+@click.option('--post-batch-size', type=int, default=10,
+              help='Number of comments posted in a single request.')
+@click.option('--record', 'record_dir', type=click.Path(file_okay=False, exists=True),
+              help='Directory in which to record received webhook events.')
+@click.option('--replay', 'replay_dir', type=click.Path(file_okay=False, exists=True),
+              help='Replay recorded webhook events, run a single check and exit.')
+def main(token, stale_days, org, repo, endpoint, categories, host, port, secret, check_interval,
+         do_commenting, post_interval, post_batch_size, record_dir, replay_dir):
+    """
+    Long running version of mantid_pr_bot driven by GitHub webhooks.
+
+    Open pull requests are indexed once at startup, after which only pull
+    requests touched by pull_request, pull_request_review, status and
+    issue_comment events are fetched again. Staleness is checked against the
+    index at a regular interval.
+    """
+    categories = list(categories) or [c[0] for c in workflow.categories]
+    fields = workflow.get_required_fields(categories) | \
+        resolutions.get_required_fields(categories) | {'commits'}
+
+    client = GitHubClient(token, org, repo, fields=fields, endpoint=endpoint)
+    daemon = Daemon(client, stale_days, check_interval, categories, do_commenting,
+                    post_interval, post_batch_size, record_dir)
+    daemon.load()
+
+    if replay_dir:
+        log('Replayed {} events'.format(daemon.replay(replay_dir)))
+        for pr, message in daemon.check():
+            click.echo('#{} ({})'.format(pr['number'], pr['url']))
+            click.echo(message)
+            click.echo()
+        return
+
+    stop_event = threading.Event()
+    worker = threading.Thread(target=daemon.process_events, args=(stop_event,))
+    worker.start()
+
+    server = ThreadingHTTPServer((host, port), make_webhook_handler(daemon, secret))
+    log('Listening for webhooks on {}:{}'.format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stop_event.set()
+        worker.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,356 @@
-import json
+import re
 import requests
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from textwrap import dedent
 
 import click
 
+from . import jsoncodec
+from .cache import make_response_key
+from .classify import elapsed_days_since_update
+from .ratelimit import RateLimiter, TokenPool, adapt_page_size
+from .records import format_timestamp, parse_timestamp
+from .transport import Transport
+
+
+# Optional fields of a pull request and the GraphQL selection used to fetch
+# them. The ID, number, state, last update time and URL are always fetched.
+PULL_REQUEST_FIELDS = OrderedDict([
+    ('mergeable', """
+        mergeable
+    """),
+    ('commits', """
+        commits(last: 1) {
+            nodes {
+                commit {
+                    oid
+                    author {
+                        user {
+                            login
+                        }
+                    }
+                    committer {
+                        user {
+                            login
+                        }
+                    }
+                    status {
+                        state
+                    }
+                }
+            }
+        }
+    """),
+    ('reviews', """
+        reviews(last: 10) {
+            totalCount
+            pageInfo {
+                hasPreviousPage
+                startCursor
+            }
+            nodes {
+                state
+                author {
+                    login
+                }
+            }
+        }
+    """),
+    ('reviewRequests', """
+        reviewRequests(last: 10) {
+            totalCount
+            pageInfo {
+                hasPreviousPage
+                startCursor
+            }
+            nodes {
+                requestedReviewer {
+                    ... on User {
+                        login
+                    }
+                }
+            }
+        }
+    """),
+    ('comments', """
+        comments(last: 10) {
+            totalCount
+            pageInfo {
+                hasPreviousPage
+                startCursor
+            }
+            nodes {
+                author {
+                    login
+                }
+                body
+                createdAt
+            }
+        }
+    """),
+])
+
+# Connections of which only the last few items are fetched with a pull request,
+# the rest are fetched only when needed (see GitHubClient.complete_pull_requests)
+WINDOWED_CONNECTIONS = ('reviews', 'reviewRequests', 'comments')
+
+
+def build_pull_request_selection(fields):
+    """
+    Builds the GraphQL selection set for a pull request.
+
+    @param fields Collection of optional field names (keys of PULL_REQUEST_FIELDS)
+    @return Selection set string
+    """
+    unknown = set(fields) - set(PULL_REQUEST_FIELDS.keys())
+    if unknown:
+        raise ValueError('Unknown pull request fields: {}'.format(', '.join(sorted(unknown))))
+
+    selection = ['id', 'number', 'state', 'updatedAt', 'url']
+    selection += [dedent(s).strip() for f, s in PULL_REQUEST_FIELDS.items() if f in fields]
+    return '\n'.join(selection)
+
+
+def build_pull_request_page_query(fields):
+    """
+    Builds a query for a page of pull requests of a repository.
+
+    @param fields Collection of optional field names (keys of PULL_REQUEST_FIELDS)
+    @return Query string
+    """
+    return \
+        """
+        query($repo_owner: String!, $repo_name: String!, $page_size: Int!, $cursor: String,
+              $states: [PullRequestState!], $order_by: IssueOrder) {
+            rateLimit {
+                cost
+                remaining
+                resetAt
+            }
+            repository(owner: $repo_owner, name: $repo_name) {
+                pullRequests(first: $page_size, after: $cursor, states: $states,
+                             orderBy: $order_by) {
+                    pageInfo {
+                        hasNextPage
+                        endCursor
+                    }
+                    nodes {
+        """ + build_pull_request_selection(fields) + """
+                    }
+                }
+            }
+        }
+        """
+
+
+def build_pull_request_nodes_query(fields):
+    """
+    Builds a query for a list of pull requests given their IDs.
+
+    @param fields Collection of optional field names (keys of PULL_REQUEST_FIELDS)
+    @return Query string
+    """
+    return \
+        """
+        query($ids: [ID!]!) {
+            rateLimit {
+                cost
+                remaining
+                resetAt
+            }
+            nodes(ids: $ids) {
+                ... on PullRequest {
+        """ + build_pull_request_selection(fields) + """
+                }
+            }
+        }
+        """
+
+
+def build_single_pull_request_query(fields):
+    """
+    Builds a query for a single pull request of a repository, given its number.
+
+    @param fields Collection of optional field names (keys of PULL_REQUEST_FIELDS)
+    @return Query string
+    """
+    return \
+        """
+        query($repo_owner: String!, $repo_name: String!, $number: Int!) {
+            rateLimit {
+                cost
+                remaining
+                resetAt
+            }
+            repository(owner: $repo_owner, name: $repo_name) {
+                pullRequest(number: $number) {
+        """ + build_pull_request_selection(fields) + """
+                }
+            }
+        }
+        """
+
+
+def build_pull_request_search_query(fields):
+    """
+    Builds a query for a page of pull requests matching a search.
+
+    @param fields Collection of optional field names (keys of PULL_REQUEST_FIELDS)
+    @return Query string
+    """
+    return \
+        """
+        query($search: String!, $page_size: Int!, $cursor: String) {
+            rateLimit {
+                cost
+                remaining
+                resetAt
+            }
+            search(query: $search, type: ISSUE, first: $page_size, after: $cursor) {
+                issueCount
+                pageInfo {
+                    hasNextPage
+                    endCursor
+                }
+                nodes {
+                    ... on PullRequest {
+        """ + build_pull_request_selection(fields) + """
+                    }
+                }
+            }
+        }
+        """
+
+
+def build_open_pull_request_span_query():
+    """
+    Builds a query for the number of open pull requests of a repository and
+    the creation time of the oldest of them.
+
+    @return Query string
+    """
+    return \
+        """
+        query($repo_owner: String!, $repo_name: String!) {
+            rateLimit {
+                cost
+                remaining
+                resetAt
+            }
+            repository(owner: $repo_owner, name: $repo_name) {
+                pullRequests(first: 1, states: [OPEN],
+                             orderBy: {field: CREATED_AT, direction: ASC}) {
+                    totalCount
+                    nodes {
+                        createdAt
+                    }
+                }
+            }
+        }
+        """
+
+
+def build_connection_query(connections, page_size=100):
+    """
+    Builds a query for the items before a cursor in a connection of each of
+    several pull requests, each pull request being aliased as p0, p1, etc.
+
+    @param connections List of (pull request ID, connection name, cursor) tuples
+    @param page_size Number of items to fetch from each connection (max: 100)
+    @return Tuple of (query string, variables dictionary)
+    """
+    params = []
+    selections = []
+    variables = {}
+    for i, (pr_id, name, cursor) in enumerate(connections):
+        params.append('$id{0}: ID!, $cursor{0}: String'.format(i))
+        variables['id{}'.format(i)] = pr_id
+        variables['cursor{}'.format(i)] = cursor
+
+        # Same selection as in PULL_REQUEST_FIELDS, paging back from the cursor
+        connection = re.sub(r'^(\w+)\(last: \d+\)',
+                            r'\1(last: {}, before: $cursor{})'.format(page_size, i),
+                            dedent(PULL_REQUEST_FIELDS[name]).strip(), count=1)
+        selections.append(
+            """
+            p{0}: node(id: $id{0}) {{
+                ... on PullRequest {{
+            """.format(i) + connection + """
+                }
+            }
+            """)
+
+    query = \
+        """
+        query(""" + ', '.join(params) + """) {
+            rateLimit {
+                cost
+                remaining
+                resetAt
+            }
+        """ + ''.join(selections) + """
+        }
+        """
+    return query, variables
+
+
+def build_multi_repository_query(count, fields):
+    """
+    Builds a query for the first page of open pull requests of several
+    repositories, each repository being aliased as r0, r1, etc.
+
+    @param count Number of repositories
+    @param fields Collection of optional field names (keys of PULL_REQUEST_FIELDS)
+    @return Query string
+    """
+    params = ['$page_size: Int!']
+    repositories = []
+    for i in range(count):
+        params.append('$owner{0}: String!, $name{0}: String!'.format(i))
+        repositories.append(
+            """
+            r{0}: repository(owner: $owner{0}, name: $name{0}) {{
+                pullRequests(first: $page_size, states: [OPEN]) {{
+                    pageInfo {{
+                        hasNextPage
+                        endCursor
+                    }}
+                    nodes {{
+            """.format(i) + build_pull_request_selection(fields) + """
+                    }
+                }
+            }
+            """)
+
+    return \
+        """
+        query(""" + ', '.join(params) + """) {
+            rateLimit {
+                cost
+                remaining
+                resetAt
+            }
+        """ + ''.join(repositories) + """
+        }
+        """
+
 
 class GitHubClient(object):
     """
     Class for handling GraphQL queries for GitHub's APIv4.
     """
 
-    def __init__(self, access_token, organisation, repository):
+    def __init__(self, access_token, organisation, repository, transport=None, fields=None,
+                 endpoint=None, complete_connections=True, tokens=None, response_cache=None):
         # GitHub APIv4 endpoint
-        self.endpoint = "https://api.github.com/graphql"
+        self.endpoint = endpoint or "https://api.github.com/graphql"
 
-        # Create GraphQL Authorization header
-        self.auth = {"Authorization": "Bearer {}".format(access_token)}
+        # Token of the bot, with which all mutations are made
+        self.access_token = access_token
 
         # Initialise empty GraphQL variables dictionary
         self.variables = {
@@ -22,33 +358,153 @@ class GitHubClient(object):
                 'repo_name': repository
             }
 
-        # Number of results to return per page
+        # Number of results to return per page (adapted as pages are fetched)
         self.page_size = 25
 
-    def send_query(self, query):
+        # Optional pull request fields to fetch (defaults to all of them)
+        self.fields = set(fields) if fields is not None else set(PULL_REQUEST_FIELDS.keys())
+
+        # Tokens queries are shared between (as well as the bot's) and the
+        # GraphQL rate limit budget of the bot's
+        self.tokens = tokens if tokens is not None else TokenPool()
+        self.budget = self.tokens.add(access_token)
+
+        # Pooled HTTP connection used for all requests
+        self.transport = transport if transport is not None else Transport()
+
+        # If the items beyond the last few of reviews, review requests and
+        # comments are fetched for the pull requests that have them
+        self.complete_connections = complete_connections
+
+        # Optional cache of replies to read only queries (see cache.ResponseCache)
+        self.response_cache = response_cache
+
+    def send_query(self, query, variables=None, idempotent=True, token=None):
         """
         Sends Query as JSON object, reply formatted as nested python dictionary
+
+        @param query GraphQL query string
+        @param variables GraphQL variables (defaults to the repository variables)
+        @param idempotent If the query can safely be retried (false for mutations)
+        @param token Access token to send the query with (defaults to the one
+                     with the most rate limit budget left, or the bot's for
+                     mutations)
         """
-        # Read query and variables into JSON formatted string
-        message = json.dumps({"query": query, "variables": self.variables})
+        if variables is None:
+            variables = self.variables
+
+        # Only read only queries are served from (and added to) the response
+        # cache, mutations always reach GitHub. A reply that depends on who
+        # sends the query is cached against the token it is sent with.
+        cache_key = None
+        if self.response_cache is not None and idempotent and \
+                not query.lstrip().startswith('mutation'):
+            cache_key = make_response_key(self.endpoint, query, variables, token)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
 
-        # Convert Python None to JSON null
-        payload = message.replace("None", "null")
+        # Mutations are always made as the bot, so comments have one author
+        if token is None and not idempotent:
+            token = self.access_token
 
-        result = requests.post(self.endpoint, payload, headers=self.auth)
-        result_json = result.json()
+        expected_cost = self.tokens.last_cost or 1
+        token = self.tokens.acquire(expected_cost, token)
+        try:
+            payload = jsoncodec.dumps({"query": query, "variables": variables})
+
+            result = self.transport.post(self.endpoint, payload, headers=self._headers(token),
+                                         idempotent=idempotent)
+            if not result.ok:
+                raise _api_error(result)
+
+            result_json = jsoncodec.loads(result.content)
 
-        if not result.ok:
-            msg = result_json['message'] if 'message' in result_json else 'Unknown API error'
-            msg = '{} ({})'.format(msg, result.status_code)
-            raise RuntimeError(msg)
+            self._update_budget(token, result, result_json)
+        finally:
+            self.tokens.release(token, expected_cost)
+
+        if cache_key is not None and not result_json.get('errors', None):
+            self.response_cache.set(cache_key, result_json)
 
         return result_json
 
+    def stream_query(self, query, variables, prefixes):
+        """
+        Sends a query, parsing the reply as it is received.
+
+        Only the values at the given locations of the reply are produced (see
+        jsoncodec.iter_objects), so the reply never has to be held in memory in
+        full. The rate limit budget is updated from the rateLimit object of the
+        reply, if the query requests it.
+
+        @param query GraphQL query string
+        @param variables GraphQL variables
+        @param prefixes Locations of the values to produce (e.g. "errors")
+        @return Iterator over (prefix, value) tuples
+        """
+        if self.response_cache is not None:
+            # Replies are cached whole, so are not streamed
+            for item in jsoncodec.iter_parsed(self.send_query(query, variables), prefixes):
+                yield item
+            return
+
+        expected_cost = self.tokens.last_cost or 1
+        token = self.tokens.acquire(expected_cost)
+        try:
+            payload = jsoncodec.dumps({"query": query, "variables": variables})
+
+            result = self.transport.post(self.endpoint, payload, headers=self._headers(token),
+                                         stream=True)
+            try:
+                if not result.ok:
+                    raise _api_error(result)
+
+                self._update_budget(token, result, {})
+
+                prefixes = set(prefixes)
+                for prefix, value in jsoncodec.iter_objects(result.raw,
+                                                            prefixes | {'data.rateLimit'}):
+                    if prefix == 'data.rateLimit':
+                        self._update_budget(token, result, {'data': {'rateLimit': value}})
+                    if prefix in prefixes:
+                        yield prefix, value
+            finally:
+                self.transport.record_streamed(result)
+                result.close()
+        finally:
+            self.tokens.release(token, expected_cost)
+
+    def _headers(self, token):
+        """
+        Gets the headers of a request authorised by an access token.
+        """
+        return {
+            "Authorization": "Bearer {}".format(token),
+            "Content-Type": "application/json",
+        }
+
+    def _update_budget(self, token, result, result_json):
+        """
+        Updates the rate limit budget of the token a request was sent with from
+        the rateLimit object of its response, falling back to the X-RateLimit
+        headers (e.g. for mutations).
+        """
+        budget = self.tokens.budgets[token]
+        rate_limit = (result_json.get('data', None) or {}).get('rateLimit', None)
+        if rate_limit:
+            reset_time = datetime.strptime(
+                rate_limit['resetAt'], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+            budget.update(rate_limit['remaining'], reset_time.timestamp(),
+                          rate_limit['cost'])
+        elif 'X-RateLimit-Remaining' in result.headers:
+            budget.update(int(result.headers['X-RateLimit-Remaining']),
+                          float(result.headers.get('X-RateLimit-Reset', 0)))
+
     def get_my_username(self):
         """
         Gets the GitHub username of the authenticaed user (i.e. the owner of
-        the auth token).
+        the auth token, as whom comments are posted).
 
         @return Username
         """
@@ -58,174 +514,610 @@ class GitHubClient(object):
                 viewer {
                     login
                 }
+                rateLimit {
+                    cost
+                    remaining
+                    resetAt
+                }
             }
             """
 
-        data = self.send_query(query)
+        data = self.send_query(query, token=self.access_token)
         return data['data']['viewer']['login']
 
-    def fetch_pull_requests(self):
-
-        import click
+    def fetch_pull_requests(self, cache=None):
         """
-        Gets a list of pull requests.
+        Gets a list of open pull requests.
 
-        Fields that are requested:
+        Fields that can be requested (see PULL_REQUEST_FIELDS, only those the
+        client was created with are fetched):
             - PR ID (ret[i]['id'])
             - PR number (ret[i]['number'])
+            - PR state (ret[i]['state'])
             - Time last updated (ret[i]['updatedAt'])
             - GitHub URL (ret[i]['url'])
-            - Mergeable state ([ret[i]['mergeable']])
-            - Last commit (ret[i]['commits']['nodes'][0])
+            - Mergeable state ([ret[i]['mergeable']]) ("mergeable")
+            - Last commit (ret[i]['commits']['nodes'][0]) ("commits")
+                - Commit SHA (commit['commit']['oid'])
                 - Author's GitHub username (commit['commit']['author']['user']['login'])
                 - Committer's GitHub username (commit['commit']['committer']['user']['login'])
                 - CI status (commit['commit']['status']['state'])
-            - PR reviews (ret[i]['reviews'][j])
+            - PR reviews (ret[i]['reviews'][j]) ("reviews")
                 - Status (item['nodes'][i]['state'])
                 - Reviewer's GitHub username (item['nodes'][i]['author']['login'])
-            - PR review request (ret[i]['reviewRequests'][j])
+            - PR review request (ret[i]['reviewRequests'][j]) ("reviewRequests")
                 - Reviewer's GitHub username (item['nodes'][i]['requestedReviewer']['login'])
-            - Last 10 PR comments (ret[i]['comments']['nodes'][j])
+            - Last 10 PR comments (ret[i]['comments']['nodes'][j]) ("comments")
                 - Comment author's GitHub username (item['author']['login'])
                 - Time comment was posted (item['createdAt'])
                 - Comment body (item['body'])
 
+        When a cache is given and it has been populated by a previous run, only
+        pull requests updated since that run are fetched (newest first) and
+        merged into the cache, pull requests that have since been closed or
+        merged are removed from it.
+
+        @param cache PullRequestCache to update incrementally (optional)
         @return List of pull requests with filtered fields
         """
+        if cache is None or cache.watermark is None:
+            pull_requests = list(self.iter_pull_requests())
+
+            if cache is not None:
+                cache.replace(pull_requests)
+
+            return pull_requests
+
+        order_by = {'field': 'UPDATED_AT', 'direction': 'DESC'}
+        changed = []
+        done = False
+        # Typically only the first page is needed, so prefetching would usually
+        # just waste a request
+        for page in self.paginate_pull_requests(states=None, order_by=order_by,
+                                                prefetch=False):
+            for pr in page['nodes']:
+                # Timestamps are ISO 8601 in UTC, so compare lexicographically
+                if pr['updatedAt'] < cache.watermark:
+                    done = True
+                    break
+                changed.append(pr)
+
+            if done:
+                break
+
+        self.complete_pull_requests(changed)
+        cache.update(changed)
+        return cache.pull_requests()
+
+    def iter_pull_requests(self, prefetch=True, cursor=None):
+        """
+        Iterates over open pull requests as each page of results arrives.
+
+        Fields requested are the same as for fetch_pull_requests. While the
+        pull requests of one page are being consumed the next page is fetched
+        in the background.
+
+        @param prefetch If the next page should be fetched in the background
+        @param cursor Cursor after which to start (None to start from the beginning)
+        @return Iterator over pull requests
+        """
+        for page in self.paginate_pull_requests(states=['OPEN'], prefetch=prefetch,
+                                                cursor=cursor):
+            if not self.complete_connections:
+                for pr in page['nodes']:
+                    yield pr
+                continue
+
+            nodes = list(page['nodes'])
+            self.complete_pull_requests(nodes)
+            for pr in nodes:
+                yield pr
+
+    def fetch_pull_request(self, number):
+        """
+        Gets a single pull request.
+
+        Fields requested are the same as for fetch_pull_requests.
+
+        @param number Pull request number
+        @return Pull request (None if there is no such pull request)
+        """
+        query = build_single_pull_request_query(self.fields)
+        data = self.send_query(query, dict(self.variables, number=number))
+
+        repository = (data.get('data', None) or {}).get('repository', None)
+        pr = repository['pullRequest'] if repository else None
+        if pr is not None:
+            self.complete_pull_requests([pr])
+        return pr
+
+    def fetch_issue(self, number):
+        """
+        Gets an issue of the repository by number.
+
+        @param number Issue number
+        @return Dictionary of the issue's ID, number and URL (None if there is
+                no such issue)
+        """
         query = \
             """
-            query($repo_owner: String!, $repo_name: String!, $page_size: Int!, $cursor: String) {
+            query($repo_owner: String!, $repo_name: String!, $number: Int!) {
+                rateLimit {
+                    cost
+                    remaining
+                    resetAt
+                }
                 repository(owner: $repo_owner, name: $repo_name) {
-                    pullRequests(first: $page_size, after: $cursor, states: [OPEN]) {
-                        pageInfo {
-                            hasNextPage
-                            endCursor
-                        }
-                        nodes {
-                            id
-                            number
-                            updatedAt
-                            url
-                            mergeable
-                            commits(last: 1) {
-                                nodes {
-                                    commit {
-                                        author {
-                                            user {
-                                                login
-                                            }
-                                        }
-                                        committer {
-                                            user {
-                                                login
-                                            }
-                                        }
-                                        status {
-                                            state
-                                        }
-                                    }
-                                }
-                            }
-                            reviews(last: 10) {
-                                nodes {
-                                    state
-                                    author {
-                                        login
-                                    }
-                                }
-                            }
-                            reviewRequests(last: 10) {
-                                nodes {
-                                    requestedReviewer {
-                                        ... on User {
-                                            login
-                                        }
-                                    }
-                                }
-                            }
-                            comments(last: 10) {
-                                nodes {
-                                    author {
-                                        login
-                                    }
-                                    body
-                                    createdAt
-                                }
-                            }
-                        }
+                    issue(number: $number) {
+                        id
+                        number
+                        url
                     }
                 }
             }
             """
+        data = self.send_query(query, dict(self.variables, number=number))
 
-        # Create optional cursor variable (used for pagination)
-        self.variables['cursor'] = None
-        # Set number of results per page (max: 100)
-        self.variables['page_size'] = self.page_size
+        repository = (data.get('data', None) or {}).get('repository', None)
+        return repository['issue'] if repository else None
 
-        pull_requests = []
+    # Maximum number of results the search API returns for a single search
+    search_result_limit = 1000
+
+    def fetch_pull_requests_sharded(self, workers=8, shard_size=50):
+        """
+        Gets the same list of open pull requests as fetch_pull_requests
+        (without a cache), fetching disjoint shards of them concurrently.
+
+        Shards are ranges of creation time (see plan_creation_shards), each
+        fetched with fetch_pull_requests_created. Pull requests are merged by
+        ID and sorted by number, which is the order the sequential fetch
+        returns them in.
+
+        Note that the search index can lag slightly behind changes to pull
+        requests.
+
+        @param workers Number of shards to fetch concurrently
+        @param shard_size Number of pull requests each shard is sized for
+        @return List of pull requests with filtered fields
+        """
+        shards = self.plan_creation_shards(shard_size)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = list(executor.map(
+                lambda shard: self._search_pull_requests_created(*shard), shards))
+
+        # Shards only overlap if a pull request was created on a boundary
+        pull_requests = {}
+        for shard in results:
+            for pr in shard:
+                pull_requests[pr['id']] = pr
+
+        pull_requests = sorted(pull_requests.values(), key=lambda pr: pr['number'])
+        self.complete_pull_requests(pull_requests)
+        return pull_requests
+
+    def plan_creation_shards(self, shard_size=50):
+        """
+        Splits the open pull requests into disjoint ranges of creation time.
+
+        The time from the creation of the oldest open pull request until now
+        is split evenly, into ranges that would hold shard_size pull requests
+        each if pull requests were created at an even rate. The last range is
+        open ended, so nothing created since is missed.
 
-        # Fetch data from GitHub, iterate through Pull Requests if there are
-        # more pages of data
+        @param shard_size Number of pull requests each shard is sized for
+        @return List of (first, last) Unix times, last being None for the last
+                shard (empty if there are no open pull requests)
+        """
+        data = self.send_query(build_open_pull_request_span_query())
+        repository = (data.get('data', None) or {}).get('repository', None)
+        if repository is None:
+            errors = data.get('errors', None) or []
+            raise RuntimeError('; '.join([e['message'] for e in errors]) or
+                               'Repository not found')
+
+        total = repository['pullRequests']['totalCount']
+        if total == 0:
+            return []
+
+        start = parse_timestamp(repository['pullRequests']['nodes'][0]['createdAt'])
+        end = int(time.time())
+        count = max(1, min(-(-total // max(1, shard_size)), end - start + 1))
+        bounds = [start + (end - start) * i // count for i in range(count)]
+        shards = [(bounds[i], bounds[i + 1] - 1) for i in range(count - 1)]
+        shards.append((bounds[-1], None))
+        return shards
+
+    def fetch_pull_requests_created(self, first, last=None):
+        """
+        Gets the open pull requests created in a range of time, through the
+        search API.
+
+        Ranges holding more than a page are paginated, those holding more than
+        the search API returns are split in two.
+
+        @param first Unix time of the start of the range
+        @param last Unix time of the end of the range (inclusive, None for no end)
+        @return List of pull requests with filtered fields, sorted by number
+        """
+        pull_requests = sorted(self._search_pull_requests_created(first, last),
+                               key=lambda pr: pr['number'])
+        self.complete_pull_requests(pull_requests)
+        return pull_requests
+
+    def _search_pull_requests_created(self, first, last):
+        search = 'repo:{repo_owner}/{repo_name} is:pr is:open created:{0}..{1}'.format(
+            format_timestamp(first), format_timestamp(last) if last is not None else '*',
+            **self.variables)
+        query = build_pull_request_search_query(self.fields)
+
+        pull_requests = []
+        cursor = None
         while True:
-            data = self.send_query(query)
-
-            # Check for and output errors
-            errors = data.get('errors', None)
-            if errors:
-                click.echo('API request errors:')
-                for e in errors:
-                    click.echo('{} ({})'.format(
-                        e['message'],
-                        ', '.join(['{line}:{column}'.format(**l) for l in e['locations']])))
-                click.echo()
-
-            pull_requests += data['data']['repository']['pullRequests']['nodes']
-
-            # If more pull requests, update cursor to point to new page
-            if data['data']['repository']['pullRequests']['pageInfo']['hasNextPage']:
-                self.variables['cursor'] = \
-                        data['data']['repository']['pullRequests']['pageInfo']['endCursor']
-            else:
-                # No more data, stop pagination
-                break
+            data = self.send_query(query, {'search': search, 'page_size': 100,
+                                           'cursor': cursor})
+            _echo_errors(data.get('errors', None))
+
+            page = (data.get('data', None) or {}).get('search', None)
+            if page is None:
+                raise RuntimeError('Search for pull requests failed')
+
+            # Results past the limit cannot be paged to, so split the range
+            split_end = last if last is not None else int(time.time())
+            if cursor is None and page['issueCount'] > self.search_result_limit and \
+                    split_end > first:
+                middle = (first + split_end) // 2
+                return self._search_pull_requests_created(first, middle) + \
+                    self._search_pull_requests_created(middle + 1, last)
+
+            # Issues matching the search are returned as empty objects
+            pull_requests += [pr for pr in page['nodes'] if pr]
+
+            if not page['pageInfo']['hasNextPage']:
+                return pull_requests
+            cursor = page['pageInfo']['endCursor']
 
-        # Remove non-default variables
-        del self.variables['page_size'], self.variables['cursor']
+    def complete_pull_requests(self, pull_requests, batch_size=25):
+        """
+        Fetches the items of reviews, review requests and comments that were
+        not fetched with each pull request (only the last few are), adding them
+        to the pull requests in place.
+
+        Only connections with earlier items are fetched, in batches of one
+        aliased query per batch_size connections, so this typically costs no
+        or very few requests.
+
+        @param pull_requests List of pull requests to complete
+        @param batch_size Maximum number of connections fetched in one query
+        @return Number of connections that were completed
+        """
+        if not self.complete_connections:
+            return 0
+
+        pending = []
+        for pr in pull_requests:
+            for name in WINDOWED_CONNECTIONS:
+                page_info = (pr.get(name, None) or {}).get('pageInfo', None) or {}
+                if page_info.get('hasPreviousPage', False):
+                    pending.append((pr, name, page_info['startCursor']))
+
+        completed = len(pending)
+        while pending:
+            batch, pending = pending[:batch_size], pending[batch_size:]
+            query, variables = build_connection_query(
+                [(pr['id'], name, cursor) for pr, name, cursor in batch])
+            data = self.send_query(query, variables)
+            _echo_errors(data.get('errors', None))
+
+            for i, (pr, name, _) in enumerate(batch):
+                node = (data.get('data', None) or {}).get('p{}'.format(i), None)
+                if not node:
+                    continue
+
+                # Earlier items come first, as in a single page
+                page = node[name]
+                pr[name]['nodes'] = page['nodes'] + pr[name]['nodes']
+                pr[name]['pageInfo'] = page['pageInfo']
+                if page['pageInfo']['hasPreviousPage']:
+                    pending.append((pr, name, page['pageInfo']['startCursor']))
+
+        return completed
 
+    def fetch_stale_pull_requests(self, stale_days_threshold, chunk_size=100):
+        """
+        Gets the open pull requests that have not been updated for a number of
+        days, in two passes.
+
+        The first pass pages through all open pull requests fetching only their
+        last update time, the second fetches the fields the client was created
+        with for just the stale pull requests, by ID.
+
+        @param stale_days_threshold Number of days of inactivity after which a PR is "stale"
+        @param chunk_size Number of pull requests fetched per request in the second pass
+        @return List of stale pull requests
+        """
+        stale_ids = []
+        for page in self.paginate_pull_requests(states=['OPEN'], prefetch=True, fields=[]):
+            stale_ids += [pr['id'] for pr in page['nodes']
+                          if elapsed_days_since_update(pr) >= stale_days_threshold]
+
+        query = build_pull_request_nodes_query(self.fields)
+
+        pull_requests = []
+        for i in range(0, len(stale_ids), chunk_size):
+            data = self.send_query(query, {'ids': stale_ids[i:i + chunk_size]})
+            pull_requests += [pr for pr in data['data']['nodes'] if pr]
+
+        self.complete_pull_requests(pull_requests)
         return pull_requests
 
-    def post_comments_on_pull_requests(self, comments):
-        mutation = \
-            """
-            mutation($pr_id: ID!, $message: String!) {
-                addComment(input: {subjectId: $pr_id, body: $message}) {
-                    subject {
-                        id
-                    }
-                }
-            }
-            """
+    def paginate_pull_requests(self, states=None, order_by=None, prefetch=False,
+                               fields=None, cursor=None):
+        """
+        Iterates over pages of pull requests.
+
+        @param states List of pull request states to fetch (None for all)
+        @param order_by Ordering of pull requests (None for GitHub's default)
+        @param prefetch If the next page should be requested before the current
+                        page is yielded
+        @param fields Optional fields of each pull request to fetch (defaults to
+                      the fields the client was created with)
+        @param cursor Cursor after which to start (None to start from the beginning)
+        @return Iterator over pullRequests connections, one per page (the nodes
+                of each are an iterator, read from the reply as they are consumed)
+        """
+        if fields is None:
+            fields = self.fields
 
-        # No need for repository variables in mutation query - store and remove
-        # from query variables, to avoid a GitHub error
-        repo_name = self.variables['repo_name']
-        repo_owner = self.variables['repo_owner']
-        del self.variables['repo_owner']
-        del self.variables['repo_name']
+        query = build_pull_request_page_query(fields)
 
-        # Iterate through stale pull requests, and comment the message chosen
-        for c in comments:
-            self.variables['pr_id'] = c[0]['id']
-            self.variables['message'] = c[1]
-            self.send_query(mutation)
+        variables = dict(self.variables)
+        variables['states'] = states
+        variables['order_by'] = order_by
 
-        try:
-            del self.variables['pr_id']
-            del self.variables['message']
-        except KeyError:
+        def fetch_page(cursor, page_size):
+            # Copy variables so a prefetch never alters a request in flight
+            page_variables = dict(variables, cursor=cursor, page_size=page_size)
+            start = time.monotonic()
+            page = _StreamedPage(self.stream_query(query, page_variables, _StreamedPage.prefixes))
+            return page, page_size, time.monotonic() - start
+
+        page = None
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Fetch data from GitHub, iterate through Pull Requests if there
+            # are more pages of data
+            pending = executor.submit(fetch_page, cursor, self.page_size)
+            try:
+                while pending is not None:
+                    page, page_size, latency = pending.result()
+                    pending = None
+
+                    if page.page_info is None:
+                        _echo_errors(page.errors)
+                        raise RuntimeError('; '.join([e['message'] for e in page.errors]) or
+                                           'Repository not found')
+
+                    # Choose the size of the next page (max: 100) from how long
+                    # this page took and how much budget it cost. With a
+                    # response cache the size is fixed instead, so repeated
+                    # runs send identical (i.e. cached) queries.
+                    if self.response_cache is not None:
+                        self.page_size = 100
+                    else:
+                        self.page_size = adapt_page_size(
+                            page_size, latency, page.rate_limit.get('cost', None),
+                            page.rate_limit.get('remaining', None), self.budget.reserve)
+
+                    # If more pull requests, request the page following the
+                    # cursor (before handing over this page when prefetching)
+                    cursor = page.page_info['endCursor']
+                    has_next_page = page.page_info['hasNextPage']
+
+                    if has_next_page and prefetch:
+                        pending = executor.submit(fetch_page, cursor, self.page_size)
+
+                    yield {'pageInfo': page.page_info, 'nodes': page.nodes()}
+
+                    # Errors follow the data in the reply, so read past any
+                    # nodes that were not consumed
+                    page.finish()
+                    _echo_errors(page.errors)
+
+                    if has_next_page and not prefetch:
+                        pending = executor.submit(fetch_page, cursor, self.page_size)
+            finally:
+                # Release the connections of pages that were abandoned part way
+                # through or prefetched but never used
+                if page is not None:
+                    page.close()
+                if pending is not None and not pending.cancel() and pending.exception() is None:
+                    pending.result()[0].close()
+
+    def post_comments_on_pull_requests(self, comments, workers=1, rate_limiter=None,
+                                       batch_size=1):
+        """
+        Posts comments on pull requests.
+
+        Comments are grouped into batches, each batch being sent as a single
+        GraphQL document containing one aliased addComment mutation per comment
+        (c0, c1, ...). Batches are sent from a pool of worker threads, each
+        using its own query variables, while the rate limiter keeps the overall
+        rate of comments within GitHub's secondary limits for content creation
+        (each comment in a batch counting separately).
+
+        @param comments List of (pull request, comment text) tuples
+        @param workers Maximum number of batches to post concurrently
+        @param rate_limiter Limiter applied before each request, charged for
+                            every comment it carries
+        @param batch_size Maximum number of comments posted in one request
+        @return List of (pull request, success, error message) tuples
+        """
+        if rate_limiter is None:
+            rate_limiter = RateLimiter()
+
+        batch_size = max(1, batch_size)
+        batches = [comments[i:i + batch_size] for i in range(0, len(comments), batch_size)]
+
+        def post_batch(batch):
+            mutation, variables = build_add_comment_mutation(batch)
+
+            rate_limiter.wait(len(batch))
+            try:
+                data = self.send_query(mutation, variables, idempotent=False)
+            except (RuntimeError, requests.RequestException) as e:
+                return [(pr, False, str(e)) for pr, _ in batch]
+
+            return split_add_comment_results(batch, data)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            return [r for results in executor.map(post_batch, batches) for r in results]
+
+
+class _StreamedPage(object):
+    """
+    Page of pull requests whose nodes are parsed from the reply as they are
+    consumed.
+
+    The reply is read up to the page info on creation. GitHub replies with
+    fields in the order they are selected, so the rate limit and page info
+    arrive before any nodes.
+    """
+
+    page_info_prefix = 'data.repository.pullRequests.pageInfo'
+    nodes_prefix = 'data.repository.pullRequests.nodes.item'
+    prefixes = ('errors', 'data.rateLimit', page_info_prefix, nodes_prefix)
+
+    def __init__(self, objects):
+        """
+        @param objects Iterator over the reply (see GitHubClient.stream_query)
+        """
+        self._objects = objects
+        self._buffered = []
+        self.errors = []
+        self.rate_limit = {}
+        self.page_info = None
+
+        for prefix, value in objects:
+            if prefix == self.page_info_prefix:
+                self.page_info = value
+                break
+            self._read(prefix, value)
+
+    def _read(self, prefix, value):
+        if prefix == self.nodes_prefix:
+            self._buffered.append(value)
+        elif prefix == 'errors':
+            self.errors += value or []
+        elif prefix == 'data.rateLimit':
+            self.rate_limit = value or {}
+
+    def nodes(self):
+        """
+        @return Iterator over the pull requests of the page
+        """
+        buffered, self._buffered = self._buffered, []
+        for pr in buffered:
+            yield pr
+
+        for prefix, value in self._objects:
+            if prefix == self.nodes_prefix:
+                yield value
+            else:
+                self._read(prefix, value)
+
+    def finish(self):
+        """
+        Reads the remainder of the reply, discarding any nodes.
+        """
+        for _ in self.nodes():
             pass
 
-        # Restore repository variables
-        self.variables['repo_name'] = repo_name
-        self.variables['repo_owner'] = repo_owner
+    def close(self):
+        self._objects.close()
+
+
+def _echo_errors(errors):
+    """
+    Outputs the errors of a GraphQL reply.
+    """
+    if not errors:
+        return
+
+    click.echo('API request errors:')
+    for e in errors:
+        click.echo('{} ({})'.format(
+            e['message'],
+            ', '.join(['{line}:{column}'.format(**l) for l in e.get('locations', [])])))
+    click.echo()
+
+
+def _api_error(result):
+    """
+    Creates the exception raised for an unsuccessful API response.
+    """
+    try:
+        msg = jsoncodec.loads(result.content).get('message', 'Unknown API error')
+    except (ValueError, AttributeError):
+        msg = 'Unknown API error'
+    return RuntimeError('{} ({})'.format(msg, result.status_code))
+
+
+def build_add_comment_mutation(comments):
+    """
+    Builds a single mutation adding several comments.
+
+    @param comments List of (pull request, comment text) tuples
+    @return Tuple of (mutation string, variables dictionary)
+    """
+    params = []
+    fields = []
+    variables = {}
+
+    for i, (pr, message) in enumerate(comments):
+        params.append('$pr_id{0}: ID!, $message{0}: String!'.format(i))
+        fields.append(
+            'c{0}: addComment(input: {{subjectId: $pr_id{0}, body: $message{0}}}) '
+            '{{ subject {{ id }} }}'.format(i))
+        variables['pr_id{}'.format(i)] = pr['id']
+        variables['message{}'.format(i)] = message
+
+    mutation = 'mutation({}) {{\n{}\n}}'.format(', '.join(params), '\n'.join(fields))
+    return mutation, variables
+
+
+def split_add_comment_results(comments, data):
+    """
+    Splits the response to a batched addComment mutation into a result for
+    each comment.
+
+    Errors are assigned to a comment using the alias at the start of their
+    path, errors without a path are considered to affect the whole batch.
+
+    @param comments List of (pull request, comment text) tuples that were posted
+    @param data Response to the mutation
+    @return List of (pull request, success, error message) tuples
+    """
+    alias_errors = {}
+    batch_errors = []
+    for e in data.get('errors', None) or []:
+        path = e.get('path', None)
+        if path:
+            alias_errors.setdefault(path[0], []).append(e['message'])
+        else:
+            batch_errors.append(e['message'])
+
+    results = []
+    response = data.get('data', None) or {}
+    for i, (pr, _) in enumerate(comments):
+        alias = 'c{}'.format(i)
+        errors = alias_errors.get(alias, []) + batch_errors
+        if not errors and response.get(alias, None) is None:
+            errors = ['No result returned']
+
+        if errors:
+            results.append((pr, False, '; '.join(errors)))
+        else:
+            results.append((pr, True, None))
+
+    return results
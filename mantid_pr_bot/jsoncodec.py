@@ -0,0 +1,121 @@
+"""
+JSON encoding and decoding of GraphQL requests and responses.
+
+orjson is used when it is installed, otherwise the standard library json
+module. ijson is used (when installed) to parse responses incrementally as
+they are received.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def dumps(obj):
+    """
+    Serialises an object to JSON.
+
+    @param obj Object to serialise
+    @return UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    """
+    Parses a JSON document.
+
+    @param data UTF-8 encoded JSON (bytes or str)
+    @return Parsed object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def iter_objects(stream, prefixes):
+    """
+    Iterates over the values found at a set of locations in a JSON document.
+
+    Locations are given in ijson's prefix notation: keys separated by dots,
+    with "item" standing for every element of an array (e.g.
+    "data.repository.pullRequests.nodes.item"). Values are produced in the
+    order they appear in the document.
+
+    When ijson is installed the document is parsed as it is read, so only one
+    value is held in memory at a time, otherwise it is read and parsed in full.
+
+    @param stream File like object to read the document from
+    @param prefixes Locations of the values to produce
+    @return Iterator over (prefix, value) tuples
+    """
+    prefixes = frozenset(prefixes)
+
+    if ijson is None:
+        for item in _walk(loads(stream.read()), '', prefixes):
+            yield item
+        return
+
+    builder = None
+    depth = 0
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is None:
+            if prefix not in prefixes or event in ('map_key', 'end_map', 'end_array'):
+                continue
+            if event not in ('start_map', 'start_array'):
+                yield prefix, value
+                continue
+            builder = ijson.ObjectBuilder()
+            target = prefix
+
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+            if depth == 0:
+                yield target, builder.value
+                builder = None
+
+
+def iter_parsed(value, prefixes):
+    """
+    Iterates over the values found at a set of locations in an already parsed
+    JSON document, as iter_objects.
+
+    @param value Parsed document
+    @param prefixes Locations of the values to produce
+    @return Iterator over (prefix, value) tuples
+    """
+    return _walk(value, '', frozenset(prefixes))
+
+
+def _walk(value, prefix, prefixes):
+    if prefix in prefixes:
+        yield prefix, value
+        return
+
+    # Only descend towards the requested locations
+    if not any(p.startswith(prefix) for p in prefixes):
+        return
+
+    if isinstance(value, dict):
+        children = ((key, v) for key, v in value.items())
+    elif isinstance(value, list):
+        children = (('item', v) for v in value)
+    else:
+        return
+
+    for key, child in children:
+        for item in _walk(child, '{}.{}'.format(prefix, key) if prefix else key, prefixes):
+            yield item
@@ -0,0 +1,211 @@
+import json
+import sqlite3
+import threading
+import time
+
+from .filtering import get_markdown_comment_in_comment
+from .records import PullRequestRecord, parse_timestamp
+
+
+def get_problem_type(comment_text):
+    """
+    Gets the problem type from the machine readable markdown comment of a
+    comment posted by the bot (see resolutions.fill_random_response_message).
+
+    @param comment_text Comment text
+    @return Problem type, None if the comment has no (valid) markdown comment
+    """
+    md_comment = get_markdown_comment_in_comment(comment_text)
+    if not md_comment:
+        return None
+
+    try:
+        return json.loads(md_comment[0]).get('problem_type', None)
+    except (ValueError, AttributeError):
+        return None
+
+
+class CommentLedger(object):
+    """
+    SQLite backed record of every comment posted by the bot.
+
+    The ledger is used to enforce a cooldown per problem category, so the same
+    pull request is not nagged about the same problem again until the cooldown
+    has elapsed, without having to fetch the bodies of existing comments.
+    """
+
+    def __init__(self, filename):
+        """
+        @param filename Path to the SQLite database (":memory:" for a temporary ledger)
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS comments ('
+                'pr_id TEXT NOT NULL, '
+                'problem_type TEXT NOT NULL, '
+                'posted_at REAL NOT NULL)')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS comments_pr_problem '
+                'ON comments (pr_id, problem_type)')
+
+    def close(self):
+        self._db.close()
+
+    def is_empty(self):
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM comments LIMIT 1').fetchone() is None
+
+    def record(self, pr_id, problem_type, posted_at=None):
+        """
+        Records that a comment has been posted.
+
+        @param pr_id Pull request ID
+        @param problem_type Problem type the comment was about
+        @param posted_at Unix time the comment was posted (defaults to now)
+        """
+        self.record_many([(pr_id, problem_type, posted_at)])
+
+    def record_many(self, entries):
+        """
+        Records that several comments have been posted.
+
+        @param entries Iterable of (pull request ID, problem type, Unix time
+                       posted or None for now) tuples
+        """
+        now = time.time()
+        rows = [(pr_id, problem_type, posted_at if posted_at is not None else now)
+                for pr_id, problem_type, posted_at in entries]
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT INTO comments (pr_id, problem_type, posted_at) VALUES (?, ?, ?)', rows)
+
+    def last_posted(self, pr_ids):
+        """
+        Gets the time of the last comment posted for each problem type on a set
+        of pull requests.
+
+        @param pr_ids Iterable of pull request IDs
+        @return Dictionary of (pull request ID, problem type) to Unix time
+        """
+        pr_ids = list(set(pr_ids))
+        last = {}
+        with self._lock:
+            # Stay well below SQLite's limit on the number of parameters
+            for i in range(0, len(pr_ids), 500):
+                chunk = pr_ids[i:i + 500]
+                rows = self._db.execute(
+                    'SELECT pr_id, problem_type, MAX(posted_at) FROM comments '
+                    'WHERE pr_id IN ({}) GROUP BY pr_id, problem_type'.format(
+                        ', '.join('?' * len(chunk))), chunk)
+                for pr_id, problem_type, posted_at in rows:
+                    last[(pr_id, problem_type)] = posted_at
+        return last
+
+    def filter_comments(self, comments, cooldown_days, now=None):
+        """
+        Removes comments whose problem was already raised on the same pull
+        request within its cooldown period.
+
+        @param comments List of (pull request, comment text) tuples
+        @param cooldown_days Dictionary of problem type to cooldown in days, the
+                             None key giving the default for other problem types
+        @param now Unix time to measure cooldowns from (defaults to now)
+        @return Tuple of (comments to post, suppressed comments)
+        """
+        suppressed = self._in_cooldown([(pr, get_problem_type(text)) for pr, text in comments],
+                                       cooldown_days, now)
+        return ([c for c, s in zip(comments, suppressed) if not s],
+                [c for c, s in zip(comments, suppressed) if s])
+
+    def filter_problems(self, problems, cooldown_days, now=None):
+        """
+        Removes problems that were already raised on the same pull request
+        within their cooldown period.
+
+        @param problems List of (pull request, problem type) tuples
+        @param cooldown_days Dictionary of problem type to cooldown in days, the
+                             None key giving the default for other problem types
+        @param now Unix time to measure cooldowns from (defaults to now)
+        @return Tuple of (problems to raise, suppressed problems)
+        """
+        suppressed = self._in_cooldown(problems, cooldown_days, now)
+        return ([p for p, s in zip(problems, suppressed) if not s],
+                [p for p, s in zip(problems, suppressed) if s])
+
+    def _in_cooldown(self, problems, cooldown_days, now=None):
+        if now is None:
+            now = time.time()
+
+        last = self.last_posted(pr['id'] for pr, _ in problems)
+
+        in_cooldown = []
+        for pr, problem_type in problems:
+            cooldown = cooldown_days.get(problem_type, cooldown_days.get(None, 0))
+            posted_at = last.get((pr['id'], problem_type), None)
+            in_cooldown.append(posted_at is not None and now - posted_at < cooldown * 86400)
+        return in_cooldown
+
+    def record_results(self, comments, results):
+        """
+        Records the comments that were successfully posted.
+
+        @param comments List of (pull request, comment text) tuples that were posted
+        @param results Result of GitHubClient.post_comments_on_pull_requests
+                       (in the same order as comments)
+        """
+        self.record_many([(pr['id'], get_problem_type(text), None)
+                          for (pr, text), (_, success, _) in zip(comments, results)
+                          if success])
+
+    def rebuild(self, pull_requests, bot_username):
+        """
+        Populates the ledger from the markdown comments of comments previously
+        posted by the bot.
+
+        Pull requests must have been fetched with their comments.
+
+        @param pull_requests Iterable of pull requests (or PullRequestRecords)
+        @param bot_username Username the bot posts comments as
+        @return Number of comments recorded
+        """
+        entries = []
+        for pr in pull_requests:
+            if isinstance(pr, PullRequestRecord):
+                marked = [(a, t, md) for a, t, md in pr.marked_comments]
+            else:
+                marked = []
+                for c in (pr.get('comments', None) or {}).get('nodes', []):
+                    md_comment = get_markdown_comment_in_comment(c['body'])
+                    if md_comment:
+                        author = (c['author'] or {}).get('login', None)
+                        marked.append((author, c['createdAt'], md_comment[0]))
+
+            for author, created_at, md_comment in marked:
+                if author != bot_username:
+                    continue
+                problem_type = get_problem_type('<!--{}-->'.format(md_comment))
+                if problem_type:
+                    entries.append((pr['id'], problem_type, parse_timestamp(created_at)))
+
+        self.record_many(entries)
+        return len(entries)
+
+
+def parse_cooldowns(default_days, overrides):
+    """
+    Parses per problem type cooldowns.
+
+    @param default_days Cooldown for problem types without an override
+    @param overrides Iterable of "problem_type=days" strings
+    @return Dictionary of problem type to cooldown in days (None key for the default)
+    """
+    cooldowns = {None: default_days}
+    for override in overrides:
+        problem_type, _, days = override.partition('=')
+        try:
+            cooldowns[problem_type.strip()] = float(days)
+        except ValueError:
+            raise ValueError('Invalid cooldown "{}", expected problem_type=days'.format(override))
+    return cooldowns
@@ -1,13 +1,29 @@
 import click
+import os
+import socket
 
+from datetime import datetime
+
+from .cache import DiskResponseCache, PullRequestCache
 from .github import GitHubClient
+from .ledger import CommentLedger, parse_cooldowns
+from .metrics import Metrics
+from .ratelimit import RateLimiter, TokenPool
+from .snapshot import Snapshot, write_snapshot
+from .sweep import merge_sweep_results, parse_repositories, sweep_repositories
+from .transport import Transport
+from .workqueue import TaskProcessor, WorkQueue, describe_task, plan_tasks, run_worker
+from . import resolutions, rules, workflow
 from .workflow import filter_prs
-from .resolutions import generate_resolution_comments
+from .resolutions import generate_digests, generate_resolution_comments, render_digest
 
 
 @click.command()
 @click.option('--token', type=str, required=True,
               help='GitHub Personal Access token.')
+@click.option('--extra-token', 'extra_tokens', type=str, multiple=True,
+              help='Additional access token whose rate limit budget is shared by queries '
+                   '(may be repeated), comments are always posted with --token.')
 @click.option('--stale-days', type=int, default=14,
               help='GitHub Personal Access token.')
 @click.option('--org', type=str, default='mantidproject',
@@ -22,7 +38,101 @@ from .resolutions import generate_resolution_comments
               help='Apply the chosen comments to each PR.')
 @click.option('--force', is_flag=True,
               help='Skip confirmation prompts')
-def main(token, stale_days, org, repo, list_prs, list_comments, do_commenting, force):
+@click.option('--endpoint', type=str, default='https://api.github.com/graphql',
+              help='GitHub GraphQL API endpoint.')
+@click.option('--connect-timeout', type=float, default=5.0,
+              help='Seconds to wait when connecting to GitHub.')
+@click.option('--read-timeout', type=float, default=60.0,
+              help='Seconds to wait for a response from GitHub.')
+@click.option('--max-retries', type=int, default=3,
+              help='Number of times a failed request is retried.')
+@click.option('--post-workers', type=int, default=4,
+              help='Number of comment requests to send concurrently.')
+@click.option('--post-interval', type=float, default=1.0,
+              help='Minimum number of seconds between two comments.')
+@click.option('--post-per-minute', type=int, default=80,
+              help='Maximum number of comments posted in any minute.')
+@click.option('--post-per-hour', type=int, default=500,
+              help='Maximum number of comments posted in any hour.')
+@click.option('--post-batch-size', type=int, default=10,
+              help='Number of comments posted in a single request.')
+@click.option('--cache-file', type=click.Path(dir_okay=False),
+              help='File in which to cache pull requests between runs.')
+@click.option('--full-refresh', is_flag=True,
+              help='Ignore the contents of the cache and fetch all pull requests.')
+@click.option('--rate-limit-reserve', type=int, default=50,
+              help='GraphQL rate limit points that should be left unspent.')
+@click.option('--rate-limit-wait', type=int, default=0,
+              help='Maximum seconds to wait for the rate limit to reset before failing.')
+@click.option('--category', 'categories', multiple=True,
+              help='Problem category to check (may be repeated, defaults to all), one of {} '
+                   'or the name of a rule given by --rules.'.format(
+                       ', '.join([c[0] for c in workflow.categories])))
+@click.option('--two-pass', is_flag=True,
+              help='Find stale pull requests before fetching their details.')
+@click.option('--sharded-fetch', is_flag=True,
+              help='Fetch pull requests in shards of creation time, concurrently.')
+@click.option('--fetch-workers', type=int, default=8,
+              help='Number of shards to fetch concurrently with --sharded-fetch.')
+@click.option('--repos', type=str,
+              help='Comma separated list of repositories ("name" or "owner/name") to sweep.')
+@click.option('--repos-file', type=click.File('r'),
+              help='File listing repositories to sweep, one per line.')
+@click.option('--sweep-workers', type=int, default=4,
+              help='Number of repositories to fetch concurrently when sweeping.')
+@click.option('--alias-batch-size', type=int, default=0,
+              help='Number of repositories whose first page is fetched in one query.')
+@click.option('--metrics-json', type=click.Path(dir_okay=False),
+              help='File to write run metrics to as JSON.')
+@click.option('--metrics-prom', type=click.Path(dir_okay=False),
+              help='File to write run metrics to for the Prometheus textfile collector.')
+@click.option('--ledger', 'ledger_file', type=click.Path(dir_okay=False),
+              help='SQLite database recording posted comments, used to enforce cooldowns.')
+@click.option('--cooldown-days', type=float, default=7.0,
+              help='Days before the same problem is raised on a pull request again.')
+@click.option('--cooldown', 'cooldowns', multiple=True,
+              help='Cooldown for a single problem type as "problem_type=days" (may be repeated).')
+@click.option('--rules', 'rules_file', type=click.Path(exists=True, dir_okay=False),
+              help='TOML or JSON file defining the problem categories (see rules.example.toml).')
+@click.option('--rule-stats', is_flag=True,
+              help='Report the time spent evaluating and hit rate of each rule.')
+@click.option('--save-snapshot', type=click.Path(dir_okay=False),
+              help='File to save the fetched pull requests to.')
+@click.option('--from-snapshot', type=click.Path(exists=True, dir_okay=False),
+              help='Snapshot to read pull requests from instead of fetching them.')
+@click.option('--response-cache', 'response_cache_file', type=click.Path(dir_okay=False),
+              help='SQLite database in which to cache replies to queries between runs '
+                   '(not used with --do-commenting).')
+@click.option('--response-cache-ttl', type=float, default=600.0,
+              help='Seconds a cached reply is used for.')
+@click.option('--response-cache-size', type=int, default=10000,
+              help='Maximum number of cached replies.')
+@click.option('--digest-issue', type=int,
+              help='Post one comment per notified user on this tracking issue, listing all '
+                   'of their pull requests, instead of a comment on each pull request.')
+@click.option('--queue', 'queue_file', type=click.Path(dir_okay=False),
+              help='SQLite work queue shared by a coordinator (--enqueue) and workers (--work).')
+@click.option('--enqueue', is_flag=True,
+              help='Add a task to the work queue for each repository (or shard of one).')
+@click.option('--work', is_flag=True,
+              help='Claim and process tasks from the work queue until none are left.')
+@click.option('--run-id', type=str,
+              help='Name of the run the queued tasks belong to (defaults to the UTC date).')
+@click.option('--shard-size', type=int, default=0,
+              help='Split each repository into tasks of about this many open pull requests '
+                   'when enqueueing (0 for one task per repository).')
+@click.option('--lease-seconds', type=float, default=300.0,
+              help='Seconds a task is held by a worker that stops renewing it.')
+@click.option('--max-attempts', type=int, default=3,
+              help='Number of times a queued task is attempted before it is given up on.')
+def main(token, extra_tokens, stale_days, org, repo, list_prs, list_comments, do_commenting, force,
+         endpoint, connect_timeout, read_timeout, max_retries, post_workers, post_interval,
+         post_batch_size, cache_file, full_refresh, rate_limit_reserve, rate_limit_wait,
+         categories, two_pass, sharded_fetch, fetch_workers, repos, repos_file, sweep_workers,
+         alias_batch_size, metrics_json, metrics_prom, ledger_file, cooldown_days, cooldowns,
+         rules_file, rule_stats, save_snapshot, from_snapshot, response_cache_file,
+         response_cache_ttl, response_cache_size, digest_issue, queue_file, enqueue, work, run_id,
+         shard_size, lease_seconds, max_attempts, post_per_minute, post_per_hour):
     """
     Tool used to gently remind people when a pull request goes stale.
 
@@ -34,20 +144,296 @@ def main(token, stale_days, org, repo, list_prs, list_comments, do_commenting, f
     add a little variety (therefore note that the output of --list-comments is
     not necessarily the comment that will be posted by --do-commenting in
     separate invocations).
+
+    Several repositories can be swept in one run using --repos and/or
+    --repos-file, in which case --repo is ignored.
+
+    Pull requests can be saved with --save-snapshot and classified again
+    later without using the API with --from-snapshot, staleness is then
+    measured from the time the snapshot was taken.
+
+    Large runs can be split between processes (or machines sharing a file
+    system) through a work queue: a coordinator run with --queue and
+    --enqueue adds a task per repository, then any number of runs with
+    --queue and --work process them. Tasks of crashed workers are retried and,
+    with --ledger, no comment is posted twice.
     """
-    click.echo('Organisation: {}'.format(org))
-    click.echo('Repository: {}'.format(repo))
+    repositories = []
+    if repos:
+        repositories += parse_repositories(repos.split(','), org)
+    if repos_file:
+        repositories += [r for r in parse_repositories(repos_file, org)
+                         if r not in repositories]
+
+    if repositories and (save_snapshot or from_snapshot):
+        raise click.UsageError(
+            '--save-snapshot and --from-snapshot cannot be used when sweeping repositories')
+
+    # Pull requests are fetched in only one of these ways
+    fetch_options = [name for name, value in [('--from-snapshot', from_snapshot),
+                                              ('--cache-file', cache_file),
+                                              ('--two-pass', two_pass),
+                                              ('--sharded-fetch', sharded_fetch)] if value]
+    if len(fetch_options) > 1:
+        raise click.UsageError('{} cannot be used together'.format(' and '.join(fetch_options)))
+    if repositories and fetch_options and not (enqueue or work):
+        raise click.UsageError(
+            '{} cannot be used when sweeping repositories'.format(fetch_options[0]))
+
+    if (enqueue or work) and not queue_file:
+        raise click.UsageError('--enqueue and --work require --queue')
+    if enqueue and work:
+        raise click.UsageError('--enqueue and --work cannot be used together')
+    if (enqueue or work) and (save_snapshot or from_snapshot):
+        raise click.UsageError('--save-snapshot and --from-snapshot cannot be used with --queue')
+    if (enqueue or work) and fetch_options:
+        raise click.UsageError('{} cannot be used with --queue'.format(fetch_options[0]))
+    if work and digest_issue:
+        raise click.UsageError('--digest-issue cannot be used with --work')
+    if work and do_commenting and not ledger_file:
+        # The ledger is how a retried task knows which comments were posted
+        raise click.UsageError('--work with --do-commenting requires --ledger')
+
+    if repositories:
+        target = '{} repositories'.format(len(repositories))
+        click.echo('Repositories: {}'.format(
+            ', '.join(['{}/{}'.format(*r) for r in repositories])))
+    else:
+        target = '{}/{}'.format(org, repo)
+        click.echo('Organisation: {}'.format(org))
+        click.echo('Repository: {}'.format(repo))
     click.echo('Stale days: {}'.format(stale_days))
     click.echo()
 
-    gh_client = GitHubClient(token, org, repo)
+    metrics = Metrics({'repository': 'sweep' if repositories else target})
 
-    username = gh_client.get_my_username()
-    click.echo('Token owner is: {}'.format(username))
-    click.echo()
+    transport = Transport(connect_timeout=connect_timeout, read_timeout=read_timeout,
+                          max_retries=max_retries,
+                          pool_size=max(10, post_workers, sweep_workers, fetch_workers),
+                          metrics=metrics)
+
+    # Problem categories are either built in or defined by rules
+    pipeline = None
+    resolution_table = None
+    if rules_file:
+        try:
+            active_rules = rules.load_rules(rules_file)
+        except (IOError, ValueError) as e:
+            raise click.BadParameter(str(e), param_hint='--rules')
+        available = [r.name for r in active_rules]
+    else:
+        available = [c[0] for c in workflow.categories]
+
+    unknown = [c for c in categories if c not in available]
+    if unknown:
+        raise click.BadParameter('unknown categories: {} (expected {})'.format(
+            ', '.join(unknown), ', '.join(available)), param_hint='--category')
+    categories = list(categories) or available
+
+    # Only fetch the pull request fields needed by the enabled categories
+    if rules_file:
+        active_rules = [r for r in active_rules if r.name in categories]
+        pipeline = rules.RulePipeline(active_rules)
+        resolution_table = rules.build_resolutions(active_rules)
+        fields = rules.get_required_fields(active_rules)
+    else:
+        fields = workflow.get_required_fields(categories)
+    if list_comments or do_commenting:
+        fields |= resolutions.get_required_fields(categories, resolution_table)
+    required_fields = set(fields)
+
+    ledger = None
+    if ledger_file:
+        try:
+            cooldowns = parse_cooldowns(cooldown_days, cooldowns)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--cooldown')
+
+        ledger = CommentLedger(ledger_file)
+        # An empty ledger is rebuilt from earlier comments, which is the only
+        # time their bodies need to be fetched
+        if ledger.is_empty():
+            fields.add('comments')
+
+    # Queries are spread over every token, each with its own budget
+    tokens = TokenPool([token] + list(extra_tokens), reserve=rate_limit_reserve,
+                       max_wait=rate_limit_wait)
+
+    # Cached replies are only good enough to look at, never to comment on
+    response_cache = None
+    if response_cache_file and do_commenting:
+        click.echo('Not using the response cache, as comments are to be posted')
+        click.echo()
+    elif response_cache_file:
+        response_cache = DiskResponseCache(response_cache_file, ttl=response_cache_ttl,
+                                           max_entries=response_cache_size)
+
+    gh_client = GitHubClient(token, org, repo, transport=transport, fields=fields,
+                             endpoint=endpoint, tokens=tokens, response_cache=response_cache)
+
+    # A snapshot is classified offline, the API is only needed to post comments
+    username = None
+    if (not from_snapshot and not enqueue) or do_commenting:
+        with metrics.phase('auth'):
+            username = gh_client.get_my_username()
+        click.echo('Token owner is: {}'.format(username))
+        click.echo()
+
+    if enqueue or work:
+        queue = WorkQueue(queue_file, lease_seconds=lease_seconds, max_attempts=max_attempts)
+        run_id = run_id or datetime.utcnow().strftime('%Y-%m-%d')
+        targets = repositories or [(org, repo)]
+
+        def make_client(owner, name, extra_fields=()):
+            return GitHubClient(token, owner, name, transport=transport,
+                                fields=set(fields) | set(extra_fields), endpoint=endpoint,
+                                tokens=tokens)
+
+        if enqueue:
+            with metrics.phase('enqueue'):
+                tasks = plan_tasks(targets, shard_size, make_client)
+                added = queue.enqueue(run_id, tasks)
+            click.echo('Enqueued {} new tasks ({} planned) for run {}'.format(
+                added, len(tasks), run_id))
+        else:
+            if do_commenting and not force and not click.confirm(
+                    'This will post comments for every task of run {} as {}, '
+                    'do you want to continue?'.format(run_id, username)):
+                click.echo('Commenting was cancelled!')
+                do_commenting = False
+
+            rate_limiter = RateLimiter(post_interval, post_per_minute, post_per_hour)
+            worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+
+            processor = TaskProcessor(
+                    make_client, stale_days, categories, pipeline, do_commenting,
+                    ledger=ledger, username=username, resolution_table=resolution_table,
+                    cooldowns=cooldowns, rate_limiter=rate_limiter,
+                    post_workers=post_workers, post_batch_size=post_batch_size)
+
+            click.echo('Worker {} processing run {}'.format(worker, run_id))
+            with metrics.phase('work'):
+                completed, failed = run_worker(queue, run_id, worker, processor.process)
+            metrics.set('tasks_completed', completed)
+            metrics.set('tasks_failed', failed)
+            click.echo('Completed {} tasks ({} attempts failed)'.format(completed, failed))
+        click.echo()
+
+        status = queue.status(run_id)
+        click.echo('Run {}: {}'.format(run_id, ', '.join(
+            '{} {}'.format(count, state) for state, count in status.items())))
+        if work and status['pending'] == 0 and status['leased'] == 0:
+            totals = {}
+            for payload, state, _, result, error in queue.results(run_id):
+                if state == 'failed':
+                    click.echo(' - {}: failed ({})'.format(describe_task(payload), error))
+                for key in ('posted', 'failed'):
+                    totals[key] = totals.get(key, 0) + (result or {}).get(key, 0)
+            click.echo('Comments posted by completed tasks: {} ({} failed)'.format(
+                totals.get('posted', 0), totals.get('failed', 0)))
+        click.echo()
+        queue.close()
 
-    all_prs = gh_client.fetch_pull_requests()
-    filtered_prs = filter_prs(all_prs, stale_days)
+        # Nothing is left for this process to classify or post
+        filtered_prs = {}
+        do_commenting = list_prs = list_comments = False
+    elif repositories:
+        # Repositories are classified as they are fetched, so both are timed
+        # together
+        with metrics.phase('fetch'):
+            results = sweep_repositories(
+                    token, repositories, stale_days, categories, fields=fields,
+                    transport=transport, tokens=tokens, workers=sweep_workers,
+                    alias_batch_size=alias_batch_size, endpoint=endpoint,
+                    pipeline=pipeline, response_cache=response_cache)
+
+        click.echo('Repository summary:')
+        for (owner, name), (repo_prs, error) in results.items():
+            if error:
+                click.echo(' - {}/{}: failed ({})'.format(owner, name, error))
+            else:
+                click.echo(' - {}/{}: {}'.format(owner, name, ', '.join(
+                    ['{} {}'.format(category, len(prs)) for category, prs in repo_prs.items()])))
+        click.echo()
+
+        filtered_prs = merge_sweep_results(results)
+    else:
+        snapshot = None
+        if from_snapshot:
+            snapshot = Snapshot(from_snapshot)
+            missing = required_fields - snapshot.fields
+            if missing:
+                raise click.ClickException('Snapshot does not contain the fields: {}'.format(
+                    ', '.join(sorted(missing))))
+            click.echo('Snapshot of {} taken at {} UTC ({} pull requests)'.format(
+                snapshot.repository, snapshot.taken_at, len(snapshot)))
+            click.echo()
+
+        cache = None
+        if cache_file and snapshot is None:
+            cache = PullRequestCache.load(cache_file, '{}/{}'.format(org, repo), fields)
+            if full_refresh:
+                cache.clear()
+            click.echo('Cached pull requests: {}'.format(len(cache)))
+
+        taken_at = datetime.utcnow()
+        with metrics.phase('fetch'):
+            if snapshot is not None:
+                # Pull requests are read from the snapshot as they are classified
+                all_prs = iter(snapshot)
+                taken_at = snapshot.taken_at
+            elif cache is not None:
+                all_prs = gh_client.fetch_pull_requests(cache)
+                cache.save()
+            elif two_pass:
+                all_prs = gh_client.fetch_stale_pull_requests(stale_days)
+            elif sharded_fetch:
+                all_prs = gh_client.fetch_pull_requests_sharded(workers=fetch_workers)
+            else:
+                # Classify pull requests as they arrive rather than waiting for
+                # them all (time spent waiting for pages is counted as fetching)
+                all_prs = metrics.timed_iterator('fetch', gh_client.iter_pull_requests())
+
+        # A snapshot holds every pull request, not just the stale ones
+        if save_snapshot:
+            all_prs = list(all_prs)
+
+        start = metrics.phases['fetch']
+        with metrics.phase('classify'):
+            if pipeline is not None:
+                filtered_prs = pipeline.classify(all_prs, stale_days, taken_at).categories
+            else:
+                filtered_prs = filter_prs(all_prs, stale_days, categories, taken_at)
+        metrics.add_time('classify', start - metrics.phases['fetch'])
+
+        if save_snapshot:
+            with metrics.phase('snapshot'):
+                count = write_snapshot(
+                        save_snapshot, all_prs,
+                        snapshot.repository if snapshot else '{}/{}'.format(org, repo),
+                        snapshot.fields if snapshot else fields, taken_at, filtered_prs)
+            click.echo('Saved {} pull requests to {}'.format(count, save_snapshot))
+            click.echo()
+
+        if snapshot is not None:
+            snapshot.close()
+
+    metrics.set_categories(filtered_prs)
+
+    if pipeline is not None and rule_stats:
+        click.echo('Rule statistics:')
+        for stats in pipeline.statistics():
+            click.echo(' - {}: {} of {} matched ({:.1%}), {:.6f} s, evaluated as {}'.format(
+                stats['name'], stats['hits'], stats['evaluations'], stats['hit_rate'],
+                stats['seconds'], ' and '.join(stats['order']) or 'always'))
+        click.echo()
+
+    if ledger is not None and ledger.is_empty() and username is not None and \
+            not (enqueue or work):
+        stale_prs = {pr['id']: pr for prs in filtered_prs.values() for pr in prs}
+        click.echo('Rebuilt comment ledger from {} earlier comments'.format(
+            ledger.rebuild(stale_prs.values(), username)))
+        click.echo()
 
     # List all PRs in each category
     if list_prs:
@@ -60,8 +446,44 @@ def main(token, stale_days, org, repo, list_prs, list_comments, do_commenting, f
 
     # Generate the list of comments
     comments = None
-    if list_comments or do_commenting:
-        comments = generate_resolution_comments(filtered_prs)
+    digests = None
+    if digest_issue and (list_comments or do_commenting):
+        problems = [(pr, problem_type) for problem_type, prs in filtered_prs.items()
+                    for pr in prs]
+
+        if ledger is not None:
+            problems, suppressed = ledger.filter_problems(problems, cooldowns)
+            metrics.set('comments_suppressed', len(suppressed))
+            click.echo('Skipping {} problems raised within their cooldown'.format(
+                len(suppressed)))
+            click.echo()
+
+        # The issue is only looked up when the digests are to be posted
+        issue = {'id': None, 'number': digest_issue,
+                 'url': 'https://github.com/{}/{}/issues/{}'.format(org, repo, digest_issue)}
+        if do_commenting:
+            issue = gh_client.fetch_issue(digest_issue)
+            if issue is None:
+                raise click.ClickException('Issue #{} not found in {}/{}'.format(
+                    digest_issue, org, repo))
+
+        with metrics.phase('render'):
+            digests = generate_digests(problems, resolution_table)
+            comments = [(issue, render_digest(user, user_problems))
+                        for user, user_problems in digests.items()]
+        click.echo('Digests for {} users covering {} problems'.format(
+            len(digests), len(problems)))
+        click.echo()
+    elif list_comments or do_commenting:
+        with metrics.phase('render'):
+            comments = generate_resolution_comments(filtered_prs, resolution_table)
+
+        if ledger is not None:
+            comments, suppressed = ledger.filter_comments(comments, cooldowns)
+            metrics.set('comments_suppressed', len(suppressed))
+            click.echo('Skipping {} comments on problems raised within their cooldown'.format(
+                len(suppressed)))
+            click.echo()
 
     # Print the list of comments for review
     if list_comments:
@@ -75,13 +497,59 @@ def main(token, stale_days, org, repo, list_prs, list_comments, do_commenting, f
     # Post comments on pull requests
     if do_commenting and comments:
         if force or click.confirm(
-                'This will post several comments to {}/{} as {}, '
-                'do you want to continue?'.format(org, repo, username)):
+                'This will post several comments to {} as {}, '
+                'do you want to continue?'.format(target, username)):
             click.echo('Posting comments')
-            gh_client.post_comments_on_pull_requests(comments)
+            with metrics.phase('post'):
+                results = gh_client.post_comments_on_pull_requests(
+                        comments, workers=post_workers,
+                        rate_limiter=RateLimiter(post_interval, post_per_minute,
+                                                 post_per_hour),
+                        batch_size=post_batch_size)
+
+            if ledger is not None and digests is not None:
+                # Every problem listed in a digest that was posted was raised
+                ledger.record_many([
+                    (pr['id'], problem_type, None)
+                    for user_problems, (_, success, _) in zip(digests.values(), results)
+                    if success for pr, problem_type in user_problems])
+            elif ledger is not None:
+                ledger.record_results(comments, results)
+
+            failures = [r for r in results if not r[1]]
+            metrics.set('comments_posted', len(results) - len(failures))
+            metrics.set('comments_failed', len(failures))
+            click.echo('Posted {} of {} comments'.format(
+                len(results) - len(failures), len(results)))
+            for pr, _, error in failures:
+                click.echo(' - #{} failed: {}'.format(pr['number'], error))
         else:
             click.echo('Commenting was cancelled!')
 
+    click.echo('Rate limit points used: {} (remaining: {})'.format(
+        tokens.total_cost, tokens.remaining))
+    if len(tokens.tokens) > 1:
+        for i, t in enumerate(tokens.tokens):
+            budget = tokens.budgets[t]
+            click.echo(' - token {}: {} used (remaining: {})'.format(
+                i, budget.total_cost, budget.remaining))
+
+    if response_cache is not None:
+        click.echo('Response cache: {} hits, {} misses'.format(
+            response_cache.hits, response_cache.misses))
+        metrics.set('response_cache_hits', response_cache.hits)
+        metrics.set('response_cache_misses', response_cache.misses)
+        response_cache.close()
+
+    metrics.set('graphql_cost', tokens.total_cost)
+    if tokens.remaining is not None:
+        metrics.set('graphql_remaining', tokens.remaining)
+
+    if metrics_json:
+        metrics.write_json(metrics_json)
+    if metrics_prom:
+        metrics.write_prometheus(metrics_prom)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Metrics(object):
+    """
+    Thread safe collection of the measurements made during a run.
+
+    Three kinds of measurement are recorded:
+        - phases: wall time (in seconds) spent in each phase of the run
+        - counters: totals such as HTTP requests or bytes transferred
+        - categories: number of pull requests in each problem category
+    """
+
+    # Prefix of all exported Prometheus metric names
+    prefix = 'mantid_pr_bot'
+
+    def __init__(self, labels=None):
+        """
+        @param labels Dictionary of labels applied to all exported metrics
+        """
+        self.labels = OrderedDict(sorted((labels or {}).items()))
+        self._lock = threading.Lock()
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+        self.categories = OrderedDict()
+        self.start_time = time.time()
+
+    def add_time(self, phase, seconds):
+        """
+        Adds time to a phase.
+        """
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager recording the time spent in a phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed_iterator(self, phase, iterable):
+        """
+        Wraps an iterable, recording the time spent producing each item in a
+        phase (e.g. time spent waiting for pages of a streamed fetch).
+
+        @param phase Name of the phase
+        @param iterable Iterable to wrap
+        @return Iterator over the items of iterable
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(phase, time.perf_counter() - start)
+                return
+            self.add_time(phase, time.perf_counter() - start)
+            yield item
+
+    def increment(self, name, value=1):
+        """
+        Increments a counter.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        """
+        Sets a counter to a value.
+        """
+        with self._lock:
+            self.counters[name] = value
+
+    def set_categories(self, sorted_prs):
+        """
+        Records the number of pull requests in each problem category.
+
+        @param sorted_prs Dictionary of problem type to list of pull requests
+        """
+        with self._lock:
+            self.categories = OrderedDict(
+                (name, len(prs)) for name, prs in sorted_prs.items())
+
+    def as_dict(self):
+        """
+        @return Dictionary of all measurements
+        """
+        with self._lock:
+            return OrderedDict([
+                ('labels', dict(self.labels)),
+                ('start_time', self.start_time),
+                ('duration', time.time() - self.start_time),
+                ('phases', dict(self.phases)),
+                ('counters', dict(self.counters)),
+                ('categories', dict(self.categories)),
+            ])
+
+    def write_json(self, filename):
+        """
+        Writes all measurements to a JSON file.
+        """
+        _write_atomic(filename, json.dumps(self.as_dict(), indent=2))
+
+    def write_prometheus(self, filename):
+        """
+        Writes all measurements to a file in the Prometheus text exposition
+        format, for use with the node_exporter textfile collector.
+        """
+        data = self.as_dict()
+        lines = []
+
+        def metric(name, help_text, samples):
+            name = '{}_{}'.format(self.prefix, name)
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} gauge'.format(name))
+            for labels, value in samples:
+                lines.append('{}{} {}'.format(name, self._format_labels(labels), value))
+
+        metric('last_run_timestamp_seconds', 'Time the run started.',
+               [({}, data['start_time'])])
+        metric('run_duration_seconds', 'Wall time of the whole run.',
+               [({}, data['duration'])])
+        metric('phase_duration_seconds', 'Wall time spent in each phase of the run.',
+               [({'phase': p}, v) for p, v in data['phases'].items()])
+        for name, value in data['counters'].items():
+            metric(name, 'Value of the {} counter at the end of the run.'.format(name),
+                   [({}, value)])
+        metric('category_pull_requests', 'Number of pull requests in each problem category.',
+               [({'category': c}, v) for c, v in data['categories'].items()])
+
+        _write_atomic(filename, '\n'.join(lines) + '\n')
+
+    def _format_labels(self, labels):
+        all_labels = OrderedDict(self.labels)
+        all_labels.update(labels)
+        if not all_labels:
+            return ''
+        return '{{{}}}'.format(','.join(
+            '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+            for k, v in all_labels.items()))
+
+
+def _write_atomic(filename, text):
+    # The textfile collector may read the file at any time, never let it see a
+    # partially written file
+    tmp_filename = '{}.tmp'.format(filename)
+    with open(tmp_filename, 'w') as f:
+        f.write(text)
+    os.replace(tmp_filename, filename)
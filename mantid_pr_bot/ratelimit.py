@@ -0,0 +1,283 @@
+import threading
+import time
+
+from collections import deque
+
+
+class RateLimiter(object):
+    """
+    Thread safe limiter of the rate at which content is created.
+
+    GitHub's secondary rate limits for content creation advise waiting at least
+    one second between mutations, no more than 80 per minute and 500 per
+    hour, regardless of how many requests are in flight at once. Each mutation
+    counts, so a request carrying several (aliased) mutations is charged for
+    all of them.
+    """
+
+    def __init__(self, min_interval=1.0, per_minute=80, per_hour=500):
+        """
+        @param min_interval Minimum number of seconds between two mutations
+        @param per_minute Maximum number of mutations in any minute (None for no limit)
+        @param per_hour Maximum number of mutations in any hour (None for no limit)
+        """
+        self.min_interval = min_interval
+        self.windows = [(60.0, per_minute), (3600.0, per_hour)]
+        self.windows = [(length, limit) for length, limit in self.windows if limit]
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+        # Times and sizes of the reservations made within the longest window
+        self._sent = deque()
+
+    def wait(self, count=1):
+        """
+        Blocks until the caller is allowed to send a request.
+
+        @param count Number of mutations in the request
+        """
+        for length, limit in self.windows:
+            if count > limit:
+                raise ValueError('Cannot send {} mutations at once, at most {} are allowed in '
+                                 '{:.0f} seconds'.format(count, limit, length))
+
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+
+            longest = max([length for length, _ in self.windows] or [0.0])
+            while self._sent and self._sent[0][0] <= now - longest:
+                self._sent.popleft()
+
+            # Delay the request until every window has room for it
+            delayed = True
+            while delayed:
+                delayed = False
+                for length, limit in self.windows:
+                    in_window = [(t, n) for t, n in self._sent if t > start - length]
+                    excess = sum(n for _, n in in_window) + count - limit
+                    for t, n in in_window:
+                        if excess <= 0:
+                            break
+                        # Room is made as the oldest reservations leave the window
+                        excess -= n
+                        start = t + length
+                        delayed = True
+
+            self._sent.append((start, count))
+            self._next_time = start + self.min_interval * count
+            wait_time = start - now
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class RateLimitExceeded(RuntimeError):
+    """
+    Raised when a query would exhaust the GraphQL rate limit budget.
+    """
+    pass
+
+
+class RateLimitBudget(object):
+    """
+    Thread safe tracker of the GraphQL rate limit budget of an access token.
+
+    The budget is updated from the rateLimit object returned by queries (or the
+    X-RateLimit headers of responses that do not include it) and checked by
+    TokenPool.acquire before a query is sent with the token.
+    """
+
+    def __init__(self, reserve=50):
+        """
+        @param reserve Number of points that should never be spent
+        """
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self.remaining = None
+        self.reset_time = None
+        self.last_cost = None
+        self.total_cost = 0
+
+    def update(self, remaining, reset_time, cost=None):
+        """
+        Records the state of the budget reported by GitHub.
+
+        @param remaining Number of points remaining
+        @param reset_time Unix time at which the budget resets
+        @param cost Cost of the query that reported the budget (if known)
+        """
+        with self._lock:
+            self.remaining = remaining
+            self.reset_time = reset_time
+            if cost is not None:
+                self.last_cost = cost
+                self.total_cost += cost
+
+
+class TokenPool(object):
+    """
+    Thread safe pool of access tokens, each with its own RateLimitBudget.
+
+    Each query is sent with the token that has the most budget left, less the
+    estimated cost of the queries already in flight with it. A token whose
+    budget would be eaten into beyond its reserve is set aside until the
+    budget resets, or until queries in flight with it complete if they are
+    all that stands in the way. Only when every token is set aside does the
+    caller wait, failing with RateLimitExceeded rather than waiting more than
+    max_wait seconds for a budget to reset, so that it does not run out part
+    way through a paginated fetch.
+    """
+
+    # Hourly GraphQL budget assumed for a token before GitHub has reported it
+    default_limit = 5000
+
+    def __init__(self, tokens=(), reserve=50, max_wait=0):
+        """
+        @param tokens Access tokens to share queries between
+        @param reserve Number of points of each token's budget that should
+                       never be spent
+        @param max_wait Maximum number of seconds to wait for a budget to
+                        reset, beyond which RateLimitExceeded is raised
+        """
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self.tokens = []
+        self.budgets = {}
+        self._in_flight = {}
+        for token in tokens:
+            self.add(token)
+
+    def add(self, token):
+        """
+        Adds a token to the pool, if it is not already in it.
+
+        @param token Access token
+        @return RateLimitBudget of the token
+        """
+        with self._lock:
+            if token not in self.budgets:
+                self.tokens.append(token)
+                self.budgets[token] = RateLimitBudget(self.reserve)
+                self._in_flight[token] = 0
+            return self.budgets[token]
+
+    @property
+    def last_cost(self):
+        """
+        Highest cost of the last query made with each token (None if unknown).
+        """
+        costs = [b.last_cost for b in self.budgets.values() if b.last_cost is not None]
+        return max(costs) if costs else None
+
+    @property
+    def total_cost(self):
+        return sum(b.total_cost for b in self.budgets.values())
+
+    @property
+    def remaining(self):
+        """
+        Total points remaining of the tokens whose budget is known (None if
+        none are).
+        """
+        remaining = [b.remaining for b in self.budgets.values() if b.remaining is not None]
+        return sum(remaining) if remaining else None
+
+    def acquire(self, expected_cost=1, token=None):
+        """
+        Chooses the token to send a query with, blocking until one has the
+        budget for it.
+
+        @param expected_cost Estimated cost of the query
+        @param token Token the query must be sent with (defaults to any)
+        @return Token to send the query with, to be given to release once the
+                query has completed
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                best = None
+                best_headroom = None
+                next_reset = None
+                in_flight_only = False
+                for candidate in [token] if token is not None else self.tokens:
+                    budget = self.budgets[candidate]
+                    remaining = budget.remaining
+                    if remaining is None or budget.reset_time is None or \
+                            budget.reset_time <= now:
+                        remaining = self.default_limit
+
+                    headroom = remaining - self._in_flight[candidate] - expected_cost
+                    if headroom < budget.reserve:
+                        if remaining - expected_cost >= budget.reserve:
+                            # Set aside until queries in flight with it complete
+                            in_flight_only = True
+                        elif budget.reset_time is not None and \
+                                (next_reset is None or budget.reset_time < next_reset):
+                            # Set aside until its budget resets
+                            next_reset = budget.reset_time
+                        continue
+
+                    if best is None or headroom > best_headroom:
+                        best = candidate
+                        best_headroom = headroom
+
+                if best is not None:
+                    self._in_flight[best] += expected_cost
+                    return best
+
+            if in_flight_only:
+                # Budget held by queries in flight is freed as soon as they
+                # complete, however long their tokens' budgets take to reset
+                time.sleep(0.05)
+                continue
+
+            wait_time = next_reset - time.time() if next_reset is not None else 0.0
+            if wait_time > self.max_wait:
+                raise RateLimitExceeded(
+                    'Rate limit budget of {} exhausted, resets in {:.0f} seconds'.format(
+                        'the token' if token is not None or len(self.tokens) == 1
+                        else 'all {} tokens'.format(len(self.tokens)), wait_time))
+
+            time.sleep(max(0.05, wait_time))
+
+    def release(self, token, expected_cost=1):
+        """
+        Records that a query sent with a token (see acquire) has completed.
+
+        @param token Token the query was sent with
+        @param expected_cost Estimated cost given to acquire
+        """
+        with self._lock:
+            self._in_flight[token] = max(0, self._in_flight[token] - expected_cost)
+
+
+def adapt_page_size(page_size, latency, cost=None, remaining=None, reserve=0,
+                    target_latency=5.0, minimum=5, maximum=100):
+    """
+    Chooses the size of the next page of a paginated query.
+
+    The page size is scaled towards the size expected to take the target
+    latency (by at most a factor of two in either direction), then limited so
+    that the estimated cost of the next page fits in the remaining budget.
+
+    @param page_size Size of the last page
+    @param latency Seconds taken to fetch the last page
+    @param cost Rate limit cost of the last page (if known)
+    @param remaining Remaining rate limit budget (if known)
+    @param reserve Number of points of the budget that should not be spent
+    @param target_latency Desired number of seconds to fetch a page
+    @param minimum Smallest allowed page size
+    @param maximum Largest allowed page size (100 is the maximum GitHub allows)
+    @return Size of the next page
+    """
+    scale = target_latency / latency if latency > 0 else 2.0
+    scale = min(2.0, max(0.5, scale))
+    new_size = int(page_size * scale)
+
+    if cost and remaining is not None:
+        cost_per_item = float(cost) / page_size
+        affordable = int((remaining - reserve) / cost_per_item)
+        new_size = min(new_size, affordable)
+
+    return min(maximum, max(minimum, new_size))
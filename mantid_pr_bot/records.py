@@ -0,0 +1,178 @@
+import sys
+
+from calendar import timegm
+from datetime import datetime, timedelta
+from enum import IntEnum
+from time import gmtime, strftime, strptime
+
+from .filtering import get_markdown_comment_in_comment
+
+
+# Format of timestamps in GitHub API responses
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class ReviewState(IntEnum):
+    """
+    State of a pull request review.
+    """
+    OTHER = 0
+    APPROVED = 1
+    COMMENTED = 2
+    PENDING = 3
+    CHANGES_REQUESTED = 4
+    DISMISSED = 5
+
+
+def parse_timestamp(text):
+    """
+    Converts a GitHub timestamp to seconds since the epoch.
+    """
+    return timegm(strptime(text, TIME_FORMAT))
+
+
+def format_timestamp(seconds):
+    """
+    Converts seconds since the epoch to a GitHub timestamp.
+    """
+    return strftime(TIME_FORMAT, gmtime(seconds))
+
+
+def _intern(login):
+    return sys.intern(login) if login else login
+
+
+class PullRequestRecord(object):
+    """
+    Compact representation of a pull request, holding only what the problem
+    category predicates and recipient functions need.
+
+    Logins are interned, so those of frequent contributors are stored once,
+    review states are small integers and the bodies of comments are discarded
+    once any machine readable markdown comment (see
+    resolutions.fill_random_response_message) has been extracted.
+
+    The top level fields of the original pull request can still be read by
+    key (e.g. pr['number']), so records can be used wherever pull requests are
+    only identified or reported on.
+    """
+
+    __slots__ = (
+        'id',
+        'number',
+        'state',
+        'url',
+        'updated_at',
+        'mergeable',
+        'commit_oid',
+        'author',
+        'committer',
+        'ci_state',
+        'review_states',
+        'review_authors',
+        'requested_reviewers',
+        'marked_comments',
+    )
+
+    # Top level pull request fields that can be read by key
+    _keys = {
+        'id': 'id',
+        'number': 'number',
+        'state': 'state',
+        'url': 'url',
+        'mergeable': 'mergeable',
+    }
+
+    def __getitem__(self, key):
+        if key == 'updatedAt':
+            return format_timestamp(self.updated_at)
+        try:
+            return getattr(self, self._keys[key])
+        except KeyError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    @property
+    def developers(self):
+        """
+        Same as resolutions.get_pr_developer.
+        """
+        if self.author is None or self.committer is None:
+            return []
+        return [self.author] if self.author == self.committer else [self.author, self.committer]
+
+    @property
+    def pending_reviewers(self):
+        """
+        Same as resolutions.get_pending_reviewers.
+        """
+        return [a for s, a in zip(self.review_states, self.review_authors)
+                if s == ReviewState.PENDING]
+
+    def elapsed_days(self, now):
+        """
+        Gets the number of whole days since the pull request was last updated.
+
+        @param now Naive UTC datetime to measure from
+        """
+        return (now - (EPOCH + timedelta(seconds=self.updated_at))).days
+
+
+def parse_pull_request(pr):
+    """
+    Converts a pull request from the GitHub API to a PullRequestRecord.
+
+    @param pr Pull request as returned by GitHubClient
+    @return PullRequestRecord
+    """
+    record = PullRequestRecord()
+    record.id = pr['id']
+    record.number = pr['number']
+    record.state = _intern(pr.get('state', 'OPEN'))
+    record.url = pr['url']
+    record.updated_at = parse_timestamp(pr['updatedAt'])
+    record.mergeable = _intern(pr.get('mergeable', None))
+
+    try:
+        commit = pr['commits']['nodes'][0]['commit']
+    except (KeyError, IndexError, TypeError):
+        commit = {}
+
+    def login(user):
+        return _intern(user['login']) if user else None
+
+    record.commit_oid = commit.get('oid', None)
+    record.author = login((commit.get('author', None) or {}).get('user', None))
+    record.committer = login((commit.get('committer', None) or {}).get('user', None))
+    record.ci_state = _intern((commit.get('status', None) or {}).get('state', ''))
+
+    reviews = (pr.get('reviews', None) or {}).get('nodes', [])
+    record.review_states = tuple(
+        ReviewState[r['state']] if r['state'] in ReviewState.__members__ else ReviewState.OTHER
+        for r in reviews)
+    record.review_authors = tuple(login(r['author']) for r in reviews)
+
+    # Requests from teams come back without a login (only users are queried
+    # for one) and are kept as None, so they still count as review requests
+    review_requests = (pr.get('reviewRequests', None) or {}).get('nodes', [])
+    record.requested_reviewers = tuple(
+        login(rr['requestedReviewer']) for rr in review_requests)
+
+    # Keep (author, time posted, markdown comment) of only the comments that
+    # carry a markdown comment
+    comments = (pr.get('comments', None) or {}).get('nodes', [])
+    marked = []
+    for c in comments:
+        md_comment = get_markdown_comment_in_comment(c['body'])
+        if md_comment:
+            marked.append((login(c['author']), c['createdAt'], md_comment[0]))
+    record.marked_comments = tuple(marked)
+
+    return record
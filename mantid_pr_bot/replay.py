@@ -0,0 +1,160 @@
+import json
+import os
+import random
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+
+from . import columnar, workflow
+from .records import TIME_FORMAT, parse_pull_request
+from .resolutions import generate_resolution_comments
+from .snapshot import Snapshot, is_snapshot
+
+
+def find_snapshots(directory):
+    """
+    Finds the snapshot files in a directory.
+
+    @param directory Directory to search
+    @return Sorted list of paths to snapshot files
+    """
+    paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+    return [p for p in paths if os.path.isfile(p) and is_snapshot(p)]
+
+
+def replay_snapshot(filename, stale_days_thresholds, enabled_categories=None,
+                    comments=False, seed=0):
+    """
+    Classifies the pull requests of a snapshot as of the time it was taken.
+
+    Pull requests are read once and classified for every staleness threshold,
+    using the columnar classification when NumPy is installed.
+
+    @param filename Path to the snapshot file
+    @param stale_days_thresholds List of numbers of days of inactivity after
+                                 which a PR is "stale"
+    @param enabled_categories Names of the categories to evaluate (defaults to all)
+    @param comments If the comments that would have been posted are generated
+    @param seed Seed for the choice of comment messages (combined with the
+                snapshot file name, so results do not depend on scheduling)
+    @return Dictionary of results
+    """
+    with Snapshot(filename) as snapshot:
+        taken_at = snapshot.taken_at
+        repository = snapshot.repository
+        prs = list(snapshot)
+
+    # Records avoid parsing timestamps again for every threshold
+    table = None
+    if columnar.np is not None:
+        table = columnar.FeatureTable(prs)
+    else:
+        prs = [parse_pull_request(pr) for pr in prs]
+
+    thresholds = []
+    for stale_days in stale_days_thresholds:
+        if table is not None:
+            sorted_prs = columnar.filter_table(table, stale_days, enabled_categories, taken_at)
+        else:
+            sorted_prs = workflow.filter_prs(prs, stale_days, enabled_categories, taken_at)
+
+        result = OrderedDict()
+        result['stale_days'] = stale_days
+        result['categories'] = OrderedDict(
+            (name, len(category_prs)) for name, category_prs in sorted_prs.items())
+
+        if comments:
+            random.seed('{}:{}'.format(seed, os.path.basename(filename)))
+            result['comments'] = [
+                OrderedDict([('number', pr['number']), ('text', text)])
+                for pr, text in generate_resolution_comments(sorted_prs)]
+
+        thresholds.append(result)
+
+    return OrderedDict([
+        ('snapshot', os.path.basename(filename)),
+        ('repository', repository),
+        ('taken_at', taken_at.strftime(TIME_FORMAT)),
+        ('pull_requests', len(prs)),
+        ('thresholds', thresholds),
+    ])
+
+
+def _replay_snapshot(args):
+    return replay_snapshot(*args)
+
+
+def replay_snapshots(filenames, stale_days_thresholds, enabled_categories=None,
+                     comments=False, seed=0, workers=None):
+    """
+    Classifies the pull requests of several snapshots, across a pool of
+    processes.
+
+    @param filenames Paths to the snapshot files
+    @param workers Number of processes (defaults to the number of CPUs, 1 to
+                   replay in this process)
+    @return List of results of replay_snapshot, ordered by the time each
+            snapshot was taken
+    """
+    tasks = [(f, stale_days_thresholds, enabled_categories, comments, seed) for f in filenames]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) < 2:
+        results = [_replay_snapshot(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Snapshots are cheap to classify, so hand them out in chunks
+            chunk_size = max(1, len(tasks) // (workers * 4))
+            results = list(executor.map(_replay_snapshot, tasks, chunksize=chunk_size))
+
+    return sorted(results, key=lambda r: r['taken_at'])
+
+
+@click.command()
+@click.option('--snapshots', type=click.Path(exists=True, file_okay=False), required=True,
+              help='Directory of snapshots (see --save-snapshot) to replay.')
+@click.option('--stale-days', type=int, multiple=True,
+              help='Number of days of inactivity after which a PR is stale '
+                   '(may be repeated to compare thresholds, defaults to 14).')
+@click.option('--category', 'categories', multiple=True,
+              type=click.Choice([c[0] for c in workflow.categories]),
+              help='Problem category to check (may be repeated, defaults to all).')
+@click.option('--comments', is_flag=True,
+              help='Include the comments that would have been posted in the output.')
+@click.option('--seed', type=int, default=0,
+              help='Seed for the choice of comment messages.')
+@click.option('--workers', type=int,
+              help='Number of processes to replay snapshots in (defaults to the number of CPUs).')
+@click.option('--output', type=click.File('w'),
+              help='File to write the results of every snapshot to as JSON.')
+def main(snapshots, stale_days, categories, comments, seed, workers, output):
+    """
+    Replays archived snapshots of pull requests, reporting the number of pull
+    requests that would have been in each problem category (and optionally the
+    comments that would have been posted) at the time each was taken.
+    """
+    stale_days = list(stale_days) or [14]
+    categories = list(categories) or None
+
+    filenames = find_snapshots(snapshots)
+    click.echo('Replaying {} snapshots'.format(len(filenames)))
+    click.echo()
+
+    results = replay_snapshots(filenames, stale_days, categories, comments, seed, workers)
+
+    names = categories or [c[0] for c in workflow.categories]
+    click.echo('{:<20} {:>10}  {}'.format('taken_at', 'stale_days', '  '.join(names)))
+    for result in results:
+        for threshold in result['thresholds']:
+            click.echo('{:<20} {:>10}  {}'.format(
+                result['taken_at'], threshold['stale_days'], '  '.join(
+                    ['{:>{}}'.format(threshold['categories'][n], len(n)) for n in names])))
+
+    if output:
+        json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
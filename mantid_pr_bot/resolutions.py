@@ -1,8 +1,11 @@
 import json
 
+from collections import OrderedDict
 from random import randrange
 from string import Template
 
+from .records import PullRequestRecord
+
 
 def get_admins(pr):
     """
@@ -24,6 +27,9 @@ def get_pr_developer(pr):
 
     @return Single element list containing current developer
     """
+    if isinstance(pr, PullRequestRecord):
+        return pr.developers
+
     try:
         author = pr['commits']['nodes'][0]['commit']['author']['user']['login']
         committer = pr['commits']['nodes'][0]['commit']['committer']['user']['login']
@@ -39,6 +45,9 @@ def get_pending_reviewers(pr):
 
     @return List of usernames of pending review authors.
     """
+    if isinstance(pr, PullRequestRecord):
+        return pr.pending_reviewers
+
     return [r['author']['login'] for r in pr['reviews']['nodes'] if r['state'] == 'PENDING']
 
 
@@ -47,9 +56,15 @@ def get_requested_reviewers(pr):
     Gets a list of users who have outstanding review requests on a pull
     request.
 
+    Review requests from teams have no login and are left out.
+
     @return List of users from which reviews are requested
     """
-    return [rr['requestedReviewer']['login'] for rr in pr['reviewRequests']['nodes']]
+    if isinstance(pr, PullRequestRecord):
+        return [r for r in pr.requested_reviewers if r]
+
+    return [rr['requestedReviewer']['login'] for rr in pr['reviewRequests']['nodes']
+            if (rr['requestedReviewer'] or {}).get('login', None)]
 
 
 resolutions = {
@@ -90,6 +105,49 @@ resolutions = {
     ])
 }
 
+# Short description of each problem type, used to list problems in digests
+problem_descriptions = {
+    'generic': 'needs attention',
+    'no_dev': 'has no developer',
+    'conflicting': 'has merge conflicts',
+    'failing': 'has a failing build',
+    'unreviewed': 'has not been put up for review',
+    'pending_review': 'has a review in progress',
+    'pending_gatekeeper': 'is ready for a second review',
+    'review_requested': 'has a review requested',
+    'ignored_review': 'has review comments to address',
+}
+
+# Pull request fields (see github.PULL_REQUEST_FIELDS) needed by each of the
+# functions that select the users to notify
+recipient_fields = {
+    get_admins: set(),
+    get_pr_developer: {'commits'},
+    get_pending_reviewers: {'reviews'},
+    get_requested_reviewers: {'reviewRequests'},
+}
+
+
+def get_required_fields(problem_types, table=None):
+    """
+    Gets the pull request fields required to generate comments for a set of
+    problem types.
+
+    @param problem_types Names of the problem types comments are generated for
+    @param table Resolutions to use instead of the built in ones (see
+                 rules.build_resolutions)
+    @return Set of field names
+    """
+    if table is None:
+        table = resolutions
+
+    fields = set()
+    for problem_type in problem_types:
+        if problem_type not in table.keys():
+            problem_type = 'generic'
+        fields |= recipient_fields[table[problem_type][0]]
+    return fields
+
 
 def fill_message_template(template, usernames):
     """
@@ -108,21 +166,26 @@ def fill_message_template(template, usernames):
     return msg_str
 
 
-def fill_random_response_message(problem_type, pr):
+def fill_random_response_message(problem_type, pr, table=None):
     """
     Selects and generates a random comment text for a PR, extracting the
     relevant users to be notified.
 
     @param problem_type Type of problem message desired
     @param pr Pull request to process
+    @param table Resolutions to use instead of the built in ones (see
+                 rules.build_resolutions)
     @return Comment text
     """
-    if problem_type not in resolutions.keys():
+    if table is None:
+        table = resolutions
+
+    if problem_type not in table.keys():
         problem_type = 'generic'
 
-    usernames = resolutions[problem_type][0](pr)
-    idx = randrange(0, len(resolutions[problem_type][1]))
-    user_msg = fill_message_template(resolutions[problem_type][1][idx], usernames)
+    usernames = table[problem_type][0](pr)
+    idx = randrange(0, len(table[problem_type][1]))
+    user_msg = fill_message_template(table[problem_type][1][idx], usernames)
 
     machine_msg = json.dumps({'problem_type': problem_type})
 
@@ -131,15 +194,65 @@ def fill_random_response_message(problem_type, pr):
     return msg_str
 
 
-def generate_resolution_comments(sorted_prs):
+def generate_resolution_comments(sorted_prs, table=None):
     """
     Generates a resolution comment for each sorted pull request.
 
     @param sorted_prs Dictionary of response type to list of pull requests
+    @param table Resolutions to use instead of the built in ones (see
+                 rules.build_resolutions)
     @return List of (pull request, comment text) tuples
     """
     comments = []
     for problem_type, prs in sorted_prs.items():
         comments.extend(
-                [(pr, fill_random_response_message(problem_type, pr)) for pr in prs])
+                [(pr, fill_random_response_message(problem_type, pr, table)) for pr in prs])
     return comments
+
+
+def generate_digests(problems, table=None):
+    """
+    Groups problems by the users that would be notified of them, so each user
+    can be sent a single digest rather than a comment on every pull request.
+
+    Problems on pull requests with nobody to notify (e.g. a pull request
+    without a developer) are sent to the admins.
+
+    @param problems List of (pull request, problem type) tuples
+    @param table Resolutions to use instead of the built in ones (see
+                 rules.build_resolutions)
+    @return Ordered dictionary of username to list of (pull request, problem
+            type) tuples, in the order users were first notified
+    """
+    if table is None:
+        table = resolutions
+
+    digests = OrderedDict()
+    for pr, problem_type in problems:
+        recipients = table.get(problem_type, table['generic'])[0]
+        for username in recipients(pr) or get_admins(pr):
+            digests.setdefault(username.strip(), []).append((pr, problem_type))
+    return digests
+
+
+def render_digest(username, problems):
+    """
+    Generates the text of a digest, listing each of a user's pull requests
+    and its problems.
+
+    @param username User the digest is for
+    @param problems List of (pull request, problem type) tuples
+    @return Comment text
+    """
+    by_pr = OrderedDict()
+    for pr, problem_type in problems:
+        by_pr.setdefault(pr['url'], []).append(
+            problem_descriptions.get(problem_type, problem_type.replace('_', ' ')))
+
+    lines = ['@{} the following pull requests need your attention:'.format(username), '']
+    lines += ['- {} {}'.format(url, ', '.join(descriptions))
+              for url, descriptions in by_pr.items()]
+
+    machine_msg = json.dumps({'digest': username})
+
+    return '{}\n<!-- {} -->'.format('\n'.join(lines), machine_msg)
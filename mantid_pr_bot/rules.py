@@ -0,0 +1,386 @@
+"""
+Problem categories defined in a configuration file rather than in
+workflow.categories and resolutions.resolutions.
+
+Rules are read from a TOML (Python 3.11+, or with tomli installed) or JSON
+file. Each rule names a problem category, the checks a stale pull request must
+pass to be in it and, optionally, who is notified and with which messages
+(defaulting to those in resolutions.py for a category of the same name):
+
+    [[rules]]
+    name = "failing"
+    recipients = "developer"
+    messages = ["$users the build is failing, can you investigate."]
+    when = [{check = "ci_status", status = "FAILURE"}]
+
+See rules.example.toml for rules equivalent to the built in categories.
+"""
+
+import json
+import re
+import threading
+import time
+
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+from functools import partial
+from string import Template
+
+from . import filtering, resolutions
+from .classify import Classification, elapsed_days_since_update, extract_features_with_age
+
+
+def _count_between(attribute, min=0, max=None):
+    def predicate(f):
+        count = getattr(f, attribute)
+        return count >= min and (max is None or count <= max)
+    return predicate
+
+
+# Checks that rules are built from, each the pull request fields it needs (see
+# github.PULL_REQUEST_FIELDS) and a function creating a predicate over
+# PullRequestFeatures from the parameters given in the rule, mostly the
+# predicates of filtering.py.
+checks = {
+    'stale': (set(), lambda days: lambda f: filtering.has_pr_not_been_updated_since(
+        days, f.elapsed_days)),
+    'no_developer': ({'commits'},
+                     lambda: filtering.is_author_of_last_commit_no_longer_a_mantid_dev),
+    'merge_conflicts': ({'mergeable'}, lambda: filtering.does_this_pr_have_merge_conflicts),
+    'ci_status': ({'commits'},
+                  lambda status='SUCCESS': partial(filtering.was_ci_status_of_last_pr, status)),
+    'reviews': ({'reviews'}, lambda min=0, max=None: _count_between('review_count', min, max)),
+    'review_requests': ({'reviewRequests'},
+                        lambda min=0, max=None: _count_between('review_request_count',
+                                                               min, max)),
+    'pending_review': ({'reviews'}, lambda: filtering.has_a_reviewer_not_reviewed_this_pr),
+    'changes_requested': ({'reviews'},
+                          lambda: filtering.has_the_author_not_responded_to_review_comments),
+    'all_reviews_approved': ({'reviews'}, lambda: lambda f: f.all_reviews_approved),
+}
+
+# Users that can be notified by a rule
+recipients = {
+    'admins': resolutions.get_admins,
+    'developer': resolutions.get_pr_developer,
+    'pending_reviewers': resolutions.get_pending_reviewers,
+    'requested_reviewers': resolutions.get_requested_reviewers,
+}
+
+
+Condition = namedtuple('Condition', ['key', 'predicate', 'fields'])
+
+Rule = namedtuple('Rule', ['name', 'conditions', 'recipients', 'messages'])
+
+
+def load_rules(filename):
+    """
+    Loads rules from a TOML or JSON file.
+
+    @param filename Path to the rules file (JSON if it ends in .json)
+    @return List of Rules
+    """
+    if filename.endswith('.json'):
+        with open(filename, 'r') as f:
+            data = json.load(f)
+    else:
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError('Reading TOML requires Python 3.11 or tomli, '
+                                 'use a .json rules file instead')
+
+        with open(filename, 'rb') as f:
+            try:
+                data = tomllib.load(f)
+            except tomllib.TOMLDecodeError as e:
+                raise ValueError('Invalid TOML: {}'.format(e))
+
+    return parse_rules(data.get('rules', []))
+
+
+def parse_rules(definitions):
+    """
+    Validates and compiles rule definitions.
+
+    @param definitions List of dictionaries, as read from a rules file
+    @return List of Rules
+    """
+    rules = []
+    for definition in definitions:
+        name = definition.get('name', None)
+        if not isinstance(name, str) or not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', name):
+            raise ValueError('Invalid rule name: {!r}'.format(name))
+        if name in [r.name for r in rules]:
+            raise ValueError('Duplicate rule: {}'.format(name))
+
+        conditions = [_parse_condition(name, c) for c in definition.get('when', [])]
+
+        recipient = definition.get('recipients', None)
+        if recipient is not None and recipient not in recipients:
+            raise ValueError('Unknown recipients in rule {}: {} (expected one of {})'.format(
+                name, recipient, ', '.join(sorted(recipients))))
+
+        messages = _parse_messages(name, definition.get('messages', []))
+
+        rules.append(Rule(name, conditions, recipient, messages))
+
+    return rules
+
+
+def _parse_messages(rule_name, definition):
+    if not isinstance(definition, list) or not all(isinstance(m, str) for m in definition):
+        raise ValueError('Invalid messages in rule {}: expected a list of strings'.format(
+            rule_name))
+
+    messages = []
+    for message in definition:
+        template = Template(message)
+        # Only $users is filled in when comments are generated
+        try:
+            template.substitute(users='')
+        except KeyError as e:
+            raise ValueError('Invalid message in rule {}: {!r} (unknown placeholder ${}, '
+                             'only $users is supported)'.format(rule_name, message, e.args[0]))
+        except ValueError as e:
+            raise ValueError('Invalid message in rule {}: {!r} ({})'.format(
+                rule_name, message, e))
+        messages.append(template)
+    return messages
+
+
+def _parse_condition(rule_name, definition):
+    params = dict(definition)
+    check = params.pop('check', None)
+    negate = params.pop('negate', False)
+
+    if check not in checks:
+        raise ValueError('Unknown check in rule {}: {} (expected one of {})'.format(
+            rule_name, check, ', '.join(sorted(checks))))
+
+    fields, factory = checks[check]
+    try:
+        predicate = factory(**params)
+    except TypeError:
+        raise ValueError('Invalid parameters for check {} in rule {}: {}'.format(
+            check, rule_name, ', '.join(sorted(params)) or 'none'))
+
+    if negate:
+        predicate = (lambda p: lambda f: not p(f))(predicate)
+
+    # Identical conditions in different rules are only evaluated once per PR
+    key = '{}{}({})'.format('not ' if negate else '', check,
+                            ', '.join('{}={!r}'.format(k, v) for k, v in sorted(params.items())))
+    return Condition(key, predicate, fields)
+
+
+def get_required_fields(rules):
+    """
+    Gets the pull request fields required to evaluate a set of rules (see
+    resolutions.get_required_fields for those needed to notify their
+    recipients).
+
+    @param rules List of Rules
+    @return Set of field names
+    """
+    fields = set()
+    for rule in rules:
+        for condition in rule.conditions:
+            fields |= condition.fields
+    return fields
+
+
+def build_resolutions(rules):
+    """
+    Builds the table of users to notify and messages for each rule (in the
+    form of resolutions.resolutions).
+
+    Rules without recipients or messages use those of the built in category of
+    the same name, or the generic ones.
+
+    @param rules List of Rules
+    @return Dictionary of problem type to (recipient function, message templates)
+    """
+    table = dict(resolutions.resolutions)
+    for rule in rules:
+        default = resolutions.resolutions.get(rule.name, resolutions.resolutions['generic'])
+        table[rule.name] = (
+            recipients[rule.recipients] if rule.recipients else default[0],
+            rule.messages or default[1])
+    return table
+
+
+class RulePipeline(object):
+    """
+    Evaluates rules against the features of each pull request.
+
+    Conditions shared between rules are evaluated at most once per pull
+    request and the conditions of each rule are evaluated in an order that
+    short circuits as early and cheaply as possible: by the measured cost of
+    each condition divided by the fraction of pull requests it rejects.
+
+    The cost and pass rate of conditions are measured on a sample of pull
+    requests (for which every condition is evaluated), the time spent
+    evaluating and hit rate of each rule on all of them.
+    """
+
+    def __init__(self, rules, sample_interval=16, reorder_interval=256):
+        """
+        @param rules List of Rules
+        @param sample_interval Every this many pull requests all conditions are
+                               evaluated and timed
+        @param reorder_interval Every this many pull requests the order in which
+                                conditions are evaluated is updated
+        """
+        self.rules = list(rules)
+        self.sample_interval = max(1, sample_interval)
+        self.reorder_interval = max(1, reorder_interval)
+
+        conditions = OrderedDict()
+        self._rule_conditions = []
+        for rule in self.rules:
+            indices = []
+            for c in rule.conditions:
+                if c.key not in conditions:
+                    conditions[c.key] = (len(conditions), c.predicate)
+                indices.append(conditions[c.key][0])
+            self._rule_conditions.append(indices)
+        self.condition_keys = list(conditions.keys())
+        self._predicates = [p for _, p in conditions.values()]
+
+        # Evaluation order of the conditions of each rule, initially as written
+        self._orders = [list(indices) for indices in self._rule_conditions]
+
+        self._lock = threading.Lock()
+        self.pull_requests = 0
+        self.condition_samples = [0] * len(self._predicates)
+        self.condition_passes = [0] * len(self._predicates)
+        self.condition_time = [0.0] * len(self._predicates)
+        self.rule_evaluations = [0] * len(self.rules)
+        self.rule_hits = [0] * len(self.rules)
+        self.rule_time = [0.0] * len(self.rules)
+
+    def classify(self, all_prs, stale_days_threshold, now=None):
+        """
+        Sorts pull requests into the problem category of each rule they match,
+        in a single pass (see classify.classify_prs).
+
+        @param all_prs Iterable of pull requests (or PullRequestRecords)
+        @param stale_days_threshold Number of days of inactivity after which a PR is "stale"
+        @param now UTC time to measure staleness from (defaults to now)
+        @return Classification of rule name to list of pull requests and PR
+                number to tuple of matched rule names
+        """
+        if now is None:
+            now = datetime.utcnow()
+
+        sorted_prs = OrderedDict((rule.name, []) for rule in self.rules)
+        matches = {}
+
+        stats = _PipelineStatistics(len(self._predicates), len(self.rules))
+        for pr in all_prs:
+            elapsed_days = elapsed_days_since_update(pr, now)
+            if not filtering.has_pr_not_been_updated_since(stale_days_threshold, elapsed_days):
+                matches[pr['number']] = ()
+                continue
+
+            matched = self._evaluate(extract_features_with_age(pr, elapsed_days), stats)
+            for name in matched:
+                sorted_prs[name].append(pr)
+            matches[pr['number']] = matched
+
+            if stats.pull_requests % self.reorder_interval == 0:
+                self._merge(stats)
+                stats = _PipelineStatistics(len(self._predicates), len(self.rules))
+
+        self._merge(stats)
+        return Classification(sorted_prs, matches)
+
+    def _evaluate(self, features, stats):
+        predicates = self._predicates
+        results = [None] * len(predicates)
+
+        # On sampled pull requests every condition is evaluated, so that pass
+        # rates are not biased by short circuiting
+        if (self.pull_requests + stats.pull_requests) % self.sample_interval == 0:
+            for i, predicate in enumerate(predicates):
+                start = time.perf_counter()
+                results[i] = bool(predicate(features))
+                stats.condition_time[i] += time.perf_counter() - start
+                stats.condition_samples[i] += 1
+                stats.condition_passes[i] += results[i]
+        stats.pull_requests += 1
+
+        matched = []
+        for r, order in enumerate(self._orders):
+            start = time.perf_counter()
+            hit = True
+            for i in order:
+                result = results[i]
+                if result is None:
+                    result = results[i] = bool(predicates[i](features))
+                if not result:
+                    hit = False
+                    break
+            stats.rule_time[r] += time.perf_counter() - start
+            stats.rule_evaluations[r] += 1
+            if hit:
+                stats.rule_hits[r] += 1
+                matched.append(self.rules[r].name)
+
+        return tuple(matched)
+
+    def _merge(self, stats):
+        with self._lock:
+            self.pull_requests += stats.pull_requests
+            for name in ('condition_samples', 'condition_passes', 'condition_time',
+                         'rule_evaluations', 'rule_hits', 'rule_time'):
+                totals = getattr(self, name)
+                for i, value in enumerate(getattr(stats, name)):
+                    totals[i] += value
+            self._reorder()
+
+    def _reorder(self):
+        def rank(i):
+            samples = self.condition_samples[i]
+            if samples == 0:
+                return 0.0
+            cost = self.condition_time[i] / samples
+            rejected = 1.0 - float(self.condition_passes[i]) / samples
+            return cost / rejected if rejected > 0 else float('inf')
+
+        # Python's sort is stable, so unmeasured conditions keep their order
+        self._orders = [sorted(indices, key=rank) for indices in self._rule_conditions]
+
+    def statistics(self):
+        """
+        @return List with, for each rule, an ordered dictionary of the number
+                of pull requests it was evaluated for, number that matched,
+                hit rate, seconds spent evaluating it and the order its
+                conditions are currently evaluated in
+        """
+        with self._lock:
+            return [OrderedDict([
+                ('name', rule.name),
+                ('evaluations', self.rule_evaluations[r]),
+                ('hits', self.rule_hits[r]),
+                ('hit_rate', float(self.rule_hits[r]) / self.rule_evaluations[r]
+                    if self.rule_evaluations[r] else 0.0),
+                ('seconds', self.rule_time[r]),
+                ('order', [self.condition_keys[i] for i in self._orders[r]]),
+            ]) for r, rule in enumerate(self.rules)]
+
+
+class _PipelineStatistics(object):
+
+    def __init__(self, conditions, rules):
+        self.pull_requests = 0
+        self.condition_samples = [0] * conditions
+        self.condition_passes = [0] * conditions
+        self.condition_time = [0.0] * conditions
+        self.rule_evaluations = [0] * rules
+        self.rule_hits = [0] * rules
+        self.rule_time = [0.0] * rules
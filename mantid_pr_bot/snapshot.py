@@ -0,0 +1,163 @@
+import mmap
+import os
+import struct
+import zlib
+
+from datetime import datetime
+
+from . import jsoncodec
+from .records import TIME_FORMAT
+
+
+# Snapshot file layout:
+#   - MAGIC
+#   - each pull request as zlib compressed JSON, one after the other
+#   - index as JSON (see write_snapshot)
+#   - footer: offset of the index (little endian unsigned 64 bit) and MAGIC
+MAGIC = b'MPRSNAP1'
+FOOTER = struct.Struct('<Q8s')
+
+FORMAT_VERSION = 1
+
+
+def write_snapshot(filename, pull_requests, repository, fields, taken_at=None,
+                   categories=None):
+    """
+    Writes pull requests to a snapshot file, replacing it atomically.
+
+    Each pull request is compressed separately, so any one of them can be read
+    back without decompressing the others.
+
+    @param filename Path to the snapshot file
+    @param pull_requests Iterable of pull requests (as returned by GitHubClient)
+    @param repository Repository the pull requests belong to ("owner/name")
+    @param fields Pull request fields that were fetched (see github.PULL_REQUEST_FIELDS)
+    @param taken_at UTC datetime the pull requests were fetched (defaults to now)
+    @param categories Dictionary of problem type to list of pull requests, to
+                      record the classification made when the snapshot was taken
+    @return Number of pull requests written
+    """
+    if taken_at is None:
+        taken_at = datetime.utcnow()
+
+    index = []
+    tmp_filename = '{}.tmp'.format(filename)
+    with open(tmp_filename, 'wb') as f:
+        f.write(MAGIC)
+        for pr in pull_requests:
+            data = zlib.compress(jsoncodec.dumps(pr))
+            index.append((pr['number'], f.tell(), len(data)))
+            f.write(data)
+
+        index_offset = f.tell()
+        f.write(jsoncodec.dumps({
+            'version': FORMAT_VERSION,
+            'repository': repository,
+            'fields': sorted(fields),
+            'taken_at': taken_at.strftime(TIME_FORMAT),
+            'categories': dict((name, [pr['number'] for pr in prs])
+                               for name, prs in (categories or {}).items()),
+            'index': index,
+        }))
+        f.write(FOOTER.pack(index_offset, MAGIC))
+    os.replace(tmp_filename, filename)
+
+    return len(index)
+
+
+def is_snapshot(filename):
+    """
+    Returns true if a file starts like a snapshot file.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+class Snapshot(object):
+    """
+    Read only, memory mapped view of a snapshot file (see write_snapshot).
+
+    Only the index is parsed when a snapshot is opened, pull requests are
+    decompressed and parsed as they are accessed.
+    """
+
+    def __init__(self, filename):
+        """
+        @param filename Path to the snapshot file
+        """
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if len(self._map) < len(MAGIC) + FOOTER.size or \
+                    self._map[:len(MAGIC)] != MAGIC:
+                raise ValueError('{} is not a snapshot file'.format(filename))
+
+            index_offset, magic = FOOTER.unpack(self._map[-FOOTER.size:])
+            if magic != MAGIC:
+                raise ValueError('Snapshot {} is truncated'.format(filename))
+
+            header = jsoncodec.loads(self._map[index_offset:-FOOTER.size])
+            if header.get('version') != FORMAT_VERSION:
+                raise ValueError('Snapshot {} has an unsupported version'.format(filename))
+        except Exception:
+            self._map.close()
+            raise
+
+        self.repository = header['repository']
+        self.fields = set(header['fields'])
+        self.taken_at = datetime.strptime(header['taken_at'], TIME_FORMAT)
+        self.categories = header['categories']
+
+        self.numbers = [number for number, _, _ in header['index']]
+        self._index = dict((number, (offset, length))
+                           for number, offset, length in header['index'])
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __contains__(self, number):
+        return number in self._index
+
+    def __iter__(self):
+        """
+        Iterates over all pull requests, in the order they were written.
+        """
+        for number in self.numbers:
+            yield self.get(number)
+
+    def get(self, number):
+        """
+        Reads a single pull request.
+
+        @param number Pull request number
+        @return Pull request (None if it is not in the snapshot)
+        """
+        if number not in self._index:
+            return None
+
+        offset, length = self._index[number]
+        return jsoncodec.loads(zlib.decompress(self._map[offset:offset + length]))
+
+    def category(self, name):
+        """
+        Reads the pull requests that were in a problem category when the
+        snapshot was taken.
+
+        @param name Problem type
+        @return List of pull requests
+        """
+        return [self.get(number) for number in self.categories.get(name, [])]
@@ -0,0 +1,155 @@
+import requests
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+from .github import GitHubClient, build_multi_repository_query
+from .ratelimit import TokenPool
+from .workflow import filter_prs
+
+
+def parse_repositories(names, default_owner):
+    """
+    Parses a list of repository names.
+
+    Names may either be "owner/name" or just "name", in which case the default
+    owner is used. Empty names and those starting with # are ignored.
+
+    @param names Iterable of repository names
+    @param default_owner Owner of repositories given without one
+    @return List of (owner, name) tuples
+    """
+    repositories = []
+    for name in names:
+        name = name.strip()
+        if not name or name.startswith('#'):
+            continue
+
+        if '/' in name:
+            owner, name = name.split('/', 1)
+        else:
+            owner = default_owner
+
+        if (owner, name) not in repositories:
+            repositories.append((owner, name))
+
+    return repositories
+
+
+def fetch_first_pages(client, repositories):
+    """
+    Fetches the first page of open pull requests of several repositories in a
+    single aliased query.
+
+    @param client GitHubClient used to send the query
+    @param repositories List of (owner, name) tuples
+    @return Dictionary of (owner, name) to (list of pull requests, cursor of the
+            next page or None if there are no more pages)
+    """
+    query = build_multi_repository_query(len(repositories), client.fields)
+
+    variables = {'page_size': client.page_size}
+    for i, (owner, name) in enumerate(repositories):
+        variables['owner{}'.format(i)] = owner
+        variables['name{}'.format(i)] = name
+
+    data = client.send_query(query, variables)
+
+    pages = {}
+    for i, repository in enumerate(repositories):
+        result = (data.get('data', None) or {}).get('r{}'.format(i), None)
+        if result is None:
+            # Leave repositories that failed (e.g. do not exist) to be fetched
+            # individually, so the error is reported against them
+            continue
+
+        page = result['pullRequests']
+        cursor = page['pageInfo']['endCursor'] if page['pageInfo']['hasNextPage'] else None
+        pages[repository] = (page['nodes'], cursor)
+
+    client.complete_pull_requests([pr for nodes, _ in pages.values() for pr in nodes])
+    return pages
+
+
+def sweep_repositories(access_token, repositories, stale_days_threshold,
+                       enabled_categories=None, fields=None, transport=None, workers=4,
+                       alias_batch_size=0, endpoint=None, pipeline=None, tokens=None,
+                       response_cache=None):
+    """
+    Fetches and classifies the pull requests of several repositories
+    concurrently.
+
+    All repositories share a single connection pool and pool of tokens (so
+    rate limit budgets). The first page of small repositories can optionally be
+    fetched in batches, several repositories per query.
+
+    @param access_token GitHub access token
+    @param repositories List of (owner, name) tuples
+    @param stale_days_threshold Number of days of inactivity after which a PR is "stale"
+    @param enabled_categories Names of the categories to evaluate (defaults to all)
+    @param fields Pull request fields to fetch (defaults to all)
+    @param transport Transport shared by all repositories
+    @param workers Number of repositories to fetch concurrently
+    @param alias_batch_size Number of repositories per batched first page
+                            query (0 or 1 to disable batching)
+    @param endpoint GitHub GraphQL API endpoint (defaults to api.github.com)
+    @param pipeline RulePipeline to classify with instead of the built in
+                    categories (enabled_categories is then ignored)
+    @param tokens TokenPool shared by all repositories (queries are spread
+                  over its tokens as well as access_token, defaults to a pool
+                  of access_token alone)
+    @param response_cache Cache of replies shared by all repositories (see
+                          cache.ResponseCache)
+    @return Ordered dictionary of (owner, name) to (dictionary of problem type
+            to list of pull requests, error message or None)
+    """
+    if tokens is None:
+        tokens = TokenPool()
+
+    def make_client(owner=None, name=None):
+        return GitHubClient(access_token, owner, name, transport=transport, fields=fields,
+                            endpoint=endpoint, tokens=tokens, response_cache=response_cache)
+
+    first_pages = {}
+    if alias_batch_size > 1:
+        client = make_client()
+        for i in range(0, len(repositories), alias_batch_size):
+            first_pages.update(
+                fetch_first_pages(client, repositories[i:i + alias_batch_size]))
+
+    def sweep(repository):
+        client = make_client(*repository)
+
+        if repository in first_pages:
+            nodes, cursor = first_pages[repository]
+            prs = nodes
+            if cursor is not None:
+                prs = chain(nodes, client.iter_pull_requests(cursor=cursor))
+        else:
+            prs = client.iter_pull_requests()
+
+        try:
+            if pipeline is not None:
+                return pipeline.classify(prs, stale_days_threshold).categories, None
+            return filter_prs(prs, stale_days_threshold, enabled_categories), None
+        except (RuntimeError, KeyError, TypeError, requests.RequestException) as e:
+            return {}, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = executor.map(sweep, repositories)
+        return OrderedDict(zip(repositories, results))
+
+
+def merge_sweep_results(results):
+    """
+    Combines the classified pull requests of several repositories.
+
+    @param results Result of sweep_repositories
+    @return Dictionary of problem type to list of pull requests (of all repositories)
+    """
+    combined = OrderedDict()
+    for filtered_prs, _ in results.values():
+        for name, prs in filtered_prs.items():
+            combined.setdefault(name, []).extend(prs)
+    return combined
@@ -0,0 +1,171 @@
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class Transport(object):
+    """
+    Pooled, keep-alive HTTP transport used to communicate with the GitHub API.
+
+    A single requests.Session is shared by every request so that TCP and TLS
+    connections are reused between page fetches and mutations.
+    """
+
+    # Server side errors that are generally transient
+    retry_statuses = (500, 502, 503, 504)
+
+    def __init__(self, connect_timeout=5.0, read_timeout=60.0, max_retries=3,
+                 backoff=1.0, pool_size=10, metrics=None):
+        """
+        @param connect_timeout Seconds to wait for a connection to be established
+        @param read_timeout Seconds to wait between bytes of the response
+        @param max_retries Maximum number of times a request is retried
+        @param backoff Base delay (in seconds) of the exponential backoff
+        @param pool_size Maximum number of pooled connections per host
+        @param metrics Metrics in which to count requests, bytes and retries (optional)
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.metrics = metrics
+        if metrics is not None:
+            # Always export every counter, even if nothing was counted
+            for name in ('http_requests', 'http_bytes_sent', 'http_bytes_received',
+                         'http_retries'):
+                metrics.increment(name, 0)
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+
+        # Retries are handled here rather than by urllib3 so that abuse limit
+        # responses and non-idempotent requests can be treated separately
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self):
+        """
+        Closes all pooled connections.
+        """
+        self.session.close()
+
+    def post(self, url, data, headers=None, idempotent=True, stream=False):
+        """
+        Sends a POST request, retrying transient failures.
+
+        Requests that are not idempotent (i.e. mutations) are only retried
+        when it is known that the server did not act on them: failure to
+        connect and abuse/secondary rate limit responses.
+
+        @param url URL to send the request to
+        @param data Request body
+        @param headers Additional request headers
+        @param idempotent If the request is safe to repeat after a server error
+        @param stream If the response body should be left unread, to be read
+                      from response.raw
+        @return Response
+        """
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = self.session.post(url, data=data, headers=headers,
+                                             timeout=self.timeout, stream=stream)
+            except requests.ConnectTimeout:
+                if attempt >= self.max_retries:
+                    raise
+            except (requests.ConnectionError, requests.Timeout):
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+            else:
+                self._record(data, response, stream)
+                if attempt >= self.max_retries or \
+                        not self.should_retry(response, idempotent):
+                    if stream:
+                        # Let the caller decode the body as it is read
+                        response.raw.decode_content = True
+                    return response
+                response.close()
+
+            if self.metrics is not None:
+                self.metrics.increment('http_retries')
+
+            time.sleep(self.retry_delay(attempt, response))
+            attempt += 1
+
+    def _record(self, data, response, stream=False):
+        if self.metrics is None:
+            return
+
+        self.metrics.increment('http_requests')
+        self.metrics.increment('http_bytes_sent',
+                               len(data.encode('utf-8') if isinstance(data, str) else data))
+
+        # Prefer the size on the wire (i.e. compressed) when it is known, the
+        # body of a streamed response must not be read here (see
+        # record_streamed)
+        received = response.headers.get('Content-Length', None)
+        if received:
+            self.metrics.increment('http_bytes_received', int(received))
+        elif not stream:
+            self.metrics.increment('http_bytes_received', len(response.content))
+
+    def record_streamed(self, response):
+        """
+        Counts the bytes received of a streamed response whose size was not
+        known when it was returned by post (i.e. a chunked reply), once its
+        body has been read and before it is closed.
+
+        @param response Response returned by post with stream=True
+        """
+        if self.metrics is None or response.headers.get('Content-Length', None):
+            return
+
+        # Bytes read from the wire, before they were decompressed
+        self.metrics.increment('http_bytes_received', response.raw.tell())
+
+    def should_retry(self, response, idempotent=True):
+        """
+        Returns true if a response indicates a failure that may succeed if the
+        request is sent again.
+        """
+        if is_abuse_limit_response(response):
+            return True
+        return idempotent and response.status_code in self.retry_statuses
+
+    def retry_delay(self, attempt, response=None):
+        """
+        Gets the number of seconds to wait before retrying a request.
+
+        The Retry-After header is honoured when present, otherwise exponential
+        backoff with full jitter is used.
+        """
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+
+def is_abuse_limit_response(response):
+    """
+    Returns true if a response was rejected by GitHub's abuse detection or
+    secondary rate limits.
+    """
+    if response.status_code == 429:
+        return True
+
+    if response.status_code == 403:
+        if 'Retry-After' in response.headers:
+            return True
+        text = response.text.lower()
+        return 'abuse' in text or 'secondary rate limit' in text
+
+    return False
@@ -1,9 +1,8 @@
-from itertools import filterfalse
+from functools import partial
 
+from .classify import classify_prs
 from .filtering import (
-        filter_to_stale_prs,
-        filter_to_ci_pass,
-        filter_to_ci_fail,
+        was_ci_status_of_last_pr,
         is_author_of_last_commit_no_longer_a_mantid_dev,
         does_this_pr_have_merge_conflicts,
         has_noone_reviewed_this_pr,
@@ -13,49 +12,86 @@ from .filtering import (
         has_the_author_not_responded_to_review_comments)
 
 
-def filter_prs(all_prs, stale_days_threshold):
+def _when_ci_passes(predicate):
+    return lambda f: was_ci_status_of_last_pr('SUCCESS', f) & predicate(f)
+
+
+# Problem categories, in the order they are reported. Each is a predicate from
+# filtering.py over the PullRequestFeatures of a stale pull request (see
+# classify.py), or over those of a columnar.FeatureTable.
+categories = [
+    ('no_dev', is_author_of_last_commit_no_longer_a_mantid_dev),
+    ('conflicting', does_this_pr_have_merge_conflicts),
+    ('failing', partial(was_ci_status_of_last_pr, 'FAILURE')),
+    ('unreviewed', _when_ci_passes(has_noone_reviewed_this_pr)),
+    ('pending_review', _when_ci_passes(has_a_reviewer_not_reviewed_this_pr)),
+    ('pending_gatekeeper', _when_ci_passes(has_a_gatekeeper_not_reviewed_this_accepted_pr)),
+    ('review_requested', _when_ci_passes(has_a_requested_reviewer_not_reviewed_this_pr)),
+    ('ignored_review', _when_ci_passes(has_the_author_not_responded_to_review_comments)),
+]
+
+# Pull request fields (see github.PULL_REQUEST_FIELDS) needed to evaluate each
+# problem category
+category_fields = {
+    'no_dev': {'commits'},
+    'conflicting': {'mergeable'},
+    'failing': {'commits'},
+    'unreviewed': {'commits', 'reviews', 'reviewRequests'},
+    'pending_review': {'commits', 'reviews'},
+    'pending_gatekeeper': {'commits', 'reviews', 'reviewRequests'},
+    'review_requested': {'commits', 'reviewRequests'},
+    'ignored_review': {'commits', 'reviews'},
+}
+
+
+def get_required_fields(category_names):
     """
-    Sorts/filters pull requests into several "problem categories".
-
-    This function is generally where the modification to select the exact pull
-    request desired for each problem category should be done.
-
-    Any new problem categories added need to be added to resolutions.py,
-    otherwise the admins will always be the ones to be notified with a very
-    generic message.
+    Gets the pull request fields required to evaluate a set of categories.
 
-    @param all_prs List of all pull requests retrieved from GitHub API
-    @param stale_days_threshold Number of days of inactivity after which a PR is "stale"
-    @return Dictionary of problem type to list of affected pull requests
+    @param category_names Names of the enabled categories
+    @return Set of field names
     """
+    return set().union(*[category_fields[name] for name in category_names])
 
-    prs = {}
-
-    stale_prs = list(filter_to_stale_prs(stale_days_threshold, all_prs))
 
-    prs['no_dev'] = list(filter(
-        is_author_of_last_commit_no_longer_a_mantid_dev, stale_prs))
-
-    prs['conflicting'] = list(filter(
-        does_this_pr_have_merge_conflicts, stale_prs))
+def classify_stale_prs(all_prs, stale_days_threshold, enabled_categories=None, now=None):
+    """
+    Sorts pull requests into "problem categories", also recording which
+    categories each pull request matched.
 
-    prs['failing'] = list(filter_to_ci_fail(stale_prs))
+    @param all_prs Iterable of all pull requests retrieved from GitHub API
+    @param stale_days_threshold Number of days of inactivity after which a PR is "stale"
+    @param enabled_categories Names of the categories to evaluate (defaults to all)
+    @param now Time to measure staleness from (defaults to now)
+    @return Classification (categories and per PR matches)
+    """
+    active = categories
+    if enabled_categories is not None:
+        active = [c for c in categories if c[0] in enabled_categories]
 
-    stale_passing_prs = list(filter_to_ci_pass(stale_prs))
+    return classify_prs(all_prs, active, stale_days_threshold, now)
 
-    prs['unreviewed'] = list(filter(
-        has_noone_reviewed_this_pr, stale_passing_prs))
 
-    prs['pending_review'] = list(filter(
-        has_a_reviewer_not_reviewed_this_pr, stale_passing_prs))
+def filter_prs(all_prs, stale_days_threshold, enabled_categories=None, now=None):
+    """
+    Sorts/filters pull requests into several "problem categories".
 
-    prs['pending_gatekeeper'] = list(filter(
-        has_a_gatekeeper_not_reviewed_this_accepted_pr, stale_passing_prs))
+    The categories list above is generally where the modification to select
+    the exact pull request desired for each problem category should be done.
 
-    prs['review_requested'] = list(filter(
-        has_a_requested_reviewer_not_reviewed_this_pr, stale_passing_prs))
+    Any new problem categories added need to be added to resolutions.py,
+    otherwise the admins will always be the ones to be notified with a very
+    generic message.
 
-    prs['ignored_review'] = list(filter(
-        has_the_author_not_responded_to_review_comments, stale_passing_prs))
+    Pull requests are consumed in a single pass, so all_prs may equally be a
+    stream of pull requests as they are retrieved (see
+    GitHubClient.iter_pull_requests), only stale pull requests are retained.
 
-    return prs
+    @param all_prs Iterable of all pull requests retrieved from GitHub API
+    @param stale_days_threshold Number of days of inactivity after which a PR is "stale"
+    @param enabled_categories Names of the categories to evaluate (defaults to all)
+    @param now Time to measure staleness from (defaults to now)
+    @return Dictionary of problem type to list of affected pull requests
+    """
+    return classify_stale_prs(all_prs, stale_days_threshold, enabled_categories,
+                              now).categories
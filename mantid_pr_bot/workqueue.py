@@ -0,0 +1,427 @@
+import json
+import sqlite3
+import threading
+import time
+
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+
+import click
+import requests
+
+from .resolutions import generate_resolution_comments
+from .workflow import filter_prs
+
+
+Task = namedtuple('Task', ['id', 'run', 'payload', 'attempts'])
+
+# States a task goes through, a failed attempt returning it to pending until
+# it has been attempted max_attempts times
+TASK_STATES = ('pending', 'leased', 'done', 'failed')
+
+
+class LeaseLost(RuntimeError):
+    """
+    Raised when a worker no longer holds the lease of the task it is working on
+    (i.e. the lease expired and the task may have been claimed by another).
+    """
+    pass
+
+
+class WorkQueue(object):
+    """
+    SQLite backed queue of tasks shared by worker processes.
+
+    Tasks belong to a run and are claimed by workers with a lease, which the
+    worker renews while it works on the task. A task whose lease expires (i.e.
+    its worker crashed or hung) is claimed again by another worker, until it
+    has been attempted max_attempts times.
+
+    The database can be shared by processes on one machine (or a file system
+    with working locks), each opening its own WorkQueue.
+    """
+
+    def __init__(self, filename, lease_seconds=300.0, max_attempts=3):
+        """
+        @param filename Path to the SQLite database
+        @param lease_seconds Seconds a claimed task is held for without renewal
+        @param max_attempts Number of times a task is attempted before it is
+                            given up on
+        """
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self._lock = threading.Lock()
+        # Transactions are begun explicitly, so claims are atomic between processes
+        self._db = sqlite3.connect(filename, timeout=30.0, isolation_level=None,
+                                   check_same_thread=False)
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+        with self._transaction() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS tasks ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'run TEXT NOT NULL, '
+                'payload TEXT NOT NULL, '
+                'state TEXT NOT NULL, '
+                'attempts INTEGER NOT NULL DEFAULT 0, '
+                'worker TEXT, '
+                'lease_expires REAL, '
+                'result TEXT, '
+                'error TEXT, '
+                'UNIQUE (run, payload))')
+            db.execute('CREATE INDEX IF NOT EXISTS tasks_run_state ON tasks (run, state)')
+
+    def close(self):
+        self._db.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def enqueue(self, run, payloads):
+        """
+        Adds tasks to a run.
+
+        Tasks already in the run (with an identical payload) are not added
+        again, so a run can safely be enqueued more than once.
+
+        @param run Name of the run
+        @param payloads Iterable of JSON serialisable task descriptions
+        @return Number of tasks added
+        """
+        rows = [(run, json.dumps(p, sort_keys=True)) for p in payloads]
+        added = 0
+        with self._transaction() as db:
+            for row in rows:
+                added += db.execute(
+                    "INSERT OR IGNORE INTO tasks (run, payload, state) VALUES (?, ?, 'pending')",
+                    row).rowcount
+        return added
+
+    def claim(self, run, worker):
+        """
+        Claims the next task of a run that is pending or whose lease expired.
+
+        @param run Name of the run
+        @param worker Name of the claiming worker
+        @return Task (None if there is no task to claim)
+        """
+        now = time.time()
+        with self._transaction() as db:
+            # Tasks whose lease expired on their last attempt are given up on
+            db.execute(
+                "UPDATE tasks SET state = 'failed', worker = NULL, error = ? "
+                "WHERE run = ? AND state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                ('Lease expired', run, now, self.max_attempts))
+
+            row = db.execute(
+                "SELECT id, payload, attempts FROM tasks WHERE run = ? AND "
+                "(state = 'pending' OR (state = 'leased' AND lease_expires < ?)) "
+                "ORDER BY id LIMIT 1", (run, now)).fetchone()
+            if row is None:
+                return None
+
+            db.execute(
+                "UPDATE tasks SET state = 'leased', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (worker, now + self.lease_seconds, row[0]))
+
+        return Task(row[0], run, json.loads(row[1]), row[2] + 1)
+
+    def renew(self, task, worker):
+        """
+        Extends the lease of a task.
+
+        @param task Task claimed by the worker
+        @param worker Name of the worker
+        @return True if the worker still held the lease
+        """
+        with self._transaction() as db:
+            return db.execute(
+                "UPDATE tasks SET lease_expires = ? "
+                "WHERE id = ? AND worker = ? AND state = 'leased'",
+                (time.time() + self.lease_seconds, task.id, worker)).rowcount == 1
+
+    def complete(self, task, worker, result=None):
+        """
+        Marks a task as done.
+
+        @param task Task claimed by the worker
+        @param worker Name of the worker
+        @param result JSON serialisable result of the task
+        @return True if the worker still held the lease
+        """
+        with self._transaction() as db:
+            return db.execute(
+                "UPDATE tasks SET state = 'done', lease_expires = NULL, result = ?, "
+                "error = NULL WHERE id = ? AND worker = ? AND state = 'leased'",
+                (json.dumps(result), task.id, worker)).rowcount == 1
+
+    def fail(self, task, worker, error):
+        """
+        Records a failed attempt at a task, returning it to the queue unless
+        it has been attempted max_attempts times.
+
+        @param task Task claimed by the worker
+        @param worker Name of the worker
+        @param error Error message
+        @return True if the worker still held the lease
+        """
+        with self._transaction() as db:
+            return db.execute(
+                "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' "
+                "ELSE 'pending' END, worker = NULL, lease_expires = NULL, error = ? "
+                "WHERE id = ? AND worker = ? AND state = 'leased'",
+                (self.max_attempts, error, task.id, worker)).rowcount == 1
+
+    def status(self, run):
+        """
+        @param run Name of the run
+        @return Ordered dictionary of task state to number of tasks of the run
+        """
+        with self._lock:
+            counts = dict(self._db.execute(
+                'SELECT state, COUNT(*) FROM tasks WHERE run = ? GROUP BY state', (run,)))
+        return OrderedDict((state, counts.get(state, 0)) for state in TASK_STATES)
+
+    def results(self, run):
+        """
+        @param run Name of the run
+        @return List of (payload, state, attempts, result, error) tuples for
+                every task of the run, in the order they were enqueued
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT payload, state, attempts, result, error FROM tasks '
+                'WHERE run = ? ORDER BY id', (run,)).fetchall()
+        return [(json.loads(payload), state, attempts,
+                 json.loads(result) if result is not None else None, error)
+                for payload, state, attempts, result, error in rows]
+
+
+class Lease(object):
+    """
+    Keeps the lease of a claimed task from expiring, by renewing it from a
+    background thread.
+    """
+
+    def __init__(self, queue, task, worker):
+        self.queue = queue
+        self.task = task
+        self.worker = worker
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _renew(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3.0):
+            if not self.queue.renew(self.task, self.worker):
+                self.lost = True
+                return
+
+    def check(self):
+        """
+        Raises LeaseLost if the lease of the task has been lost.
+        """
+        if self.lost:
+            raise LeaseLost('Lease of task {} was lost'.format(self.task.id))
+
+    def release(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def describe_task(payload):
+    """
+    Gets a short description of a task created by plan_tasks.
+    """
+    description = '{}/{}'.format(payload['owner'], payload['name'])
+    if payload.get('created', None):
+        description += ' (created {}..{})'.format(*[t if t is not None else '*'
+                                                    for t in payload['created']])
+    return description
+
+
+def plan_tasks(repositories, shard_size=0, make_client=None):
+    """
+    Splits the work of a run into tasks.
+
+    @param repositories List of (owner, name) tuples
+    @param shard_size Number of open pull requests each task is sized for, the
+                      pull requests of a repository being split by creation
+                      time (see GitHubClient.plan_creation_shards), 0 for one
+                      task per repository
+    @param make_client Function creating a GitHubClient given an owner and
+                       name (only needed to shard repositories)
+    @return List of task payloads
+    """
+    tasks = []
+    for owner, name in repositories:
+        if shard_size > 0:
+            for first, last in make_client(owner, name).plan_creation_shards(shard_size):
+                tasks.append({'owner': owner, 'name': name, 'created': [first, last]})
+        else:
+            tasks.append({'owner': owner, 'name': name})
+    return tasks
+
+
+class TaskProcessor(object):
+    """
+    Processes the tasks of a run (see plan_tasks): fetches and classifies the
+    pull requests of each and, if commenting, posts the comments that are not
+    in their cooldown period.
+
+    Comments are recorded in the ledger as they are posted, so a task retried
+    after its worker crashed does not post them again. Comments a crashed
+    worker posted but did not get to record are found from the pull requests'
+    own comments (see CommentLedger.rebuild).
+    """
+
+    def __init__(self, make_client, stale_days, categories=None, pipeline=None,
+                 do_commenting=False, ledger=None, username=None, resolution_table=None,
+                 cooldowns=None, rate_limiter=None, post_workers=1, post_batch_size=1):
+        """
+        @param make_client Function creating a GitHubClient given an owner, a
+                           name and extra pull request fields to fetch
+        @param stale_days Number of days of inactivity after which a PR is "stale"
+        @param categories Names of the categories to evaluate (defaults to all)
+        @param pipeline RulePipeline to classify with instead of the built in
+                        categories
+        @param do_commenting If comments should be posted
+        @param ledger CommentLedger of posted comments (needed to comment)
+        @param username Login of the bot, whose comments are looked for on retries
+        @param resolution_table Users to notify and messages for each problem
+                                type (defaults to resolutions.resolutions)
+        @param cooldowns Dictionary of problem type to cooldown in days (see
+                         CommentLedger.filter_comments)
+        @param rate_limiter RateLimiter shared by all comments posted
+        @param post_workers Number of comment requests to send concurrently
+        @param post_batch_size Number of comments posted in a single request
+        """
+        self.make_client = make_client
+        self.stale_days = stale_days
+        self.categories = categories
+        self.pipeline = pipeline
+        self.do_commenting = do_commenting
+        self.ledger = ledger
+        self.username = username
+        self.resolution_table = resolution_table
+        self.cooldowns = cooldowns if cooldowns is not None else {}
+        self.rate_limiter = rate_limiter
+        self.post_workers = post_workers
+        self.post_batch_size = post_batch_size
+
+    def process(self, task, lease):
+        """
+        Processes a task.
+
+        @param task Task claimed by the worker
+        @param lease Lease of the task, checked before each chunk of comments
+                     is posted
+        @return Dictionary of the number of pull requests in each category and
+                of comments posted, failed and suppressed
+        """
+        # A retried task may have posted comments it did not get to record in
+        # the ledger, these are found from the pull requests' own comments
+        # before any are posted again
+        retry = self.do_commenting and task.attempts > 1
+        client = self.make_client(task.payload['owner'], task.payload['name'],
+                                  ['comments'] if retry else [])
+
+        created = task.payload.get('created', None)
+        if created:
+            prs = client.fetch_pull_requests_created(*created)
+        else:
+            prs = client.iter_pull_requests()
+
+        if self.pipeline is not None:
+            task_prs = self.pipeline.classify(prs, self.stale_days).categories
+        else:
+            task_prs = filter_prs(prs, self.stale_days, self.categories)
+
+        result = {'categories': dict((name, len(prs)) for name, prs in task_prs.items()),
+                  'posted': 0, 'failed': 0}
+        if not self.do_commenting:
+            return result
+
+        # As in a single run, an empty ledger is also rebuilt
+        if 'comments' in client.fields:
+            self.ledger.rebuild({pr['id']: pr for prs in task_prs.values()
+                                 for pr in prs}.values(), self.username)
+
+        comments = generate_resolution_comments(task_prs, self.resolution_table)
+        comments, suppressed = self.ledger.filter_comments(comments, self.cooldowns)
+        result['suppressed'] = len(suppressed)
+
+        # Each chunk is recorded as soon as it is posted, and only posted while
+        # the task is still this worker's
+        chunk_size = max(1, self.post_batch_size * self.post_workers)
+        for i in range(0, len(comments), chunk_size):
+            lease.check()
+            chunk = comments[i:i + chunk_size]
+            results = client.post_comments_on_pull_requests(
+                    chunk, workers=self.post_workers, rate_limiter=self.rate_limiter,
+                    batch_size=self.post_batch_size)
+            self.ledger.record_results(chunk, results)
+            failures = len([r for r in results if not r[1]])
+            result['posted'] += len(results) - failures
+            result['failed'] += failures
+        return result
+
+
+def run_worker(queue, run, worker, process, poll_interval=5.0):
+    """
+    Claims and processes tasks of a run until none are left.
+
+    While tasks are leased to other workers, the worker waits for them to
+    finish rather than exiting, so that it can retry them should their worker
+    crash.
+
+    @param queue WorkQueue
+    @param run Name of the run
+    @param worker Name of this worker
+    @param process Function processing a task, given the Task and its Lease
+                   and returning a JSON serialisable result (e.g.
+                   TaskProcessor.process)
+    @param poll_interval Seconds to wait between checks for tasks to retry
+    @return Number of tasks completed and number failed by this worker
+    """
+    completed = 0
+    failed = 0
+    while True:
+        task = queue.claim(run, worker)
+        if task is None:
+            if queue.status(run)['leased'] == 0:
+                return completed, failed
+            time.sleep(poll_interval)
+            continue
+
+        click.echo('Task {}: {} (attempt {})'.format(
+            task.id, describe_task(task.payload), task.attempts))
+
+        lease = Lease(queue, task, worker)
+        try:
+            result = process(task, lease)
+        except LeaseLost as e:
+            # The task is no longer this worker's to complete or fail
+            click.echo('Task {} abandoned: {}'.format(task.id, e))
+            continue
+        except (RuntimeError, KeyError, TypeError, requests.RequestException) as e:
+            click.echo('Task {} failed: {}'.format(task.id, e))
+            queue.fail(task, worker, str(e))
+            failed += 1
+            continue
+        finally:
+            lease.release()
+
+        if queue.complete(task, worker, result):
+            completed += 1
@@ -6,14 +6,20 @@ setup(
     version='0.2.0',
     author='Dan Nixon',
     author_email='daniel.nixon@stfc.ac.uk',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     install_requires=[
         'Click>=5.0.0',
         'requests',
     ],
+    extras_require={
+        'fast_json': ['orjson', 'ijson>=3.1'],
+        'columnar': ['numpy'],
+    },
     entry_points='''
         [console_scripts]
         mantid_pr_bot=mantid_pr_bot.main:main
+        mantid_pr_bot_daemon=mantid_pr_bot.daemon:main
+        mantid_pr_bot_replay=mantid_pr_bot.replay:main
     ''',
     classifiers=[
         'Programming Language :: Python :: 3',
@@ -0,0 +1,71 @@
+"""
+Checks that classifying pull requests with a columnar.FeatureTable gives the
+same categories as classifying them one at a time, including pull requests
+with missing or empty commit data.
+"""
+
+import unittest
+
+from datetime import datetime
+
+from benchmarks.synthetic import generate_pull_requests
+from mantid_pr_bot import columnar
+from mantid_pr_bot.records import parse_pull_request
+
+
+NOW = datetime(2024, 6, 1)
+STALE_DAYS = 14
+
+
+def null_status(pr):
+    pr['commits']['nodes'][0]['commit']['status'] = None
+
+
+def no_commits(pr):
+    pr['commits']['nodes'] = []
+
+
+def null_commits(pr):
+    pr['commits'] = None
+
+
+def empty_author_login(pr):
+    pr['commits']['nodes'][0]['commit']['author']['user'] = {'login': ''}
+
+
+EDGE_CASES = [null_status, no_commits, null_commits, empty_author_login]
+
+
+def generate_edge_cases(count=2000):
+    prs = generate_pull_requests(count, seed=16, now=NOW)
+    # Leave some pull requests untouched between the edge cases
+    for i, pr in enumerate(prs[::2]):
+        EDGE_CASES[i % len(EDGE_CASES)](pr)
+    return prs
+
+
+@unittest.skipIf(columnar.np is None, 'NumPy is not installed')
+class CheckEquivalenceTest(unittest.TestCase):
+
+    def test_pull_requests(self):
+        prs = generate_edge_cases()
+        self.assertEqual(columnar.check_equivalence(prs, STALE_DAYS, now=NOW), [])
+
+    def test_records(self):
+        records = [parse_pull_request(pr) for pr in generate_edge_cases()]
+        self.assertEqual(columnar.check_equivalence(records, STALE_DAYS, now=NOW), [])
+
+    def test_edge_cases_are_classified(self):
+        prs = generate_edge_cases()
+        sorted_prs = columnar.filter_table(columnar.FeatureTable(prs), STALE_DAYS, now=NOW)
+        # Pull requests without commits have no developer
+        no_dev = set(pr['number'] for pr in sorted_prs['no_dev'])
+        self.assertTrue(no_dev)
+        self.assertTrue(any(not (pr['commits'] or {}).get('nodes') and pr['number'] in no_dev
+                            for pr in prs))
+        for name in ('failing', 'unreviewed', 'review_requested'):
+            self.assertTrue(sorted_prs[name], name)
+
+
+if __name__ == '__main__':
+    unittest.main()
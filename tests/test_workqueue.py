@@ -0,0 +1,112 @@
+"""
+Kills a worker part way through posting comments and checks that the run
+still posts every comment exactly once, against the mock GitHub API in
+benchmarks/mock_server.py.
+"""
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from collections import Counter
+
+from click.testing import CliRunner
+
+from benchmarks.mock_server import MockGitHub, MockGitHubServer
+from benchmarks.synthetic import generate_pull_requests
+from mantid_pr_bot.ledger import get_problem_type
+from mantid_pr_bot.main import main
+from mantid_pr_bot.workqueue import WorkQueue
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PULL_REQUESTS = 1000
+WORKERS = 2
+
+# Comments are posted slowly enough for a worker to be killed part way
+# through, without the default secondary rate limits slowing the test down
+POST_OPTIONS = ['--do-commenting', '--force', '--post-interval', '0.01',
+                '--post-per-minute', '100000', '--post-per-hour', '100000']
+
+
+def posted_comments(mock):
+    return Counter((pr_id, get_problem_type(message)) for pr_id, message in mock.comments)
+
+
+class WorkerCrashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_single(self):
+        mock = MockGitHub(generate_pull_requests(PULL_REQUESTS, 1))
+        with MockGitHubServer(mock) as server:
+            result = CliRunner().invoke(main, [
+                '--token', 'bot', '--endpoint', server.endpoint,
+                '--ledger', os.path.join(self.directory, 'single.db')] + POST_OPTIONS)
+        self.assertEqual(result.exit_code, 0, result.output)
+        return posted_comments(mock)
+
+    def test_killed_worker_does_not_duplicate_or_lose_comments(self):
+        expected = self.run_single()
+        self.assertTrue(expected)
+
+        queue_file = os.path.join(self.directory, 'queue.db')
+        mock = MockGitHub(generate_pull_requests(PULL_REQUESTS, 1))
+        with MockGitHubServer(mock) as server:
+            common = ['--token', 'bot', '--endpoint', server.endpoint,
+                      '--queue', queue_file, '--run-id', 'test']
+            result = CliRunner().invoke(main, common + ['--enqueue', '--shard-size', '200'])
+            self.assertEqual(result.exit_code, 0, result.output)
+
+            args = [sys.executable, '-m', 'mantid_pr_bot.main'] + common + [
+                '--work', '--ledger', os.path.join(self.directory, 'ledger.db'),
+                '--lease-seconds', '2'] + POST_OPTIONS
+            workers = [subprocess.Popen(args, cwd=ROOT, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, universal_newlines=True)
+                       for _ in range(WORKERS)]
+            try:
+                # Kill the first worker once every worker holds a task and
+                # comments are being posted
+                queue = WorkQueue(queue_file)
+                deadline = time.time() + 60
+                while queue.status('test')['leased'] < WORKERS or not mock.comments:
+                    self.assertLess(time.time(), deadline, 'No comments were posted')
+                    time.sleep(0.01)
+                workers[0].send_signal(signal.SIGKILL)
+                posted_before_kill = len(mock.comments)
+
+                outputs = [w.communicate(timeout=120)[0] for w in workers[1:]]
+            finally:
+                for w in workers:
+                    if w.poll() is None:
+                        w.kill()
+                        w.wait()
+
+            status = queue.status('test')
+            attempts = [a for _, _, a, _, _ in queue.results('test')]
+            queue.close()
+
+        self.assertLess(posted_before_kill, sum(expected.values()))
+        # The killed worker's task was retried by the other
+        self.assertGreater(max(attempts), 1)
+        self.assertEqual(status['pending'] + status['leased'] + status['failed'], 0,
+                         '\n'.join(outputs))
+
+        actual = posted_comments(mock)
+        self.assertEqual([c for c, n in actual.items() if n > 1], [])
+        self.assertEqual(set(actual), set(expected))
+        self.assertEqual(len(mock.comments), sum(expected.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()